@@ -1,10 +1,15 @@
 from flask import Flask, jsonify
+from flask.json.provider import DefaultJSONProvider
+from bson import ObjectId
 from flask_cors import CORS
 import os
 from dotenv import load_dotenv
 import bcrypt
 # Database connection
 from utils.db import db_instance
+from utils.metrics import init_metrics
+from utils.profiling import init_profiling
+from utils.logger import get_logger, init_request_logging
 
 # Route blueprints
 from routes.auth import auth_bp
@@ -12,16 +17,30 @@ from routes.admin import admin_bp
 from routes.doctor import doctor_bp
 from routes.patient import patient_bp
 from routes.ml import ml_bp  # ML prediction routes
+from routes.reports import reports_bp
+from routes.events import events_bp
 
 # User model
 from models.user import User
 
+logger = get_logger(__name__)
+
 # Load environment variables from .env
 load_dotenv()
 
+class MongoJSONProvider(DefaultJSONProvider):
+    """JSON provider that serializes MongoDB ObjectIds as strings"""
+
+    @staticmethod
+    def default(o):
+        if isinstance(o, ObjectId):
+            return str(o)
+        return DefaultJSONProvider.default(o)
+
 def create_app():
     """Create and configure Flask application"""
     app = Flask(__name__)
+    app.json = MongoJSONProvider(app)
 
     # Basic configuration
     app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'your-secret-key-change-in-production')
@@ -32,23 +51,26 @@ def create_app():
          origins=['http://localhost:3000', 'http://127.0.0.1:3000'],
          allow_headers=[
              'Content-Type', 'Authorization', 'Access-Control-Allow-Headers',
-             'Origin', 'Accept', 'X-Requested-With'
+             'Origin', 'Accept', 'X-Requested-With', 'X-Profile', 'X-Request-ID'
          ],
          methods=['GET', 'POST', 'PUT', 'DELETE', 'OPTIONS'],
          supports_credentials=True
     )
 
+    # Request id correlation for logs
+    init_request_logging(app)
+
     import time
     retries = 5
     for i in range(retries):
         if db_instance.connect():
-            print("✅ Database connected and ready")
+            logger.info("✅ Database connected and ready")
             break
         else:
-            print(f"❌ Database not ready, retrying {i+1}/{retries}...")
+            logger.warning("❌ Database not ready, retrying %d/%d...", i + 1, retries)
             time.sleep(2)
     else:
-        print("🚨 Failed to connect to database after retries")
+        logger.critical("🚨 Failed to connect to database after retries")
         return None
 
 
@@ -61,6 +83,14 @@ def create_app():
     app.register_blueprint(doctor_bp, url_prefix='/api/doctor')
     app.register_blueprint(patient_bp, url_prefix='/api/patient')
     app.register_blueprint(ml_bp, url_prefix='/api/ml')
+    app.register_blueprint(reports_bp, url_prefix='/api/reports')
+    app.register_blueprint(events_bp, url_prefix='/api/events')
+
+    # Request instrumentation and /api/metrics
+    init_metrics(app)
+
+    # Sampled / on-demand request profiling
+    init_profiling(app)
 
     # Health check endpoint
     @app.route('/api/health', methods=['GET'])
@@ -95,7 +125,7 @@ def create_default_admin():
         existing_admin = user_model.find_user_by_email(admin_email)
 
         if not existing_admin:
-            print("Creating default admin...")
+            logger.info("Creating default admin...")
 
             
 
@@ -110,13 +140,13 @@ def create_default_admin():
 
             admin_id = user_model.create_user(admin_data)
             if admin_id:
-                print(f"Default admin created: {admin_email} / admin@123" )
+                logger.info("Default admin created: %s / admin@123", admin_email)
             else:
-                print("Failed to create default admin")
+                logger.error("Failed to create default admin")
         else:
-            print("Admin user already exists")
+            logger.info("Admin user already exists")
     except Exception as e:
-        print(f"Error creating default admin: {e}")
+        logger.exception("Error creating default admin: %s", e)
 
 def create_sample_data():
     """Create sample doctor and patient for testing"""
@@ -141,7 +171,7 @@ def create_sample_data():
             doctor_id = user_model.create_user(doctor_data)
             if doctor_id:
                 user_model.approve_doctor(doctor_id)
-                print(f"Sample doctor created: {doctor_email} / doctor123")
+                logger.info("Sample doctor created: %s / doctor123", doctor_email)
 
         # Sample patient
         patient_email = 'patient@healthcare.com'
@@ -158,9 +188,9 @@ def create_sample_data():
             }
             patient_id = user_model.create_user(patient_data)
             if patient_id:
-                print(f"Sample patient created: {patient_email} / patient123")
+                logger.info("Sample patient created: %s / patient123", patient_email)
     except Exception as e:
-        print(f"Error creating sample data: {e}")
+        logger.exception("Error creating sample data: %s", e)
 
 if __name__ == '__main__':
     app = create_app()
@@ -168,16 +198,10 @@ if __name__ == '__main__':
         # Create sample data for testing
         create_sample_data()
 
-        print("\n" + "="*50)
-        print("Healthcare Brain Tumor Detection System API")
-        print("="*50)
-        print("API Server starting on http://localhost:5001")
-        print("\nDefault login credentials:")
-        print("Admin: admin1@healthcare.com / admin@123")
-        print("Doctor: doctor@healthcare.com / doctor123")
-        print("Patient: patient@healthcare.com / patient123")
-        print("="*50 + "\n")
+        logger.info("Healthcare Brain Tumor Detection System API starting on http://localhost:5001")
+        logger.info("Default login credentials - Admin: admin1@healthcare.com / admin@123, "
+                    "Doctor: doctor@healthcare.com / doctor123, Patient: patient@healthcare.com / patient123")
 
         app.run(host='0.0.0.0', port=5001, debug=True)
     else:
-        print("Failed to create application!")
+        logger.critical("Failed to create application!")
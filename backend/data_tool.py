@@ -0,0 +1,351 @@
+"""
+Bulk export/import of healthcare_system collections.
+
+    python data_tool.py export users --out users.ndjson.gz
+    python data_tool.py export appointments --format parquet --out appointments_parquet/
+    python data_tool.py import users users.ndjson.gz --batch-size 2000
+    python data_tool.py import appointments appointments_parquet/
+
+NDJSON uses MongoDB extended JSON, so ObjectId, datetime and binary fields
+round-trip exactly. Parquet writes one typed column per top-level field
+(ObjectIds as strings, datetimes as timestamps) and keeps anything that does
+not fit its column - nested documents, arrays, mixed types - as extended JSON
+in an `_extra` column.
+
+Both directions are resumable: progress is checkpointed next to the output
+(or input) after every batch, and a rerun continues from there. Imports use
+unordered insert_many and skip documents whose _id already exists.
+"""
+
+import argparse
+import glob
+import gzip
+import json
+import os
+import sys
+import time
+from datetime import datetime
+from bson import ObjectId, json_util
+from bson.binary import Binary
+from pymongo.errors import BulkWriteError
+from utils.db import Database
+
+JSON_OPTIONS = json_util.CANONICAL_JSON_OPTIONS
+PARQUET_PART_ROWS = 100000
+SCHEMA_SAMPLE_SIZE = 1000
+
+
+class Progress:
+    """Checkpoint file stored next to the data file"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path) as f:
+            return json_util.loads(f.read())
+
+    def save(self, state):
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write(json_util.dumps(state, json_options=JSON_OPTIONS))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class Throughput:
+    def __init__(self, label):
+        self.label = label
+        self.started = time.monotonic()
+        self.docs = 0
+        self.bytes = 0
+
+    def add(self, docs, num_bytes=0):
+        self.docs += docs
+        self.bytes += num_bytes
+        elapsed = max(time.monotonic() - self.started, 1e-6)
+        print(f"\r{self.label}: {self.docs:,} docs  {self.docs / elapsed:,.0f} docs/s  "
+              f"{self.bytes / elapsed / 1024 / 1024:.1f} MB/s", end='', flush=True)
+
+    def summary(self):
+        elapsed = max(time.monotonic() - self.started, 1e-6)
+        print(f"\n{self.label} finished: {self.docs:,} docs in {elapsed:.1f}s "
+              f"({self.docs / elapsed:,.0f} docs/s)")
+
+
+def _batched_cursor(collection, last_id, batch_size):
+    """Yield lists of documents in _id order after last_id"""
+    query = {'_id': {'$gt': last_id}} if last_id is not None else {}
+    cursor = collection.find(query).sort('_id', 1).batch_size(batch_size)
+    batch = []
+    for doc in cursor:
+        batch.append(doc)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+# --- NDJSON ---
+def export_ndjson(collection, out_path, batch_size):
+    """Each batch is written as its own gzip member, so the file can be truncated back to a checkpoint"""
+    progress = Progress(out_path + '.progress')
+    state = progress.load() or {'last_id': None, 'offset': 0, 'count': 0}
+    compress = out_path.endswith('.gz')
+    stats = Throughput(f"export {collection.name}")
+    stats.docs = state['count']
+
+    mode = 'r+b' if state['offset'] and os.path.exists(out_path) else 'wb'
+    with open(out_path, mode) as f:
+        f.truncate(state['offset'])
+        f.seek(state['offset'])
+        for batch in _batched_cursor(collection, state['last_id'], batch_size):
+            data = ''.join(json_util.dumps(doc, json_options=JSON_OPTIONS) + '\n' for doc in batch).encode('utf-8')
+            if compress:
+                data = gzip.compress(data)
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+
+            state = {'last_id': batch[-1]['_id'], 'offset': f.tell(), 'count': state['count'] + len(batch)}
+            progress.save(state)
+            stats.add(len(batch), len(data))
+    progress.clear()
+    stats.summary()
+
+
+def _read_ndjson(path, skip):
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', encoding='utf-8') as f:
+        for i, line in enumerate(f):
+            if i < skip or not line.strip():
+                continue
+            yield json_util.loads(line)
+
+
+# --- Parquet ---
+def _kind(value):
+    if isinstance(value, ObjectId):
+        return 'objectid'
+    if isinstance(value, datetime):
+        return 'datetime'
+    if isinstance(value, bool):
+        return 'bool'
+    if isinstance(value, int):
+        return 'int'
+    if isinstance(value, float):
+        return 'float'
+    if isinstance(value, str):
+        return 'string'
+    if isinstance(value, (bytes, Binary)):
+        return 'binary'
+    return 'json'
+
+
+def _infer_schema(collection):
+    """Column kind per field from a sample; conflicting fields fall back to extended JSON"""
+    kinds = {}
+    for doc in collection.find().sort('_id', 1).limit(SCHEMA_SAMPLE_SIZE):
+        for key, value in doc.items():
+            if value is None:
+                continue
+            kind = _kind(value)
+            if kinds.get(key, kind) != kind:
+                kind = 'float' if {kinds[key], kind} == {'int', 'float'} else 'json'
+            kinds[key] = kind
+    return kinds
+
+
+def _arrow_schema(kinds):
+    import pyarrow as pa
+
+    types = {
+        'objectid': pa.string(), 'datetime': pa.timestamp('ms'), 'bool': pa.bool_(), 'int': pa.int64(),
+        'float': pa.float64(), 'string': pa.string(), 'binary': pa.binary(), 'json': pa.string()
+    }
+    fields = [pa.field(key, types[kind]) for key, kind in kinds.items()]
+    fields.append(pa.field('_extra', pa.string()))
+    return pa.schema(fields, metadata={'bson_kinds': json.dumps(kinds)})
+
+
+def _to_columns(batch, kinds):
+    columns = {key: [] for key in kinds}
+    columns['_extra'] = []
+    for doc in batch:
+        extra = {}
+        for key, kind in kinds.items():
+            value = doc.get(key)
+            if value is not None and kind != 'json' and _kind(value) != kind and not (kind == 'float' and _kind(value) == 'int'):
+                extra[key] = value  # does not fit the column type
+                value = None
+            if value is not None:
+                if kind == 'objectid':
+                    value = str(value)
+                elif kind == 'json':
+                    value = json_util.dumps(value, json_options=JSON_OPTIONS)
+                elif kind == 'binary':
+                    value = bytes(value)
+            columns[key].append(value)
+        for key, value in doc.items():
+            if key not in kinds:
+                extra[key] = value
+        columns['_extra'].append(json_util.dumps(extra, json_options=JSON_OPTIONS) if extra else None)
+    return columns
+
+
+def export_parquet(collection, out_dir, batch_size):
+    """Write atomic part files of PARQUET_PART_ROWS rows; a rerun continues after the last complete part"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    os.makedirs(out_dir, exist_ok=True)
+    progress = Progress(os.path.join(out_dir, '_progress'))
+    state = progress.load() or {'last_id': None, 'part': 0, 'count': 0, 'kinds': _infer_schema(collection)}
+    kinds = state['kinds']
+    schema = _arrow_schema(kinds)
+    stats = Throughput(f"export {collection.name}")
+    stats.docs = state['count']
+
+    writer = None
+    part_rows = 0
+    part_path = None
+    last_id = state['last_id']
+    for batch in _batched_cursor(collection, state['last_id'], batch_size):
+        if writer is None:
+            part_path = os.path.join(out_dir, f"part-{state['part']:05d}.parquet")
+            writer = pq.ParquetWriter(part_path + '.tmp', schema, compression='zstd')
+        writer.write_table(pa.table(_to_columns(batch, kinds), schema=schema))
+        part_rows += len(batch)
+        last_id = batch[-1]['_id']
+        stats.add(len(batch))
+
+        if part_rows >= PARQUET_PART_ROWS:
+            writer.close()
+            os.replace(part_path + '.tmp', part_path)
+            state = {'last_id': last_id, 'part': state['part'] + 1, 'count': stats.docs, 'kinds': kinds}
+            progress.save(state)
+            writer, part_rows = None, 0
+    if writer is not None:
+        writer.close()
+        os.replace(part_path + '.tmp', part_path)
+    progress.clear()
+    stats.summary()
+
+
+def _from_row(row, kinds):
+    doc = {}
+    for key, kind in kinds.items():
+        value = row.get(key)
+        if value is None:
+            continue
+        if kind == 'objectid':
+            value = ObjectId(value)
+        elif kind == 'json':
+            value = json_util.loads(value)
+        elif kind == 'datetime' and hasattr(value, 'to_pydatetime'):
+            value = value.to_pydatetime()
+        doc[key] = value
+    if row.get('_extra'):
+        doc.update(json_util.loads(row['_extra']))
+    return doc
+
+
+def _read_parquet(in_dir, skip, batch_size):
+    import pyarrow.parquet as pq
+
+    seen = 0
+    for path in sorted(glob.glob(os.path.join(in_dir, 'part-*.parquet'))):
+        parquet_file = pq.ParquetFile(path)
+        kinds = json.loads(parquet_file.schema_arrow.metadata[b'bson_kinds'])
+        for record_batch in parquet_file.iter_batches(batch_size=batch_size):
+            rows = record_batch.to_pylist()
+            if seen + len(rows) <= skip:
+                seen += len(rows)
+                continue
+            for row in rows[max(skip - seen, 0):]:
+                yield _from_row(row, kinds)
+            seen += len(rows)
+
+
+# --- Import ---
+def import_docs(collection, docs, progress, batch_size, skip):
+    stats = Throughput(f"import {collection.name}")
+    stats.docs = skip
+    batch = []
+
+    def flush():
+        try:
+            collection.insert_many(batch, ordered=False)
+        except BulkWriteError as e:
+            # Duplicate _ids come from a previous partial run; anything else is a real error
+            errors = [err for err in e.details.get('writeErrors', []) if err.get('code') != 11000]
+            if errors:
+                raise
+        stats.add(len(batch))
+        progress.save({'done': stats.docs})
+
+    for doc in docs:
+        batch.append(doc)
+        if len(batch) >= batch_size:
+            flush()
+            batch = []
+    if batch:
+        flush()
+    progress.clear()
+    stats.summary()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk export/import for the healthcare_system database")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    export_parser = subparsers.add_parser('export', help="Export a collection")
+    export_parser.add_argument('collection')
+    export_parser.add_argument('--out', required=True, help="File for ndjson (.gz to compress), directory for parquet")
+    export_parser.add_argument('--format', choices=['ndjson', 'parquet'], default='ndjson')
+    export_parser.add_argument('--batch-size', type=int, default=1000)
+
+    import_parser = subparsers.add_parser('import', help="Import a file produced by export")
+    import_parser.add_argument('collection')
+    import_parser.add_argument('source', help="ndjson(.gz) file or parquet directory")
+    import_parser.add_argument('--batch-size', type=int, default=1000)
+    args = parser.parse_args(argv)
+
+    db = Database()
+    if not db.connect():
+        return 1
+    collection = db.get_collection(args.collection)
+
+    try:
+        if args.command == 'export':
+            if args.format == 'parquet':
+                export_parquet(collection, args.out, args.batch_size)
+            else:
+                export_ndjson(collection, args.out, args.batch_size)
+        else:
+            is_parquet = os.path.isdir(args.source)
+            progress_path = os.path.join(args.source, '_import_progress') if is_parquet else args.source + '.import-progress'
+            progress = Progress(progress_path)
+            skip = (progress.load() or {}).get('done', 0)
+            if skip:
+                print(f"Resuming import after {skip:,} documents")
+            if is_parquet:
+                docs = _read_parquet(args.source, skip, args.batch_size)
+            else:
+                docs = _read_ndjson(args.source, skip)
+            import_docs(collection, docs, progress, args.batch_size, skip)
+    finally:
+        db.close_connection()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
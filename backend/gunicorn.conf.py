@@ -0,0 +1,85 @@
+# Gunicorn configuration for production
+#
+#   gunicorn -c gunicorn.conf.py wsgi:app
+#
+# Graceful reload of workers:   kill -HUP <master pid>
+# Reload with a new model file: kill -USR2 <master pid>, then kill -QUIT the old master
+# (HUP keeps the preloaded model, USR2 starts a fresh master that loads it again)
+
+import gc
+import os
+import multiprocessing
+
+# --- Server socket ---
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:5001')
+backlog = int(os.getenv('GUNICORN_BACKLOG', '2048'))
+
+# --- Workers ---
+workers = int(os.getenv('WEB_CONCURRENCY', min(multiprocessing.cpu_count(), 4)))
+# Every thread is shared by all requests: ML_MAX_CONCURRENCY + ML_MAX_QUEUE go
+# to predictions (utils/admission.py), and open event streams get what is left
+# minus one thread kept for login, booking and dashboards (routes/events.py
+# reads GUNICORN_THREADS for that). Raise this to allow more streams.
+threads = int(os.getenv('GUNICORN_THREADS', '4'))
+worker_class = 'gthread' if threads > 1 else 'sync'
+
+# Recycle workers periodically to bound memory growth
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', '1000'))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', '100'))
+
+# --- Timeouts ---
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '120'))  # model inference can be slow
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', '30'))
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', '5'))
+
+# --- Model sharing ---
+# Import wsgi.py (and with it the Keras model) in the master before forking.
+# TensorFlow is not fork-safe once it has run anything: the master may only
+# load the weights, never predict, and must not start threads that workers
+# would need. python smoke_fork.py checks that forked workers can predict;
+# if they hang or crash, PRELOAD_MODEL=0 loads the model in each worker
+# instead (no sharing, one copy of the weights per worker).
+preload_app = os.getenv('PRELOAD_MODEL', '1') != '0'
+
+# --- Logging ---
+accesslog = os.getenv('GUNICORN_ACCESS_LOG', '-')
+# Default format minus the query string (%(U)s instead of %(r)s), so tickets in URLs stay out of the logs
+access_log_format = '%(h)s %(l)s %(u)s %(t)s "%(m)s %(U)s %(H)s" %(s)s %(b)s "%(f)s" "%(a)s"'
+errorlog = os.getenv('GUNICORN_ERROR_LOG', '-')
+loglevel = os.getenv('GUNICORN_LOG_LEVEL', 'info')
+
+
+# --- Metrics ---
+# Each worker writes Prometheus samples to this directory (see utils/metrics.py)
+prometheus_multiproc_dir = os.getenv('PROMETHEUS_MULTIPROC_DIR')
+
+# Samples from a previous run would be aggregated into the new one. This runs
+# when the config is read, i.e. before the app is preloaded.
+if prometheus_multiproc_dir:
+    os.makedirs(prometheus_multiproc_dir, exist_ok=True)
+    for name in os.listdir(prometheus_multiproc_dir):
+        os.remove(os.path.join(prometheus_multiproc_dir, name))
+
+
+def when_ready(server):
+    # Move everything allocated so far out of the GC's reach, so collections in
+    # the workers do not touch (and copy) the pages holding the shared model
+    gc.freeze()
+    server.log.info("Master ready (model preloaded: %s), %s workers x %s threads", preload_app, workers, threads)
+
+
+def post_fork(server, worker):
+    # MongoClient must be created after fork, never inherited from the master
+    import wsgi
+    wsgi.init_worker()
+    server.log.info("Worker %s initialised", worker.pid)
+
+
+def child_exit(server, worker):
+    if prometheus_multiproc_dir:
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
+
+
+def worker_abort(worker):
+    worker.log.warning("Worker %s timed out and was aborted", worker.pid)
@@ -0,0 +1,386 @@
+"""
+End-to-end load test for the API.
+
+    python loadtest.py --mongo mock --users 20 --duration 60
+    python loadtest.py --mongo local --save-baseline loadtest_baseline.json
+    python loadtest.py --baseline loadtest_baseline.json          # exits 1 on regression
+    python loadtest.py --target http://localhost:5001 --users 50
+
+By default the app is built in-process with create_app() and driven through
+Flask test clients, against the MongoDB in MONGODB_URI (--mongo local) or an
+in-memory mongomock database (--mongo mock). --target drives a running server
+over HTTP instead.
+
+Setup creates doctors and patients through the API. Virtual users then run a
+weighted mix of login, doctor listing, availability lookup, booking,
+dashboards and MRI prediction with the scans in samples/mri_scans, with
+exponential think time between calls. The report lists throughput, error
+rate and latency percentiles per endpoint; with --baseline the run fails if
+any endpoint's p95 or throughput regresses by more than --tolerance.
+"""
+
+import argparse
+import glob
+import io
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+ADMIN_EMAIL = 'admin1@healthcare.com'
+ADMIN_PASSWORD = 'admin@123'
+USER_PASSWORD = 'loadtest123'
+# Kept outside UPLOAD_ROOT, whose files are extensionless content-addressed blobs
+SCAN_GLOB = os.path.join('samples', 'mri_scans', '*.jp*g')
+
+# (operation, weight) per persona
+PATIENT_MIX = [
+    ('login', 4), ('list_doctors', 10), ('available_slots', 25), ('book_appointment', 10),
+    ('patient_dashboard', 15), ('patient_appointments', 10), ('patient_predictions', 6), ('predict', 5)
+]
+DOCTOR_MIX = [('doctor_dashboard', 40), ('doctor_appointments', 30), ('doctor_predictions', 30)]
+ADMIN_MIX = [('admin_dashboard', 60), ('admin_appointments', 40)]
+PERSONA_WEIGHTS = {'patient': 0.8, 'doctor': 0.15, 'admin': 0.05}
+
+
+class InProcessClient:
+    """Flask test client; one per virtual user since test clients are not shared across threads"""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, token=None, json_body=None, files=None):
+        headers = {'Authorization': f'Bearer {token}'} if token else {}
+        kwargs = {}
+        if files:
+            kwargs['data'] = {name: (io.BytesIO(data), filename) for name, (filename, data) in files.items()}
+            kwargs['content_type'] = 'multipart/form-data'
+        response = self.client.open(path, method=method, json=json_body, headers=headers, **kwargs)
+        return response.status_code, response.get_json(silent=True)
+
+
+class HttpClient:
+    def __init__(self, base_url):
+        import requests
+
+        self.base_url = base_url.rstrip('/')
+        self.session = requests.Session()
+
+    def request(self, method, path, token=None, json_body=None, files=None):
+        headers = {'Authorization': f'Bearer {token}'} if token else {}
+        response = self.session.request(method, self.base_url + path, json=json_body, headers=headers,
+                                        files={k: (f, d, 'image/jpeg') for k, (f, d) in (files or {}).items()} or None)
+        try:
+            return response.status_code, response.json()
+        except ValueError:
+            return response.status_code, None
+
+
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def record(self, name, seconds, ok):
+        with self.lock:
+            self.latencies[name].append(seconds)
+            if not ok:
+                self.errors[name] += 1
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(int(round(pct / 100.0 * (len(sorted_values) - 1))), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+class VirtualUser(threading.Thread):
+    def __init__(self, client, persona, account, world, recorder, deadline, think_ms, seed):
+        super().__init__(daemon=True)
+        self.client = client
+        self.persona = persona
+        self.account = account
+        self.world = world
+        self.recorder = recorder
+        self.deadline = deadline
+        self.think_ms = think_ms
+        self.rng = random.Random(seed)
+        self.token = None
+        mix = {'patient': PATIENT_MIX, 'doctor': DOCTOR_MIX, 'admin': ADMIN_MIX}[persona]
+        self.operations = [name for name, _ in mix]
+        self.weights = [weight for _, weight in mix]
+
+    def call(self, name, method, path, expected=(200,), **kwargs):
+        started = time.perf_counter()
+        try:
+            status, body = self.client.request(method, path, token=self.token, **kwargs)
+        except Exception:
+            status, body = 599, None
+        self.recorder.record(name, time.perf_counter() - started, status in expected)
+        return status, body
+
+    def login(self):
+        status, body = self.call('login', 'POST', '/api/auth/login', json_body={
+            'email': self.account['email'], 'password': self.account['password'], 'user_type': self.persona
+        })
+        if status == 200:
+            self.token = body['token']
+
+    def run(self):
+        self.login()
+        while time.monotonic() < self.deadline:
+            operation = self.rng.choices(self.operations, self.weights)[0]
+            getattr(self, operation)()
+            if self.think_ms:
+                time.sleep(self.rng.expovariate(1000.0 / self.think_ms))
+
+    def _doctor_and_date(self):
+        doctor_id = self.rng.choice(self.world['doctor_ids'])
+        day = datetime.utcnow() + timedelta(days=self.rng.randint(1, 30))
+        return doctor_id, day.strftime('%Y-%m-%d')
+
+    # --- patient ---
+    def list_doctors(self):
+        self.call('list_doctors', 'GET', '/api/patient/doctors')
+
+    def available_slots(self):
+        doctor_id, date = self._doctor_and_date()
+        self.call('available_slots', 'GET', f'/api/patient/doctors/{doctor_id}/available-slots?date={date}')
+
+    def book_appointment(self):
+        doctor_id, date = self._doctor_and_date()
+        status, body = self.call('available_slots', 'GET', f'/api/patient/doctors/{doctor_id}/available-slots?date={date}')
+        slots = (body or {}).get('available_slots') if status == 200 else None
+        if not slots:
+            return
+        # 400 means another user took the slot in between, which is normal under load
+        self.call('book_appointment', 'POST', '/api/patient/appointments', expected=(201, 400), json_body={
+            'doctor_id': doctor_id, 'appointment_date': date, 'time_slot': self.rng.choice(slots),
+            'reason': 'Load test booking'
+        })
+
+    def patient_dashboard(self):
+        self.call('patient_dashboard', 'GET', '/api/patient/dashboard')
+
+    def patient_appointments(self):
+        self.call('patient_appointments', 'GET', '/api/patient/appointments')
+
+    def patient_predictions(self):
+        self.call('patient_predictions', 'GET', '/api/patient/predictions')
+
+    def predict(self):
+        if not self.world['scans']:
+            return
+        filename, data = self.rng.choice(self.world['scans'])
+        self.call('predict', 'POST', '/api/ml/predict', files={'image': (filename, data)})
+
+    # --- doctor ---
+    def doctor_dashboard(self):
+        self.call('doctor_dashboard', 'GET', '/api/doctor/dashboard')
+
+    def doctor_appointments(self):
+        self.call('doctor_appointments', 'GET', '/api/doctor/appointments')
+
+    def doctor_predictions(self):
+        self.call('doctor_predictions', 'GET', '/api/doctor/predictions')
+
+    # --- admin ---
+    def admin_dashboard(self):
+        self.call('admin_dashboard', 'GET', '/api/admin/dashboard')
+
+    def admin_appointments(self):
+        self.call('admin_appointments', 'GET', '/api/admin/appointments')
+
+
+def build_client_factory(args):
+    if args.target:
+        return lambda: HttpClient(args.target)
+
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    if args.mongo == 'mock':
+        try:
+            import mongomock
+        except ImportError:
+            sys.exit("--mongo mock needs mongomock (pip install mongomock)")
+        import pymongo
+        # utils.db imports MongoClient by name, so patch before the app is imported
+        pymongo.MongoClient = mongomock.MongoClient
+        # No capped collections / tailable cursors in mongomock
+        os.environ.setdefault('EVENT_RELAY', 'local')
+
+    from app import create_app
+    app = create_app()
+    if app is None:
+        sys.exit("create_app() failed; is MongoDB reachable?")
+    return lambda: InProcessClient(app)
+
+
+def setup_world(client, args):
+    """Create doctors and patients through the API"""
+    tag = uuid.uuid4().hex[:8]
+    status, body = client.request('POST', '/api/auth/login', json_body={
+        'email': ADMIN_EMAIL, 'password': ADMIN_PASSWORD, 'user_type': 'admin'
+    })
+    if status != 200:
+        sys.exit(f"Admin login failed ({status}); the load test needs the default admin account")
+    admin_token = body['token']
+
+    doctors = []
+    for i in range(args.doctors):
+        email = f'loadtest.doctor.{tag}.{i}@example.com'
+        status, body = client.request('POST', '/api/admin/doctors', token=admin_token, json_body={
+            'email': email, 'password': USER_PASSWORD, 'first_name': 'Load', 'last_name': f'Doctor{i}',
+            'phone': '+15550000000', 'specialization': 'Neurology', 'license_number': f'LT{i:05d}'
+        })
+        if status == 201:
+            doctors.append({'id': body['doctor_id'], 'email': email, 'password': USER_PASSWORD})
+
+    patients = []
+    for i in range(args.patients):
+        email = f'loadtest.patient.{tag}.{i}@example.com'
+        status, _ = client.request('POST', '/api/auth/signup', json_body={
+            'email': email, 'password': USER_PASSWORD, 'first_name': 'Load', 'last_name': f'Patient{i}',
+            'phone': '+15550000001'
+        })
+        if status == 201:
+            patients.append({'email': email, 'password': USER_PASSWORD})
+
+    if not doctors or not patients:
+        sys.exit("Setup failed: could not create doctors or patients")
+
+    scans = []
+    if not args.no_predict:
+        for path in sorted(glob.glob(args.scans))[:args.max_scans]:
+            with open(path, 'rb') as f:
+                scans.append((os.path.basename(path), f.read()))
+        if not scans and dict(PATIENT_MIX)['predict']:
+            sys.exit(f"No sample scans match {args.scans!r}; pass --scans or --no-predict")
+
+    return {
+        'doctor_ids': [d['id'] for d in doctors],
+        'accounts': {
+            'patient': patients,
+            'doctor': doctors,
+            'admin': [{'email': ADMIN_EMAIL, 'password': ADMIN_PASSWORD}]
+        },
+        'scans': scans
+    }
+
+
+def summarize(recorder, elapsed):
+    results = {}
+    for name, latencies in sorted(recorder.latencies.items()):
+        values = sorted(latencies)
+        results[name] = {
+            'requests': len(values),
+            'errors': recorder.errors[name],
+            'error_rate': recorder.errors[name] / len(values),
+            'rps': len(values) / elapsed,
+            'p50_ms': percentile(values, 50) * 1000,
+            'p90_ms': percentile(values, 90) * 1000,
+            'p95_ms': percentile(values, 95) * 1000,
+            'p99_ms': percentile(values, 99) * 1000,
+            'max_ms': values[-1] * 1000
+        }
+    return results
+
+
+def print_report(results):
+    print(f"\n{'endpoint':<22}{'reqs':>8}{'err%':>7}{'rps':>9}{'p50':>9}{'p90':>9}{'p95':>9}{'p99':>9}{'max':>9}")
+    for name, r in results.items():
+        print(f"{name:<22}{r['requests']:>8}{r['error_rate'] * 100:>6.1f}%{r['rps']:>9.1f}"
+              f"{r['p50_ms']:>8.1f}ms{r['p90_ms']:>7.1f}ms{r['p95_ms']:>7.1f}ms{r['p99_ms']:>7.1f}ms{r['max_ms']:>7.1f}ms")
+
+
+def compare(results, baseline, tolerance, min_requests):
+    """List of regression messages; endpoints with too few samples are skipped"""
+    regressions = []
+    for name, base in baseline.items():
+        current = results.get(name)
+        if not current or current['requests'] < min_requests or base['requests'] < min_requests:
+            continue
+        if current['p95_ms'] > base['p95_ms'] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {current['p95_ms']:.1f}ms vs baseline {base['p95_ms']:.1f}ms")
+        if current['rps'] < base['rps'] * (1 - tolerance):
+            regressions.append(f"{name}: {current['rps']:.1f} rps vs baseline {base['rps']:.1f} rps")
+        if current['error_rate'] > base['error_rate'] + 0.01:
+            regressions.append(f"{name}: error rate {current['error_rate']:.1%} vs baseline {base['error_rate']:.1%}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Mixed-workload load test for the API")
+    parser.add_argument('--target', help="Base URL of a running server (default: in-process create_app())")
+    parser.add_argument('--mongo', choices=['local', 'mock'], default='local',
+                        help="In-process only: MONGODB_URI or an in-memory mongomock database")
+    parser.add_argument('--users', type=int, default=20, help="Concurrent virtual users")
+    parser.add_argument('--duration', type=float, default=60, help="Seconds of load after setup")
+    parser.add_argument('--think-ms', type=float, default=100, help="Mean think time between calls (0 for none)")
+    parser.add_argument('--doctors', type=int, default=10)
+    parser.add_argument('--patients', type=int, default=50)
+    parser.add_argument('--scans', default=SCAN_GLOB, help="Glob of sample scans for /api/ml/predict")
+    parser.add_argument('--max-scans', type=int, default=20)
+    parser.add_argument('--no-predict', action='store_true', help="Leave /api/ml/predict out of the mix")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--baseline', help="Baseline JSON to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="Allowed relative regression (0.2 = 20%%)")
+    parser.add_argument('--min-requests', type=int, default=30, help="Ignore endpoints with fewer samples")
+    parser.add_argument('--save-baseline', help="Write this run's results as the new baseline")
+    parser.add_argument('--output', help="Write this run's results as JSON")
+    args = parser.parse_args(argv)
+
+    make_client = build_client_factory(args)
+    world = setup_world(make_client(), args)
+    print(f"Setup: {len(world['doctor_ids'])} doctors, {len(world['accounts']['patient'])} patients, "
+          f"{len(world['scans'])} scans")
+
+    rng = random.Random(args.seed)
+    recorder = Recorder()
+    deadline = time.monotonic() + args.duration
+    users = []
+    for i in range(args.users):
+        persona = rng.choices(list(PERSONA_WEIGHTS), list(PERSONA_WEIGHTS.values()))[0]
+        account = rng.choice(world['accounts'][persona])
+        users.append(VirtualUser(make_client(), persona, account, world, recorder, deadline,
+                                 args.think_ms, args.seed * 1000 + i))
+
+    started = time.monotonic()
+    for user in users:
+        user.start()
+    for user in users:
+        user.join()
+    results = summarize(recorder, time.monotonic() - started)
+    print_report(results)
+
+    run = {'created_at': datetime.utcnow().isoformat(), 'config': {
+        'target': args.target or f'in-process ({args.mongo})', 'users': args.users,
+        'duration': args.duration, 'think_ms': args.think_ms
+    }, 'endpoints': results}
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, 'w') as f:
+                json.dump(run, f, indent=2)
+            print(f"Results written to {path}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline['endpoints'], args.tolerance, args.min_requests)
+        if regressions:
+            print("\nRegressions against baseline:")
+            for message in regressions:
+                print(f"  {message}")
+            return 1
+        print("\nNo regressions against baseline")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,19 +1,96 @@
-from datetime import datetime
+"""
+Appointments.
+
+`appointment_date` is stored as a BSON datetime (midnight UTC of the
+calendar day) and `slot_start` as the UTC datetime the slot begins, reading
+'HH:MM' time slots in CLINIC_TIMEZONE. API responses still carry
+'YYYY-MM-DD' strings. Appointments written before this change had string
+dates; convert them in place, while the API keeps serving, with
+
+    python -m models.appointment --batch-size 500
+
+Until that has run, day lookups also match the old string form.
+"""
+
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo
 from bson import ObjectId
-from utils.db import db_instance
+from pymongo import ReturnDocument, UpdateOne
+from models.prediction import Prediction
+from utils.db import READ_LIST, db_instance
+from utils.events import event_bus, role_audience, user_audience
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+CLINIC_TIMEZONE = ZoneInfo(os.getenv('CLINIC_TIMEZONE', 'UTC'))
+DATE_FORMAT = '%Y-%m-%d'
+OPEN_STATUSES = ['pending', 'approved']
+
+
+def parse_day(value):
+    """Stored form of a calendar day: naive midnight UTC, like every other datetime here"""
+    if isinstance(value, datetime):
+        return datetime(value.year, value.month, value.day)
+    return datetime.strptime(value, DATE_FORMAT)
+
+
+def format_day(value):
+    """'YYYY-MM-DD' for a stored day (unmigrated string dates pass through)"""
+    return value.strftime(DATE_FORMAT) if isinstance(value, datetime) else value
+
+
+def slot_start(day, time_slot):
+    """UTC start of an 'HH:MM' slot on a day, read in CLINIC_TIMEZONE"""
+    hours, minutes = (int(part) for part in time_slot.split(':'))
+    local = datetime(day.year, day.month, day.day, hours, minutes, tzinfo=CLINIC_TIMEZONE)
+    return local.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def _on_day(day):
+    day = parse_day(day)
+    return {'$in': [day, format_day(day)]}
+
+
+def _days_between(start, end):
+    start, end = parse_day(start), parse_day(end)
+    return {'$or': [
+        {'appointment_date': {'$gte': start, '$lte': end}},
+        {'appointment_date': {'$gte': format_day(start), '$lte': format_day(end)}}
+    ]}
+
+
+# Responses keep 'YYYY-MM-DD' dates; added after $match/$sort so those still use the indexes
+_DAY_AS_STRING = {'$addFields': {'appointment_date': {'$cond': [
+    {'$eq': [{'$type': '$appointment_date'}, 'date']},
+    {'$dateToString': {'format': '%Y-%m-%d', 'date': '$appointment_date'}},
+    '$appointment_date'
+]}}}
+
 
 class Appointment:
     def __init__(self):
         self.collection = db_instance.get_collection('appointments')
+        # Admin list pages may read slightly stale data from a secondary; bookings,
+        # slot checks and a user's own appointments stay on the primary
+        self.list_reads = db_instance.get_collection('appointments', READ_LIST)
+        # Appointment priority feeds the prediction review queue
+        self.predictions = Prediction()
     
     def create_appointment(self, appointment_data):
         """Create a new appointment"""
         try:
+            day = parse_day(appointment_data['appointment_date'])
             appointment_doc = {
                 'patient_id': ObjectId(appointment_data['patient_id']),
                 'doctor_id': ObjectId(appointment_data['doctor_id']),
-                'appointment_date': appointment_data['appointment_date'],
+                'appointment_date': day,
                 'time_slot': appointment_data['time_slot'],
+                'slot_start': slot_start(day, appointment_data['time_slot']),
                 'reason': appointment_data.get('reason', ''),
                 'symptoms': appointment_data.get('symptoms', ''),
                 'status': 'pending',  # pending, approved, rejected, completed, cancelled
@@ -24,9 +101,18 @@ class Appointment:
             }
             
             result = self.collection.insert_one(appointment_doc)
+            self.predictions.refresh_review_priority(appointment_doc['patient_id'])
+            event_bus.publish('appointment.created', [
+                user_audience(appointment_doc['doctor_id']), role_audience('admin')
+            ], {
+                'appointment_id': result.inserted_id,
+                'appointment_date': format_day(day),
+                'time_slot': appointment_doc['time_slot'],
+                'priority': appointment_doc['priority']
+            })
             return str(result.inserted_id)
         except Exception as e:
-            print(f"Error creating appointment: {e}")
+            logger.exception("Error creating appointment: %s", e)
             return None
     
     def get_patient_appointments(self, patient_id):
@@ -34,17 +120,18 @@ class Appointment:
         try:
             pipeline = [
                 {'$match': {'patient_id': ObjectId(patient_id)}},
+                {'$sort': {'appointment_date': 1, 'time_slot': 1}},
+                _DAY_AS_STRING,
                 {'$lookup': {
                     'from': 'users',
                     'localField': 'doctor_id',
                     'foreignField': '_id',
                     'as': 'doctor_info'
-                }},
-                {'$sort': {'appointment_date': 1}}
+                }}
             ]
             return list(self.collection.aggregate(pipeline))
         except Exception as e:
-            print(f"Error getting patient appointments: {e}")
+            logger.exception("Error getting patient appointments: %s", e)
             return []
     
     def get_doctor_appointments(self, doctor_id):
@@ -52,17 +139,18 @@ class Appointment:
         try:
             pipeline = [
                 {'$match': {'doctor_id': ObjectId(doctor_id)}},
+                {'$sort': {'appointment_date': 1, 'time_slot': 1}},
+                _DAY_AS_STRING,
                 {'$lookup': {
                     'from': 'users',
                     'localField': 'patient_id',
                     'foreignField': '_id',
                     'as': 'patient_info'
-                }},
-                {'$sort': {'appointment_date': 1}}
+                }}
             ]
             return list(self.collection.aggregate(pipeline))
         except Exception as e:
-            print(f"Error getting doctor appointments: {e}")
+            logger.exception("Error getting doctor appointments: %s", e)
             return []
     
     def update_appointment_status(self, appointment_id, status, notes=None):
@@ -75,13 +163,29 @@ class Appointment:
             if notes:
                 update_data['doctor_notes'] = notes
             
-            result = self.collection.update_one(
+            appointment = self.collection.find_one_and_update(
                 {'_id': ObjectId(appointment_id)},
-                {'$set': update_data}
+                {'$set': update_data},
+                projection={'patient_id': 1, 'doctor_id': 1, 'appointment_date': 1, 'time_slot': 1, 'status': 1},
+                return_document=ReturnDocument.BEFORE
             )
-            return result.modified_count > 0
+            if not appointment:
+                return False
+            self.predictions.refresh_review_priority(appointment['patient_id'])
+            event_bus.publish('appointment.status', [
+                user_audience(appointment['patient_id']),
+                user_audience(appointment['doctor_id']),
+                role_audience('admin')
+            ], {
+                'appointment_id': appointment['_id'],
+                'status': status,
+                'previous_status': appointment['status'],
+                'appointment_date': format_day(appointment['appointment_date']),
+                'time_slot': appointment['time_slot']
+            })
+            return True
         except Exception as e:
-            print(f"Error updating appointment status: {e}")
+            logger.exception("Error updating appointment status: %s", e)
             return False
     
     def get_appointment_by_id(self, appointment_id):
@@ -89,6 +193,7 @@ class Appointment:
         try:
             pipeline = [
                 {'$match': {'_id': ObjectId(appointment_id)}},
+                _DAY_AS_STRING,
                 {'$lookup': {
                     'from': 'users',
                     'localField': 'doctor_id',
@@ -105,28 +210,145 @@ class Appointment:
             result = list(self.collection.aggregate(pipeline))
             return result[0] if result else None
         except Exception as e:
-            print(f"Error getting appointment by ID: {e}")
+            logger.exception("Error getting appointment by ID: %s", e)
             return None
     
+    def ensure_indexes(self):
+        """Indexes behind every appointment query in this class"""
+        self.collection.create_index([('doctor_id', 1), ('appointment_date', 1), ('time_slot', 1)])
+        self.collection.create_index([('patient_id', 1), ('appointment_date', 1), ('time_slot', 1)])
+        self.collection.create_index([('patient_id', 1), ('slot_start', 1)])
+        self.collection.create_index([('status', 1), ('created_at', -1)])
+        self.collection.create_index([('created_at', -1)])
+
+    def get_next_appointment(self, patient_id):
+        """A patient's next pending or approved appointment that has not started yet"""
+        try:
+            pipeline = [
+                {'$match': {
+                    'patient_id': ObjectId(patient_id),
+                    'slot_start': {'$gte': datetime.utcnow()},
+                    'status': {'$in': OPEN_STATUSES}
+                }},
+                {'$sort': {'slot_start': 1}},
+                {'$limit': 1},
+                _DAY_AS_STRING,
+                {'$lookup': {
+                    'from': 'users',
+                    'localField': 'doctor_id',
+                    'foreignField': '_id',
+                    'as': 'doctor_info'
+                }}
+            ]
+            result = list(self.collection.aggregate(pipeline))
+            return result[0] if result else None
+        except Exception as e:
+            logger.exception("Error getting next appointment: %s", e)
+            return None
+
+    def get_doctor_calendar(self, doctor_id, start_date, end_date, statuses=('pending', 'approved')):
+        """
+        A doctor's appointments from start_date to end_date (inclusive), grouped
+        by day, with only the patient fields a calendar needs
+        """
+        try:
+            pipeline = [
+                {'$match': {
+                    'doctor_id': ObjectId(doctor_id),
+                    'status': {'$in': list(statuses)},
+                    **_days_between(start_date, end_date)
+                }},
+                {'$sort': {'appointment_date': 1, 'time_slot': 1}},
+                _DAY_AS_STRING,
+                {'$lookup': {
+                    'from': 'users',
+                    'let': {'patient_id': '$patient_id'},
+                    'pipeline': [
+                        {'$match': {'$expr': {'$eq': ['$_id', '$$patient_id']}}},
+                        {'$project': {'first_name': 1, 'last_name': 1, 'email': 1, 'phone': 1,
+                                      'gender': 1, 'date_of_birth': 1}}
+                    ],
+                    'as': 'patient_info'
+                }},
+                {'$group': {
+                    '_id': '$appointment_date',
+                    'appointments': {'$push': {
+                        '_id': '$_id',
+                        'time_slot': '$time_slot',
+                        'slot_start': '$slot_start',
+                        'status': '$status',
+                        'priority': '$priority',
+                        'reason': '$reason',
+                        'symptoms': '$symptoms',
+                        'patient_id': '$patient_id',
+                        'patient_info': '$patient_info'
+                    }}
+                }},
+                {'$sort': {'_id': 1}},
+                {'$project': {'_id': 0, 'date': '$_id', 'appointments': 1}}
+            ]
+            return list(self.collection.aggregate(pipeline))
+        except Exception as e:
+            logger.exception("Error getting doctor calendar: %s", e)
+            return []
+
     def check_time_slot_availability(self, doctor_id, appointment_date, time_slot):
         """Check if time slot is available for doctor"""
         try:
             existing_appointment = self.collection.find_one({
                 'doctor_id': ObjectId(doctor_id),
-                'appointment_date': appointment_date,
+                'appointment_date': _on_day(appointment_date),
                 'time_slot': time_slot,
-                'status': {'$in': ['pending', 'approved']}
-            })
+                'status': {'$in': OPEN_STATUSES}
+            }, {'_id': 1})
             return existing_appointment is None
         except Exception as e:
-            print(f"Error checking time slot availability: {e}")
+            logger.exception("Error checking time slot availability: %s", e)
             return False
+
+    def get_booked_slots(self, doctor_id, appointment_date):
+        """Time slots taken on a day for a doctor"""
+        try:
+            return [apt['time_slot'] for apt in self.collection.find({
+                'doctor_id': ObjectId(doctor_id),
+                'appointment_date': _on_day(appointment_date),
+                'status': {'$in': OPEN_STATUSES}
+            }, {'time_slot': 1, '_id': 0})]
+        except Exception as e:
+            logger.exception("Error getting booked slots: %s", e)
+            return []
     
+    def get_all_appointments(self):
+        """Get all appointments for admin view, newest first"""
+        try:
+            pipeline = [
+                {'$sort': {'created_at': -1}},
+                _DAY_AS_STRING,
+                {'$lookup': {
+                    'from': 'users',
+                    'localField': 'doctor_id',
+                    'foreignField': '_id',
+                    'as': 'doctor_info'
+                }},
+                {'$lookup': {
+                    'from': 'users',
+                    'localField': 'patient_id',
+                    'foreignField': '_id',
+                    'as': 'patient_info'
+                }}
+            ]
+            return list(self.list_reads.aggregate(pipeline))
+        except Exception as e:
+            logger.exception("Error getting appointments: %s", e)
+            return []
+
     def get_pending_appointments(self):
         """Get all pending appointments for admin view"""
         try:
             pipeline = [
                 {'$match': {'status': 'pending'}},
+                {'$sort': {'created_at': -1}},
+                _DAY_AS_STRING,
                 {'$lookup': {
                     'from': 'users',
                     'localField': 'doctor_id',
@@ -138,10 +360,65 @@ class Appointment:
                     'localField': 'patient_id',
                     'foreignField': '_id',
                     'as': 'patient_info'
-                }},
-                {'$sort': {'created_at': -1}}
+                }}
             ]
-            return list(self.collection.aggregate(pipeline))
+            return list(self.list_reads.aggregate(pipeline))
         except Exception as e:
-            print(f"Error getting pending appointments: {e}")
-            return []
\ No newline at end of file
+            logger.exception("Error getting pending appointments: %s", e)
+            return []
+
+
+def migrate_appointment_dates(collection, batch_size=500, pause=0.0):
+    """
+    Convert string appointment dates to datetimes and add slot_start, in _id
+    order. Each update only applies if the date is still the string that was
+    read, so it is safe to run while the API is serving; rerunning it resumes.
+    """
+    migrated, skipped, last_id = 0, 0, None
+    while True:
+        query = {'appointment_date': {'$type': 'string'}}
+        if last_id is not None:
+            query['_id'] = {'$gt': last_id}
+        batch = list(collection.find(query, {'appointment_date': 1, 'time_slot': 1}).sort('_id', 1).limit(batch_size))
+        if not batch:
+            return migrated, skipped
+        last_id = batch[-1]['_id']
+
+        requests = []
+        for doc in batch:
+            try:
+                day = parse_day(doc['appointment_date'])
+                start = slot_start(day, doc['time_slot'])
+            except (KeyError, TypeError, ValueError):
+                logger.warning("Cannot parse date of appointment %s: %r %r", doc['_id'],
+                               doc.get('appointment_date'), doc.get('time_slot'))
+                skipped += 1
+                continue
+            requests.append(UpdateOne(
+                {'_id': doc['_id'], 'appointment_date': doc['appointment_date']},
+                {'$set': {'appointment_date': day, 'slot_start': start}}
+            ))
+        if requests:
+            migrated += collection.bulk_write(requests, ordered=False).modified_count
+        logger.info("Migrated %d appointment dates so far", migrated)
+        if pause:
+            time.sleep(pause)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert string appointment dates to BSON datetimes")
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--pause', type=float, default=0.0, help="Seconds to sleep between batches")
+    args = parser.parse_args(argv)
+
+    if not db_instance.connect():
+        return 1
+    appointments = Appointment()
+    appointments.ensure_indexes()
+    migrated, skipped = migrate_appointment_dates(appointments.collection, args.batch_size, args.pause)
+    print(f"Migrated {migrated} appointments ({skipped} with unparseable dates left as they were)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
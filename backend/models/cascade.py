@@ -0,0 +1,269 @@
+"""
+Two-stage confidence cascade for the tumor classifier.
+
+A small screening CNN sees every scan. When its top-class confidence is at
+least CASCADE_THRESHOLD percent its answer is used as is; otherwise the scan
+escalates to the full VGG16 model. The screening model takes the same
+preprocessed 224x224 tensor as VGG16 (and downsamples it internally), so
+both stages share preprocessing and the tensor cache.
+
+A fraction (CASCADE_AUDIT_RATE) of confident screens is re-run through the
+full model on a background thread to track how often the two disagree.
+
+The screening model is distilled from the full model on unlabeled scans:
+    python -m models.cascade train --images 'samples/mri_scans/*.jp*g' --epochs 15
+    python -m models.cascade evaluate --images 'dataset/test/**/*.jpg'
+
+`evaluate` runs both models over a set of scans and reports, per threshold,
+the escalation rate, agreement with full-model-only predictions and the
+average latency of each approach.
+"""
+
+import argparse
+import glob
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from utils.metrics import SCREENING_LATENCY, CASCADE_PREDICTIONS, CASCADE_LATENCY_SAVED, CASCADE_AUDITS
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+CASCADE_ENABLED = os.getenv('CASCADE_ENABLED', 'false').lower() == 'true'
+SCREENING_MODEL_PATH = os.getenv('SCREENING_MODEL_PATH', os.path.join('models', 'screening.keras'))
+CASCADE_THRESHOLD = float(os.getenv('CASCADE_THRESHOLD', '90'))
+CASCADE_AUDIT_RATE = float(os.getenv('CASCADE_AUDIT_RATE', '0.05'))
+
+# Weight of the newest sample in the running full-model latency estimate
+LATENCY_EWMA_ALPHA = 0.1
+
+
+def build_screening_model(num_classes, image_size=224):
+    """~100k-parameter CNN over the VGG16-preprocessed input"""
+    from tensorflow import keras
+    from tensorflow.keras import layers
+
+    inputs = keras.Input((image_size, image_size, 3))
+    x = layers.Rescaling(1.0 / 127.5)(inputs)  # preprocess_input output is roughly [-124, 152]
+    x = layers.AveragePooling2D(2)(x)
+    for filters in (16, 32, 64, 128):
+        x = layers.Conv2D(filters, 3, padding='same', use_bias=False)(x)
+        x = layers.BatchNormalization()(x)
+        x = layers.ReLU()(x)
+        x = layers.MaxPooling2D(2)(x)
+    x = layers.GlobalAveragePooling2D()(x)
+    x = layers.Dropout(0.2)(x)
+    outputs = layers.Dense(num_classes, activation='softmax')(x)
+    return keras.Model(inputs, outputs, name='screening')
+
+
+class Cascade:
+    """Screen with the small model, escalate uncertain scans to the full model"""
+
+    def __init__(self, screening_model, full_model, threshold=CASCADE_THRESHOLD, audit_rate=CASCADE_AUDIT_RATE):
+        self.screening_model = screening_model
+        self.full_model = full_model
+        self.threshold = threshold
+        self.audit_rate = audit_rate
+        self.full_latency = None
+        self._lock = threading.Lock()
+        # One audit at a time; audits are skipped rather than queued when busy
+        self._audit_slot = threading.Semaphore(1)
+        self._audit_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='cascade-audit')
+
+    def _run_full(self, img_array):
+        """(preds, embedding, version) from the full model server"""
+        started = time.perf_counter()
+        result = self.full_model.infer(img_array)
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            if self.full_latency is None:
+                self.full_latency = elapsed
+            else:
+                self.full_latency += LATENCY_EWMA_ALPHA * (elapsed - self.full_latency)
+        return result
+
+    def _audit(self, img_array, screened_index):
+        try:
+            preds = self._run_full(img_array)[0]
+            agrees = int(np.argmax(preds, axis=1)[0]) == screened_index
+            CASCADE_AUDITS.labels('agree' if agrees else 'disagree').inc()
+        except Exception as e:
+            logger.exception("Cascade audit error: %s", e)
+        finally:
+            self._audit_slot.release()
+
+    def predict(self, img_array):
+        """Class probabilities from whichever stage decided, like model.predict"""
+        return self.infer(img_array)[0]
+
+    def infer(self, img_array):
+        """(preds, embedding, model version); screened scans have no full-model embedding"""
+        with SCREENING_LATENCY.time():
+            screen_preds = self.screening_model(img_array, training=False).numpy()
+        confidence = float(np.max(screen_preds, axis=1)[0] * 100)
+
+        if confidence < self.threshold:
+            CASCADE_PREDICTIONS.labels('full').inc()
+            return self._run_full(img_array)
+
+        CASCADE_PREDICTIONS.labels('screen').inc()
+        if self.full_latency is not None:
+            CASCADE_LATENCY_SAVED.inc(self.full_latency)
+        if random.random() < self.audit_rate and self._audit_slot.acquire(blocking=False):
+            self._audit_executor.submit(self._audit, np.array(img_array), int(np.argmax(screen_preds, axis=1)[0]))
+        return screen_preds, None, self.full_model.version
+
+
+def load_cascade(full_model):
+    """Cascade around a ModelServer, or None if no screening model has been trained"""
+    if not os.path.exists(SCREENING_MODEL_PATH):
+        logger.warning("CASCADE_ENABLED is set but %s does not exist; using the full model only",
+                       SCREENING_MODEL_PATH)
+        return None
+    from tensorflow.keras.models import load_model
+
+    screening_model = load_model(SCREENING_MODEL_PATH)
+    logger.info("Cascade enabled: screening model %s, threshold %.1f%%", SCREENING_MODEL_PATH, CASCADE_THRESHOLD)
+    return Cascade(screening_model, full_model)
+
+
+def _image_paths(pattern):
+    paths = sorted(glob.glob(pattern, recursive=True))
+    if not paths:
+        sys.exit(f"No images match {pattern}")
+    return paths
+
+
+def _preprocess_all(paths, image_size):
+    """Preprocessed inputs in a temporary memory-mapped .npy so large sets do not need to fit in RAM"""
+    import tempfile
+    from models.ml_model import preprocess_image
+
+    tmp = tempfile.NamedTemporaryFile(suffix='.npy', delete=False)
+    tmp.close()
+    inputs = np.lib.format.open_memmap(tmp.name, mode='w+', dtype=np.float32,
+                                       shape=(len(paths), image_size, image_size, 3))
+    for i, path in enumerate(paths):
+        inputs[i] = preprocess_image(path, image_size)[0]
+    inputs.flush()
+    return inputs, tmp.name
+
+
+def train(args):
+    """Distill the screening model from the full model's predictions"""
+    from tensorflow import keras
+    from models.ml_model import model, class_labels, IMAGE_SIZE
+
+    paths = _image_paths(args.images)
+    print(f"Preprocessing {len(paths)} images...")
+    inputs, tmp_path = _preprocess_all(paths, IMAGE_SIZE)
+    try:
+        print("Labelling with the full model...")
+        targets = np.concatenate([
+            model.predict(inputs[i:i + args.batch_size], verbose=0) for i in range(0, len(paths), args.batch_size)
+        ])
+
+        class Batches(keras.utils.PyDataset):
+            def __init__(self, indices, **kwargs):
+                super().__init__(**kwargs)
+                self.indices = indices
+
+            def __len__(self):
+                return (len(self.indices) + args.batch_size - 1) // args.batch_size
+
+            def __getitem__(self, i):
+                batch = np.sort(self.indices[i * args.batch_size:(i + 1) * args.batch_size])
+                x = np.asarray(inputs[batch])
+                # Horizontal flips: MRI slices are roughly left/right symmetric
+                flip = np.random.rand(len(batch)) < 0.5
+                x[flip] = x[flip, :, ::-1]
+                return x, targets[batch]
+
+            def on_epoch_end(self):
+                np.random.shuffle(self.indices)
+
+        indices = np.random.permutation(len(paths))
+        split = max(int(len(paths) * 0.1), 1)
+        screening = build_screening_model(len(class_labels), IMAGE_SIZE)
+        screening.compile(optimizer=keras.optimizers.Adam(1e-3), loss='categorical_crossentropy', metrics=['accuracy'])
+        screening.fit(Batches(indices[split:]), validation_data=Batches(indices[:split]), epochs=args.epochs)
+        screening.save(args.output)
+        print(f"Screening model saved to {args.output}")
+    finally:
+        del inputs
+        os.remove(tmp_path)
+
+
+def evaluate(args):
+    """Compare cascade and full-model-only predictions over a set of scans"""
+    from tensorflow.keras.models import load_model
+    from models.ml_model import model, IMAGE_SIZE
+
+    screening = load_model(args.screening_model)
+    paths = _image_paths(args.images)
+    inputs, tmp_path = _preprocess_all(paths, IMAGE_SIZE)
+    try:
+        # Warm up both graphs so the first call's tracing is not counted
+        screening(inputs[:1], training=False)
+        model.predict(inputs[:1], verbose=0)
+
+        full_time = screen_time = 0.0
+        full_index, screen_index, screen_conf = [], [], []
+        for i in range(len(paths)):
+            x = inputs[i:i + 1]
+            started = time.perf_counter()
+            screen_preds = screening(x, training=False).numpy()
+            screen_time += time.perf_counter() - started
+            started = time.perf_counter()
+            full_preds = model.predict(x, verbose=0)
+            full_time += time.perf_counter() - started
+            screen_index.append(int(np.argmax(screen_preds)))
+            screen_conf.append(float(np.max(screen_preds) * 100))
+            full_index.append(int(np.argmax(full_preds)))
+    finally:
+        del inputs
+        os.remove(tmp_path)
+
+    n = len(paths)
+    full_index, screen_index, screen_conf = np.array(full_index), np.array(screen_index), np.array(screen_conf)
+    print(f"{n} scans; full model {full_time / n * 1000:.1f} ms/scan, screening {screen_time / n * 1000:.1f} ms/scan")
+    print(f"Screening alone agrees with the full model on {np.mean(screen_index == full_index):.1%}")
+    print(f"\n{'threshold':>10}{'escalated':>11}{'agreement':>11}{'ms/scan':>10}{'saved':>8}")
+    for threshold in sorted(set(args.thresholds + [CASCADE_THRESHOLD])):
+        escalate = screen_conf < threshold
+        cascade_index = np.where(escalate, full_index, screen_index)
+        ms = (screen_time + full_time * escalate.mean()) / n * 1000
+        print(f"{threshold:>9.1f}%{escalate.mean():>10.1%}{np.mean(cascade_index == full_index):>11.1%}"
+              f"{ms:>10.1f}{1 - ms / (full_time / n * 1000):>8.0%}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Train or evaluate the screening model for the cascade")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    train_parser = subparsers.add_parser('train', help="Distill the screening model from the full model")
+    train_parser.add_argument('--images', required=True, help="Glob of training scans (labels are not needed)")
+    train_parser.add_argument('--epochs', type=int, default=15)
+    train_parser.add_argument('--batch-size', type=int, default=32)
+    train_parser.add_argument('--output', default=SCREENING_MODEL_PATH)
+
+    evaluate_parser = subparsers.add_parser('evaluate', help="Escalation rate and agreement per threshold")
+    evaluate_parser.add_argument('--images', required=True)
+    evaluate_parser.add_argument('--screening-model', default=SCREENING_MODEL_PATH)
+    evaluate_parser.add_argument('--thresholds', type=float, nargs='*', default=[70, 80, 90, 95, 98])
+    args = parser.parse_args(argv)
+
+    if args.command == 'train':
+        train(args)
+    else:
+        evaluate(args)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,285 @@
+"""
+Scan embeddings and similar-case search.
+
+EmbeddingForward runs the classifier layer by layer in one tf.function and
+returns the class probabilities together with the penultimate activation
+(the input of the final Dense layer), so the embedding costs no extra
+forward pass. If that layer is very wide (e.g. a Flatten straight into the
+classifier) the global-average-pooled last conv block is used instead.
+
+Embeddings are stored in `prediction_embeddings` as float16 bytes, one
+document per prediction, tagged with the model version that produced them.
+Each worker keeps an EmbeddingIndex: an L2-normalized float16 matrix of the
+reviewed cases for the serving model version, refreshed incrementally from
+MongoDB. Queries are scored with chunked NumPy matrix products; beyond
+EMBEDDING_IVF_THRESHOLD vectors an inverted-file index (k-means centroids,
+EMBEDDING_IVF_PROBES lists searched) restricts scoring to nearby clusters.
+"""
+
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+import numpy as np
+from bson import ObjectId
+from bson.binary import Binary
+from utils.db import db_instance
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+EMBEDDING_MAX_DIM = int(os.getenv('EMBEDDING_MAX_DIM', '4096'))
+EMBEDDING_REFRESH_SECONDS = float(os.getenv('EMBEDDING_REFRESH_SECONDS', '30'))
+EMBEDDING_IVF_THRESHOLD = int(os.getenv('EMBEDDING_IVF_THRESHOLD', '200000'))
+EMBEDDING_IVF_PROBES = int(os.getenv('EMBEDDING_IVF_PROBES', '8'))
+SEARCH_CHUNK_ROWS = 65536
+
+
+class EmbeddingForward:
+    """Callable returning (probabilities, embeddings) for a batch from one forward pass"""
+
+    def __init__(self, model):
+        import tensorflow as tf
+
+        if hasattr(model, 'layer_steps'):
+            steps, kinds = model.layer_steps()
+        else:
+            from models.mmap_weights import _iter_layers
+
+            layers = list(_iter_layers(model))
+            steps = [lambda x, layer=layer: layer(x, training=False) for layer in layers]
+            kinds = [type(layer).__name__ for layer in layers]
+        last_conv = max(i for i, kind in enumerate(kinds) if kind == 'Conv2D')
+
+        @tf.function(reduce_retracing=True)
+        def forward(x):
+            pooled = None
+            for i, step in enumerate(steps[:-1]):
+                x = step(x)
+                if i == last_conv:
+                    pooled = tf.reduce_mean(x, axis=[1, 2])
+            penultimate = tf.reshape(x, [tf.shape(x)[0], -1])
+            return steps[-1](x), penultimate, pooled
+
+        self._forward = forward
+        self.use_pooled = None
+
+    def __call__(self, img_array):
+        preds, penultimate, pooled = self._forward(np.asarray(img_array, dtype=np.float32))
+        if self.use_pooled is None:
+            self.use_pooled = penultimate.shape[-1] > EMBEDDING_MAX_DIM
+        return preds.numpy(), (pooled if self.use_pooled else penultimate).numpy()
+
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+class _IVF:
+    """Inverted-file index over a prefix of the embedding matrix"""
+
+    def __init__(self, vectors, seed=0):
+        rng = np.random.default_rng(seed)
+        n = len(vectors)
+        n_lists = max(int(np.sqrt(n)), 1)
+        sample = vectors[np.sort(rng.choice(n, min(n, 50 * n_lists), replace=False))].astype(np.float32)
+        centroids = sample[rng.choice(len(sample), n_lists, replace=False)]
+        for _ in range(10):
+            assignment = np.argmax(sample @ centroids.T, axis=1)
+            for c in range(n_lists):
+                members = sample[assignment == c]
+                if len(members):
+                    centroids[c] = members.mean(axis=0)
+            centroids = _normalize(centroids)
+
+        assignment = np.concatenate([
+            np.argmax(vectors[i:i + SEARCH_CHUNK_ROWS].astype(np.float32) @ centroids.T, axis=1)
+            for i in range(0, n, SEARCH_CHUNK_ROWS)
+        ])
+        order = np.argsort(assignment, kind='stable')
+        bounds = np.searchsorted(assignment[order], np.arange(n_lists + 1))
+        self.centroids = centroids
+        self.lists = [order[bounds[c]:bounds[c + 1]] for c in range(n_lists)]
+        self.size = n
+
+    def candidates(self, query, probes):
+        nearest = np.argsort(-(self.centroids @ query))[:probes]
+        return np.concatenate([self.lists[c] for c in nearest])
+
+
+class EmbeddingIndex:
+    """Per-process similarity index over reviewed predictions of one model version"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reset(None)
+
+    # Looked up on every use: the index is created at import, possibly in the
+    # Gunicorn master, and must use each worker's own MongoClient
+    @property
+    def collection(self):
+        return db_instance.get_collection('prediction_embeddings')
+
+    def _reset(self, version):
+        self.version = version
+        self.vectors = None
+        self.ids = []
+        self.rows = {}
+        self.synced_at = None
+        self.checked_at = 0.0
+        self.ivf = None
+        self.building = False
+
+    def ensure_indexes(self):
+        self.collection.create_index([('model_version', 1), ('reviewed', 1), ('updated_at', 1)])
+
+    def add(self, prediction_id, vector, model_version, content_hash):
+        """Store a prediction's embedding (float16)"""
+        try:
+            self.collection.insert_one({
+                '_id': ObjectId(prediction_id),
+                'model_version': model_version,
+                'content_hash': content_hash,
+                'dim': int(vector.shape[-1]),
+                'vector': Binary(np.asarray(vector, dtype=np.float16).tobytes()),
+                'reviewed': False,
+                'updated_at': datetime.utcnow()
+            })
+            return True
+        except Exception as e:
+            logger.exception("Error storing embedding: %s", e)
+            return False
+
+    def mark_reviewed(self, prediction_id):
+        """Reviewed cases become searchable on the next refresh"""
+        try:
+            self.collection.update_one(
+                {'_id': ObjectId(prediction_id)},
+                {'$set': {'reviewed': True, 'updated_at': datetime.utcnow()}}
+            )
+        except Exception as e:
+            logger.exception("Error marking embedding reviewed: %s", e)
+
+    def get(self, prediction_id):
+        return self.collection.find_one({'_id': ObjectId(prediction_id)})
+
+    def _append(self, docs):
+        new = [doc for doc in docs if doc['_id'] not in self.rows]
+        if not new:
+            return
+        block = _normalize(np.stack([
+            np.frombuffer(doc['vector'], dtype=np.float16) for doc in new
+        ])).astype(np.float16)
+
+        count = len(self.ids)
+        if self.vectors is None:
+            self.vectors = np.empty((max(1024, len(new)), block.shape[1]), dtype=np.float16)
+        elif count + len(new) > len(self.vectors):
+            grown = np.empty((max(2 * len(self.vectors), count + len(new)), block.shape[1]), dtype=np.float16)
+            grown[:count] = self.vectors[:count]
+            self.vectors = grown
+        self.vectors[count:count + len(new)] = block
+        for doc in new:
+            self.rows[doc['_id']] = len(self.ids)
+            self.ids.append(doc['_id'])
+
+    def refresh(self, version):
+        """
+        Pull reviewed embeddings added or reviewed since the last refresh. The
+        lock is only held to update the in-memory arrays; the MongoDB read and
+        IVF builds run outside it, so concurrent searches keep using the
+        current index meanwhile.
+        """
+        with self._lock:
+            if version != self.version:
+                self._reset(version)
+            if time.monotonic() - self.checked_at < EMBEDDING_REFRESH_SECONDS:
+                return
+            self.checked_at = time.monotonic()
+            synced_at = self.synced_at
+
+        query = {'model_version': version, 'reviewed': True}
+        if synced_at:
+            # Small overlap so writes committed out of order are not missed
+            query['updated_at'] = {'$gte': synced_at - timedelta(seconds=5)}
+        batch = []
+        for doc in self.collection.find(query, {'vector': 1, 'updated_at': 1}).sort('updated_at', 1):
+            batch.append(doc)
+            if len(batch) >= 10000:
+                if not self._append_batch(version, batch):
+                    return
+                batch = []
+        if not self._append_batch(version, batch):
+            return
+
+        with self._lock:
+            count = len(self.ids)
+            if self.version != version or self.building or count < EMBEDDING_IVF_THRESHOLD \
+                    or (self.ivf is not None and count < 2 * self.ivf.size):
+                return
+            self.building = True
+            # Rows below count are never rewritten, so this view stays valid
+            # even if the array is grown meanwhile
+            vectors = self.vectors[:count]
+
+        started = time.monotonic()
+        ivf = None
+        try:
+            ivf = _IVF(vectors)
+        finally:
+            with self._lock:
+                self.building = False
+                if ivf is not None and self.version == version:
+                    self.ivf = ivf
+        logger.info("Built IVF index over %d embeddings in %.1fs", count, time.monotonic() - started)
+
+    def _append_batch(self, version, docs):
+        """Add fetched docs unless the served version changed meanwhile"""
+        with self._lock:
+            if self.version != version:
+                return False
+            self._append(docs)
+            if docs:
+                self.synced_at = max(self.synced_at or docs[-1]['updated_at'], docs[-1]['updated_at'])
+            return True
+
+    def search(self, vector, version, k=5, exclude=()):
+        """[(prediction_id, cosine similarity)] of the k nearest reviewed cases"""
+        self.refresh(version)
+        with self._lock:
+            vectors, ids, ivf = self.vectors, list(self.ids), self.ivf
+        count = len(ids)
+        if not count:
+            return []
+
+        query = _normalize(vector)
+        if ivf is not None:
+            # Rows added after the IVF was built are scanned directly
+            candidates = np.concatenate([
+                ivf.candidates(query, EMBEDDING_IVF_PROBES), np.arange(ivf.size, count)
+            ])
+            scores = vectors[candidates].astype(np.float32) @ query
+        else:
+            candidates = None
+            scores = np.concatenate([
+                vectors[i:min(i + SEARCH_CHUNK_ROWS, count)].astype(np.float32) @ query
+                for i in range(0, count, SEARCH_CHUNK_ROWS)
+            ])
+
+        wanted = min(k + len(exclude), len(scores))
+        top = np.argpartition(-scores, wanted - 1)[:wanted]
+        top = top[np.argsort(-scores[top])]
+        results = []
+        for i in top:
+            row = candidates[i] if candidates is not None else i
+            if ids[row] in exclude:
+                continue
+            results.append((ids[row], float(scores[i])))
+            if len(results) == k:
+                break
+        return results
+
+
+embedding_index = EmbeddingIndex()
@@ -0,0 +1,211 @@
+"""
+Grad-CAM heatmaps for stored predictions, generated off the request path.
+
+New predictions are created with heatmap_status 'pending'. The worker
+
+    python -m models.gradcam            # poll forever
+    python -m models.gradcam --once     # drain the backlog and exit
+
+takes pending predictions in batches, runs one batched forward/backward pass
+through the Keras model for the distinct scans in the batch, and writes each
+heatmap as an 8-bit grayscale PNG under
+
+    GRADCAM_ROOT/<model version>/<sharded content hash>.png
+
+so a scan uploaded again (or re-predicted by the same model) reuses the
+stored heatmap. Heatmaps are keyed by the serving model version (see
+models/registry.py), so a new model starts a fresh cache instead of serving
+stale maps, and the worker follows version swaps like the API workers do.
+
+This module only imports TensorFlow inside GradCAM and the worker, so the
+API can import it to serve heatmaps without loading a model.
+"""
+
+import argparse
+import io
+import os
+import sys
+import time
+import numpy as np
+from PIL import Image
+from utils.upload_store import shard_path
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+GRADCAM_ROOT = os.getenv('GRADCAM_ROOT', 'uploads/heatmaps')
+GRADCAM_BATCH_SIZE = int(os.getenv('GRADCAM_BATCH_SIZE', '16'))
+GRADCAM_POLL_SECONDS = float(os.getenv('GRADCAM_POLL_SECONDS', '5'))
+OVERLAY_ALPHA = 0.45
+
+
+def heatmap_path(version, content_hash, root=GRADCAM_ROOT):
+    return shard_path(os.path.join(root, version), content_hash) + '.png'
+
+
+def save_heatmap(path, heatmap):
+    """Write a uint8 HxW heatmap as PNG, atomically"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + '.tmp'
+    Image.fromarray(heatmap).save(tmp_path, format='PNG', optimize=True)
+    os.replace(tmp_path, path)
+
+
+def _jet(values):
+    """Jet colormap for values in [0, 1]; returns uint8 RGB"""
+    rgb = np.stack([
+        np.clip(1.5 - np.abs(4 * values - 3), 0, 1),
+        np.clip(1.5 - np.abs(4 * values - 2), 0, 1),
+        np.clip(1.5 - np.abs(4 * values - 1), 0, 1)
+    ], axis=-1)
+    return (rgb * 255).astype(np.uint8)
+
+
+def render_overlay(path, scan_path):
+    """PNG bytes of the heatmap blended over the original scan"""
+    heatmap = np.asarray(Image.open(path), dtype=np.float32) / 255.0
+    colored = Image.fromarray(_jet(heatmap))
+    with Image.open(scan_path) as scan:
+        scan = scan.convert('RGB').resize(colored.size)
+    output = io.BytesIO()
+    Image.blend(scan, colored, OVERLAY_ALPHA).save(output, format='PNG')
+    output.seek(0)
+    return output
+
+
+class GradCAM:
+    """Batched Grad-CAM over the last Conv2D layer of a linear Keras model"""
+
+    def __init__(self, keras_model):
+        from models.mmap_weights import _iter_layers
+
+        self.layers = list(_iter_layers(keras_model))
+        conv_layers = [i for i, layer in enumerate(self.layers) if type(layer).__name__ == 'Conv2D']
+        if not conv_layers:
+            raise ValueError("Model has no Conv2D layer to explain")
+        self.conv_index = conv_layers[-1]
+
+    def _scores(self, features, class_indices):
+        """Pre-softmax score of each image's class, so gradients do not saturate"""
+        import tensorflow as tf
+
+        x = features
+        head = self.layers[self.conv_index + 1:]
+        last = head[-1]
+        for layer in head[:-1]:
+            x = layer(x, training=False)
+        if type(last).__name__ == 'Dense' and last.get_config().get('activation') == 'softmax':
+            x = tf.matmul(x, last.kernel)
+            if last.use_bias:
+                x = x + last.bias
+        else:
+            x = last(x, training=False)
+        return tf.gather(x, class_indices, axis=1, batch_dims=1)
+
+    def compute(self, batch, class_indices):
+        """uint8 heatmaps (N x H x W, input resolution) for a batch of preprocessed images"""
+        import tensorflow as tf
+
+        x = tf.convert_to_tensor(batch, dtype=tf.float32)
+        for layer in self.layers[:self.conv_index + 1]:
+            x = layer(x, training=False)
+        features = x
+
+        with tf.GradientTape() as tape:
+            tape.watch(features)
+            scores = self._scores(features, tf.constant(class_indices))
+        grads = tape.gradient(scores, features)
+
+        weights = tf.reduce_mean(grads, axis=(1, 2), keepdims=True)
+        cam = tf.nn.relu(tf.reduce_sum(weights * features, axis=-1))
+        cam = cam / (tf.reduce_max(cam, axis=(1, 2), keepdims=True) + 1e-8)
+        cam = tf.image.resize(cam[..., tf.newaxis], batch.shape[1:3], method='bilinear')[..., 0]
+        return (cam.numpy() * 255).astype(np.uint8)
+
+
+def process_batch(prediction_model, upload_store, cam, version, batch_size=GRADCAM_BATCH_SIZE):
+    """Generate heatmaps for one batch of pending predictions; returns how many were handled"""
+    from models.ml_model import class_labels, load_preprocessed
+
+    pending = prediction_model.get_pending_heatmaps(batch_size)
+    if not pending:
+        return 0
+
+    results = {}
+    by_hash = {}
+    for doc in pending:
+        if os.path.exists(heatmap_path(version, doc['content_hash'])):
+            results[doc['_id']] = 'ready'  # same scan already explained by this model
+        else:
+            by_hash.setdefault(doc['content_hash'], []).append(doc)
+
+    inputs, hashes, classes = [], [], []
+    for content_hash, docs in by_hash.items():
+        try:
+            image_path = upload_store.local_path(content_hash)
+            inputs.append(load_preprocessed(image_path, content_hash)[0])
+            classes.append(class_labels.index(docs[0]['prediction']))
+            hashes.append(content_hash)
+        except Exception as e:
+            logger.warning("Cannot build heatmap for %s: %s", content_hash, e)
+            results.update({doc['_id']: 'failed' for doc in docs})
+
+    if inputs:
+        try:
+            heatmaps = cam.compute(np.stack(inputs), classes)
+            for content_hash, heatmap in zip(hashes, heatmaps):
+                save_heatmap(heatmap_path(version, content_hash), heatmap)
+                results.update({doc['_id']: 'ready' for doc in by_hash[content_hash]})
+        except Exception as e:
+            # Mark the batch failed rather than retrying it forever
+            logger.exception("Grad-CAM batch failed: %s", e)
+            for content_hash in hashes:
+                results.update({doc['_id']: 'failed' for doc in by_hash[content_hash]})
+
+    prediction_model.set_heatmap_results(results, version)
+    return len(pending)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate Grad-CAM heatmaps for pending predictions")
+    parser.add_argument('--once', action='store_true', help="Process the current backlog and exit")
+    parser.add_argument('--batch-size', type=int, default=GRADCAM_BATCH_SIZE)
+    args = parser.parse_args(argv)
+
+    from tensorflow.keras.models import load_model
+    from models import ml_model
+    from models.prediction import Prediction
+    from utils.upload_store import get_upload_store
+
+    server = ml_model.model_server
+    server.start()
+    prediction_model = Prediction()
+    prediction_model.ensure_heatmap_index()
+    upload_store = get_upload_store()
+    cam, version = None, None
+
+    while True:
+        if server.version != version:
+            version = server.version
+            keras_model = server.model
+            if ml_model.USE_MMAP_WEIGHTS:
+                # Gradients need the Keras graph, not the memory-mapped inference copy
+                model_path = ml_model.registry.artifact_paths(version)[0]
+                if not os.path.exists(model_path):
+                    model_path = ml_model.MODEL_PATH
+                keras_model = load_model(model_path, custom_objects={'InputLayer': ml_model.input_layer_fix})
+            cam = GradCAM(keras_model)
+            logger.info("Grad-CAM worker using model version %s (batch size %d)", version, args.batch_size)
+
+        started = time.monotonic()
+        handled = process_batch(prediction_model, upload_store, cam, version, args.batch_size)
+        if handled:
+            logger.info("Generated heatmaps for %d predictions in %.2fs", handled, time.monotonic() - started)
+        elif args.once:
+            return 0
+        else:
+            time.sleep(GRADCAM_POLL_SECONDS)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
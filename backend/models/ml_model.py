@@ -1,3 +1,4 @@
+import fcntl
 import os
 import numpy as np
 import gdown
@@ -5,11 +6,24 @@ from tensorflow.keras.models import load_model
 from tensorflow.keras.layers import InputLayer
 from tensorflow.keras.preprocessing.image import load_img, img_to_array
 from tensorflow.keras.applications.vgg16 import preprocess_input
+from utils.metrics import PREPROCESS_LATENCY, MODEL_LATENCY, TENSOR_CACHE_REQUESTS, NEAR_DUPLICATES
+from utils.tensor_cache import TENSOR_CACHE_ENABLED, TensorCache
+from models.cascade import CASCADE_ENABLED, load_cascade
+from models.registry import ModelRegistry, ModelServer, artifact_version
+from models.phash import NEAR_DUPLICATE_MODE, near_duplicate_index, perceptual_hash
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
 
 # --- Model path ---
 MODEL_DIR = "models"
 MODEL_PATH = os.path.join(MODEL_DIR, "model.keras")
 
+# Flat, memory-mapped copy of the weights (see models/mmap_weights.py)
+WEIGHTS_PATH = os.path.join(MODEL_DIR, "model.weights.bin")
+MANIFEST_PATH = os.path.join(MODEL_DIR, "model.weights.json")
+USE_MMAP_WEIGHTS = os.getenv("MODEL_WEIGHTS_MMAP", "false").lower() == "true"
+
 
 MODEL_URL = "https://drive.google.com/file/d/1h7_N71pWN4gcPzZ8b9h34Mp5HhRwyEze/view?usp=sharing"
 
@@ -21,19 +35,72 @@ def input_layer_fix(*args, **kwargs):
 # --- Download model if not exists ---
 if not os.path.exists(MODEL_PATH):
     os.makedirs(MODEL_DIR, exist_ok=True)
-    print("Downloading model from Google Drive...")
+    logger.info("Downloading model from Google Drive...")
     gdown.download(MODEL_URL, MODEL_PATH, quiet=False)
 
 # --- Load the model safely ---
-model = load_model(MODEL_PATH, custom_objects={'InputLayer': input_layer_fix})
-print("✅ Model loaded successfully!")
+def _export_once(model_path, weights_path, manifest_path):
+    """
+    Write the memory-mapped export of a model unless it exists. Workers that
+    hot-swap to the same version at once wait on a file lock, so one exports
+    and the rest map the finished files (the manifest is renamed into place last).
+    """
+    from models.mmap_weights import export_weights
+
+    with open(manifest_path + '.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if os.path.exists(manifest_path):
+            return
+        logger.info("Exporting model weights to memory-mapped format...")
+        keras_model = load_model(model_path, custom_objects={'InputLayer': input_layer_fix})
+        export_weights(keras_model, weights_path, manifest_path)
+        del keras_model
+
+
+def load_artifact(model_path, weights_path, manifest_path):
+    """Load a model file, or its memory-mapped export when MODEL_WEIGHTS_MMAP is on"""
+    if USE_MMAP_WEIGHTS:
+        from models.mmap_weights import MappedModel
+
+        if not os.path.exists(manifest_path):
+            _export_once(model_path, weights_path, manifest_path)
+        return MappedModel(weights_path, manifest_path)
+    return load_model(model_path, custom_objects={'InputLayer': input_layer_fix})
 
 # --- Class labels (must match training label order) ---
 class_labels = ['glioma', 'meningioma', 'notumor', 'pituitary']
 
+# The bundled model is loaded here, before fork, without touching MongoDB
+# (a MongoClient created in the Gunicorn master would be shared by every
+# worker). Each worker switches to the registry's active version, if it is a
+# different one, in ModelServer.start() before serving.
+registry = ModelRegistry()
+model = load_artifact(MODEL_PATH, WEIGHTS_PATH, MANIFEST_PATH)
+model_version = artifact_version(MODEL_PATH)
+logger.info("✅ Model %s loaded successfully%s!", model_version,
+            " (memory-mapped weights)" if USE_MMAP_WEIGHTS else "")
+
+# Swaps in new registry versions without a restart (sync thread started per worker)
+model_server = ModelServer(model, model_version, load_artifact, registry, len(class_labels))
+
+# --- Optional screening stage (see models/cascade.py) ---
+cascade = load_cascade(model_server) if CASCADE_ENABLED else None
+
 # --- Brain regions (optional) ---
 regions = ["Frontal Lobe", "Parietal Lobe", "Occipital Lobe", "Temporal Lobe"]
 
+# --- Preprocessed tensor cache ---
+# Bump PREPROCESS_VERSION whenever preprocess_image changes; cached tensors
+# from other versions are then ignored.
+IMAGE_SIZE = 224
+PREPROCESS_VERSION = 1
+tensor_cache = TensorCache(f"vgg16-{IMAGE_SIZE}-v{PREPROCESS_VERSION}")
+if TENSOR_CACHE_ENABLED:
+    try:
+        tensor_cache.mark_current()  # lets the retention job prune other versions
+    except OSError as e:
+        logger.warning("Could not record tensor cache version: %s", e)
+
 # --- Preprocess single image ---
 def preprocess_image(image_path, image_size=224):
     """
@@ -45,14 +112,62 @@ def preprocess_image(image_path, image_size=224):
     img_array = np.expand_dims(img_array, axis=0)  # Add batch dimension
     return img_array
 
+def load_preprocessed(image_path, content_hash=None):
+    """
+    Preprocessed batch for an image, served from the tensor cache when the
+    upload's content hash is known.
+    """
+    if not TENSOR_CACHE_ENABLED or not content_hash:
+        return preprocess_image(image_path, IMAGE_SIZE)
+
+    cached = tensor_cache.get(content_hash)
+    if cached is not None:
+        TENSOR_CACHE_REQUESTS.labels('hit').inc()
+        return cached[np.newaxis]  # still a view on the mapped file
+
+    TENSOR_CACHE_REQUESTS.labels('miss').inc()
+    img_array = preprocess_image(image_path, IMAGE_SIZE)
+    try:
+        tensor_cache.put(content_hash, img_array[0])
+    except Exception as e:
+        logger.exception("Error caching preprocessed tensor: %s", e)
+    return img_array
+
 # --- Prediction function ---
-def predict_mri(image_path):
+def predict_mri(image_path, content_hash=None, patient_id=None):
     """
     Predict tumor type and confidence for a single MRI image.
+    Pass the upload's content hash to reuse its cached preprocessed tensor.
+
+    Near-duplicates of a scan already scored by the serving model (see
+    models/phash.py) are flagged; with NEAR_DUPLICATE_MODE=reuse, one that is
+    the same file or the same patient's scan reuses its result without a
+    model run.
     """
-    img_array = preprocess_image(image_path, 224)
-    
-    preds = model.predict(img_array)
+    with PREPROCESS_LATENCY.time():
+        img_array = load_preprocessed(image_path, content_hash)
+        phash = perceptual_hash(img_array)
+
+    near_duplicate = None
+    if NEAR_DUPLICATE_MODE in ('reuse', 'flag'):
+        version = model_server.version
+        match = near_duplicate_index.find(phash, version, content_hash, patient_id)
+        if match:
+            earlier, distance, reusable = match
+            reused = NEAR_DUPLICATE_MODE == 'reuse' and reusable
+            NEAR_DUPLICATES.labels('reused' if reused else 'flagged').inc()
+            near_duplicate = {'prediction_id': earlier['_id'], 'distance': distance, 'reused': reused}
+            if reused:
+                return {
+                    **earlier['result'],
+                    "model_version": version,
+                    "embedding": None,
+                    "phash": f"{phash:016x}",
+                    "near_duplicate": near_duplicate
+                }
+
+    with MODEL_LATENCY.time():
+        preds, embedding, version = cascade.infer(img_array) if cascade else model_server.infer(img_array)
     predicted_index = np.argmax(preds, axis=1)[0]
     confidence = float(np.max(preds, axis=1)[0] * 100)
 
@@ -63,5 +178,10 @@ def predict_mri(image_path):
     return {
         "prediction": class_labels[predicted_index],
         "confidence": confidence,
-        "region": region
+        "region": region,
+        "model_version": version,
+        # Penultimate-layer features for similar-case search (None when the screen decided)
+        "embedding": None if embedding is None else embedding[0],
+        "phash": f"{phash:016x}",
+        "near_duplicate": near_duplicate
     }
@@ -0,0 +1,277 @@
+"""
+Flat, read-only weight file for the tumor classifier.
+
+`export_weights` walks the Keras model once and writes every layer's weights
+into a single binary file (64-byte aligned, float32) plus a small JSON
+manifest describing the layer stack. `MappedModel` memory-maps that file and
+runs inference with TensorFlow ops whose weight tensors wrap the mapped
+buffers directly, so every worker process on a host shares one physical copy
+of the weights through the page cache instead of holding its own.
+
+Usage (from the backend directory):
+    python -m models.mmap_weights export
+    python -m models.mmap_weights measure --workers 4
+"""
+
+import argparse
+import json
+import os
+import sys
+import numpy as np
+
+FORMAT_VERSION = 1
+ALIGNMENT = 64  # TensorFlow only aliases NumPy buffers aligned to this many bytes
+
+# Config keys kept in the manifest for each supported layer type
+SUPPORTED_LAYERS = {
+    'Conv2D': ['strides', 'padding', 'dilation_rate', 'activation', 'use_bias', 'data_format'],
+    'MaxPooling2D': ['pool_size', 'strides', 'padding', 'data_format'],
+    'AveragePooling2D': ['pool_size', 'strides', 'padding', 'data_format'],
+    'GlobalAveragePooling2D': ['data_format'],
+    'GlobalMaxPooling2D': ['data_format'],
+    'BatchNormalization': ['epsilon', 'center', 'scale'],
+    'Flatten': [],
+    'Dense': ['activation', 'use_bias'],
+    'Dropout': [],
+    'Activation': ['activation'],
+    'ReLU': [],
+}
+
+
+def _iter_layers(model):
+    """Yield the leaf layers of a (possibly nested) Keras model in order"""
+    for layer in model.layers:
+        if type(layer).__name__ == 'InputLayer':
+            continue
+        if getattr(layer, 'layers', None):
+            # Nested model, e.g. the VGG16 base inside the classifier
+            yield from _iter_layers(layer)
+        else:
+            yield layer
+
+
+def export_weights(model, weights_path, manifest_path):
+    """Write the model's weights to a flat aligned file and a JSON manifest"""
+    layers = []
+    tmp_weights = weights_path + '.tmp'
+
+    with open(tmp_weights, 'wb') as f:
+        offset = 0
+        for layer in _iter_layers(model):
+            layer_type = type(layer).__name__
+            if layer_type not in SUPPORTED_LAYERS:
+                raise ValueError(f"Layer type {layer_type} ({layer.name}) is not supported")
+
+            config = layer.get_config()
+            if config.get('data_format', 'channels_last') != 'channels_last':
+                raise ValueError(f"Layer {layer.name} uses {config['data_format']}, only channels_last is supported")
+
+            arrays = []
+            for weight in layer.get_weights():
+                weight = np.ascontiguousarray(weight, dtype=np.float32)
+                padding = (-offset) % ALIGNMENT
+                f.write(b'\0' * padding)
+                offset += padding
+                arrays.append({'offset': offset, 'shape': list(weight.shape)})
+                f.write(weight.tobytes())
+                offset += weight.nbytes
+
+            layers.append({
+                'name': layer.name,
+                'type': layer_type,
+                'config': {key: config[key] for key in SUPPORTED_LAYERS[layer_type] if key in config},
+                'weights': arrays
+            })
+
+    manifest = {
+        'format_version': FORMAT_VERSION,
+        'dtype': 'float32',
+        'input_shape': list(model.input_shape[1:]),
+        'total_bytes': offset,
+        'layers': layers
+    }
+    tmp_manifest = manifest_path + '.tmp'
+    with open(tmp_manifest, 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+    # Weights are never written after export
+    os.chmod(tmp_weights, 0o444)
+    os.replace(tmp_weights, weights_path)
+    os.replace(tmp_manifest, manifest_path)
+    return manifest
+
+
+def _apply_layer(x, layer_type, config, weights):
+    """Run one manifest layer with plain TensorFlow ops"""
+    import tensorflow as tf
+
+    activations = {
+        None: tf.identity,
+        'linear': tf.identity,
+        'relu': tf.nn.relu,
+        'softmax': tf.nn.softmax,
+        'sigmoid': tf.nn.sigmoid,
+        'tanh': tf.nn.tanh,
+    }
+    if layer_type == 'Conv2D':
+        x = tf.nn.conv2d(x, weights[0], strides=config['strides'],
+                         padding=config['padding'].upper(), dilations=config['dilation_rate'])
+        if config.get('use_bias', True):
+            x = tf.nn.bias_add(x, weights[1])
+        return activations[config.get('activation')](x)
+    if layer_type in ('MaxPooling2D', 'AveragePooling2D'):
+        pool = tf.nn.max_pool2d if layer_type == 'MaxPooling2D' else tf.nn.avg_pool2d
+        strides = config.get('strides') or config['pool_size']
+        return pool(x, ksize=config['pool_size'], strides=strides, padding=config['padding'].upper())
+    if layer_type == 'GlobalAveragePooling2D':
+        return tf.reduce_mean(x, axis=[1, 2])
+    if layer_type == 'GlobalMaxPooling2D':
+        return tf.reduce_max(x, axis=[1, 2])
+    if layer_type == 'BatchNormalization':
+        weights = list(weights)
+        gamma = weights.pop(0) if config.get('scale', True) else None
+        beta = weights.pop(0) if config.get('center', True) else None
+        mean, variance = weights
+        return tf.nn.batch_normalization(x, mean, variance, beta, gamma, config['epsilon'])
+    if layer_type == 'Flatten':
+        return tf.reshape(x, [tf.shape(x)[0], -1])
+    if layer_type == 'Dense':
+        x = tf.matmul(x, weights[0])
+        if config.get('use_bias', True):
+            x = x + weights[1]
+        return activations[config.get('activation')](x)
+    if layer_type == 'Activation':
+        return activations[config['activation']](x)
+    if layer_type == 'ReLU':
+        return tf.nn.relu(x)
+    # Dropout is a no-op at inference time
+    return x
+
+
+class MappedModel:
+    """Inference-only model built on top of a memory-mapped weight file"""
+
+    def __init__(self, weights_path, manifest_path):
+        with open(manifest_path) as f:
+            self.manifest = json.load(f)
+        if self.manifest.get('format_version') != FORMAT_VERSION:
+            raise ValueError(f"Unsupported weight file version: {self.manifest.get('format_version')}")
+
+        self._mmap = np.memmap(weights_path, dtype=np.uint8, mode='r')
+        if self._mmap.size < self.manifest['total_bytes']:
+            raise ValueError(f"Weight file {weights_path} is truncated")
+
+        self.input_shape = (None, *self.manifest['input_shape'])
+        self._layers = [self._build_layer(spec) for spec in self.manifest['layers']]
+        self._forward = self._build_forward()
+
+    def _mapped_array(self, spec):
+        """Zero-copy view into the mapped file"""
+        return np.ndarray(tuple(spec['shape']), dtype=np.float32, buffer=self._mmap, offset=spec['offset'])
+
+    def _build_layer(self, spec):
+        import tensorflow as tf
+
+        # On CPU, TensorFlow wraps aligned NumPy buffers instead of copying them,
+        # so these tensors point straight at the mapped pages
+        weights = [tf.convert_to_tensor(self._mapped_array(w)) for w in spec['weights']]
+        return spec['type'], spec['config'], weights
+
+    def _build_forward(self):
+        import tensorflow as tf
+
+        @tf.function(input_signature=[tf.TensorSpec(self.input_shape, tf.float32)])
+        def forward(x):
+            for layer_type, config, weights in self._layers:
+                x = _apply_layer(x, layer_type, config, weights)
+            return x
+
+        return forward
+
+    def layer_steps(self):
+        """(callables, layer type names) for running the layer stack step by step"""
+        steps = [
+            lambda x, layer=layer: _apply_layer(x, *layer)
+            for layer in self._layers
+        ]
+        return steps, [layer_type for layer_type, _, _ in self._layers]
+
+    def predict(self, x, **kwargs):
+        """Same contract as keras.Model.predict for a batch of images"""
+        return self._forward(np.asarray(x, dtype=np.float32)).numpy()
+
+
+# --- RSS measurement ---
+def _memory_usage():
+    """Rss/Pss/Private memory of this process in MB (Linux only)"""
+    usage = {}
+    with open('/proc/self/smaps_rollup') as f:
+        for line in f:
+            key, _, value = line.partition(':')
+            if key in ('Rss', 'Pss', 'Private_Clean', 'Private_Dirty'):
+                usage[key] = int(value.split()[0]) / 1024
+    return {
+        'rss': usage.get('Rss', 0.0),
+        'pss': usage.get('Pss', 0.0),
+        'private': usage.get('Private_Clean', 0.0) + usage.get('Private_Dirty', 0.0)
+    }
+
+
+def _measure_worker(use_mmap, barrier, results):
+    os.environ['MODEL_WEIGHTS_MMAP'] = 'true' if use_mmap else 'false'
+    from models.ml_model import model
+
+    model.predict(np.zeros((1, 224, 224, 3), dtype=np.float32), verbose=0)
+    barrier.wait()  # measure while every worker is alive so sharing shows up in Pss
+    results.put(_memory_usage())
+    barrier.wait()
+
+
+def measure_rss(workers):
+    """Start `workers` processes per loading mode and report memory per worker"""
+    import multiprocessing
+
+    ctx = multiprocessing.get_context('spawn')
+    report = {}
+    for use_mmap in (False, True):
+        barrier = ctx.Barrier(workers)
+        results = ctx.Queue()
+        processes = [ctx.Process(target=_measure_worker, args=(use_mmap, barrier, results)) for _ in range(workers)]
+        for p in processes:
+            p.start()
+        samples = [results.get() for _ in processes]
+        for p in processes:
+            p.join()
+
+        mode = 'mmap' if use_mmap else 'keras'
+        report[mode] = {key: sum(s[key] for s in samples) / len(samples) for key in ('rss', 'pss', 'private')}
+        report[mode]['total_pss'] = sum(s['pss'] for s in samples)
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export or benchmark the memory-mapped model weights")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('export', help="Export model.keras to the flat weight file")
+    measure = subparsers.add_parser('measure', help="Compare per-worker memory for keras vs mmap loading")
+    measure.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args(argv)
+
+    if args.command == 'export':
+        os.environ['MODEL_WEIGHTS_MMAP'] = 'false'
+        from models import ml_model
+
+        manifest = export_weights(ml_model.model, ml_model.WEIGHTS_PATH, ml_model.MANIFEST_PATH)
+        print(f"Exported {len(manifest['layers'])} layers ({manifest['total_bytes'] / 1024 / 1024:.1f} MB) "
+              f"to {ml_model.WEIGHTS_PATH}")
+    else:
+        report = measure_rss(args.workers)
+        print(f"{'mode':<8}{'RSS/worker':>14}{'PSS/worker':>14}{'private/worker':>16}{'total PSS':>12}")
+        for mode, stats in report.items():
+            print(f"{mode:<8}{stats['rss']:>11.1f} MB{stats['pss']:>11.1f} MB"
+                  f"{stats['private']:>13.1f} MB{stats['total_pss']:>9.1f} MB")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
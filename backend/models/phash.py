@@ -0,0 +1,159 @@
+"""
+Perceptual hashes of scans for near-duplicate detection.
+
+The content hash only catches byte-identical uploads. A re-encoded JPEG, a
+resized copy or a screenshot of the same scan gets a new content hash but
+nearly the same perceptual hash: a 64-bit DCT hash of the preprocessed model
+input (grayscale, 32x32, sign of the low-frequency coefficients against
+their median), so it sees exactly what the model sees.
+
+Hashes of scored scans are stored in `image_hashes` together with the
+prediction they produced. Hamming-distance lookups use multi-index hashing:
+the 64 bits are split into PHASH_BANDS bands and every band value is indexed,
+so any hash within PHASH_BANDS - 1 bits of the query shares at least one band
+with it (pigeonhole). MongoDB returns the few hashes sharing a band and the
+exact distance is checked here.
+
+What a near-duplicate does is set by NEAR_DUPLICATE_MODE:
+    flag   run the model anyway and record the earlier prediction (default)
+    reuse  like flag, but copy the earlier result and skip the model run
+           when the earlier scan is the same file (content hash) or belongs
+           to the same patient; a perceptual match alone never hands one
+           patient's result to another, since brain MRIs share much of
+           their low-frequency structure
+    off    no lookups
+"""
+
+import os
+from datetime import datetime
+import numpy as np
+from bson import ObjectId
+from utils.db import db_instance
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+NEAR_DUPLICATE_MODE = os.getenv('NEAR_DUPLICATE_MODE', 'flag').lower()
+PHASH_BANDS = 6
+PHASH_MAX_DISTANCE = min(int(os.getenv('PHASH_MAX_DISTANCE', '4')), PHASH_BANDS - 1)
+HASH_SIZE = 8
+DCT_SIZE = 32
+MAX_CANDIDATES = 200
+
+
+def _dct_matrix(n):
+    k = np.arange(n)[:, np.newaxis]
+    return np.cos(np.pi * (2 * np.arange(n) + 1) * k / (2 * n))
+
+
+_DCT = _dct_matrix(DCT_SIZE)
+# Bit ranges of each band, as even as possible (11, 11, 11, 11, 10, 10 for six bands)
+_BAND_EDGES = np.linspace(0, HASH_SIZE * HASH_SIZE, PHASH_BANDS + 1).astype(int).tolist()
+
+
+def _block_mean(image, size):
+    """Area-average an HxW array down to size x size"""
+    for axis in (0, 1):
+        edges = np.linspace(0, image.shape[axis], size + 1).astype(int)
+        sums = np.add.reduceat(image, edges[:-1], axis=axis)
+        counts = np.diff(edges).reshape((-1, 1) if axis == 0 else (1, -1))
+        image = sums / counts
+    return image
+
+
+def perceptual_hash(img_array):
+    """64-bit DCT hash (unsigned int) of one preprocessed image (HxWxC or 1xHxWxC)"""
+    img = np.asarray(img_array, dtype=np.float32)
+    if img.ndim == 4:
+        img = img[0]
+    gray = _block_mean(img.mean(axis=-1), DCT_SIZE)
+    low = (_DCT @ gray @ _DCT.T)[:HASH_SIZE, :HASH_SIZE].ravel()
+    bits = low > np.median(low)
+    return int(''.join('1' if b else '0' for b in bits), 2)
+
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+
+def _bands(phash):
+    """Band values tagged with their position, for the multikey index"""
+    total = HASH_SIZE * HASH_SIZE
+    bands = []
+    for i in range(PHASH_BANDS):
+        start, end = _BAND_EDGES[i], _BAND_EDGES[i + 1]
+        value = (phash >> (total - end)) & ((1 << (end - start)) - 1)
+        bands.append(i << 32 | int(value))
+    return bands
+
+
+def _to_int64(phash):
+    """MongoDB integers are signed 64-bit"""
+    return phash - (1 << 64) if phash >= 1 << 63 else phash
+
+
+def _from_int64(value):
+    return value + (1 << 64) if value < 0 else value
+
+
+def _reusable(doc, content_hash, patient_id):
+    """An earlier result may be copied only for the same file or the same patient"""
+    if content_hash and doc.get('content_hash') == content_hash:
+        return True
+    return bool(patient_id) and doc.get('patient_id') == ObjectId(patient_id)
+
+
+class NearDuplicateIndex:
+    # Looked up on every use: the index is created at import, possibly in the
+    # Gunicorn master, and must use each worker's own MongoClient
+    @property
+    def collection(self):
+        return db_instance.get_collection('image_hashes')
+
+    def ensure_indexes(self):
+        self.collection.create_index([('model_version', 1), ('bands', 1)])
+
+    def add(self, prediction_id, phash, content_hash, result, patient_id=None):
+        """Record the perceptual hash of a scan the model scored, with the model's result"""
+        try:
+            self.collection.insert_one({
+                '_id': ObjectId(prediction_id),
+                'phash': _to_int64(phash),
+                'bands': _bands(phash),
+                'content_hash': content_hash,
+                'patient_id': ObjectId(patient_id) if patient_id else None,
+                'model_version': result['model_version'],
+                'result': {key: result[key] for key in ('prediction', 'confidence', 'region')},
+                'created_at': datetime.utcnow()
+            })
+            return True
+        except Exception as e:
+            logger.exception("Error storing perceptual hash: %s", e)
+            return False
+
+    def find(self, phash, model_version, content_hash=None, patient_id=None, max_distance=PHASH_MAX_DISTANCE):
+        """
+        Closest earlier scan scored by model_version within max_distance bits,
+        preferring one whose result may be reused for this upload (same
+        content hash or same patient): (doc, distance, reusable) or None
+        """
+        try:
+            candidates = self.collection.find(
+                {'model_version': model_version, 'bands': {'$in': _bands(phash)}},
+                {'phash': 1, 'content_hash': 1, 'patient_id': 1, 'result': 1}
+            ).limit(MAX_CANDIDATES)
+            best = None
+            for doc in candidates:
+                distance = hamming(phash, _from_int64(doc['phash']))
+                if distance > max_distance:
+                    continue
+                match = (doc, distance, _reusable(doc, content_hash, patient_id))
+                if best is None or (not match[2], distance) < (not best[2], best[1]):
+                    best = match
+            return best
+        except Exception as e:
+            logger.exception("Error looking up perceptual hash: %s", e)
+            return None
+
+
+near_duplicate_index = NearDuplicateIndex()
@@ -1,31 +1,378 @@
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+from bson import ObjectId
+from pymongo import ReturnDocument, UpdateOne
+from utils.db import READ_ANALYTICS, READ_LIST, db_instance
+from utils.events import event_bus, role_audience, user_audience
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+# Review queue ordering: tumor classes first, then the least confident,
+# boosted by the most pressing open appointment of the patient
+REVIEW_CLASS_WEIGHTS = {'glioma': 40, 'meningioma': 30, 'pituitary': 30, 'notumor': 0}
+REVIEW_UNCERTAINTY_WEIGHT = 30
+APPOINTMENT_PRIORITY_WEIGHTS = {'normal': 0, 'urgent': 25, 'emergency': 50}
+REVIEW_LEASE_SECONDS = int(os.getenv('REVIEW_LEASE_SECONDS', '900'))
+
+
+def review_priority_base(prediction, confidence):
+    """Priority of a prediction before the appointment boost (higher is reviewed first)"""
+    return REVIEW_CLASS_WEIGHTS.get(prediction, 0) + REVIEW_UNCERTAINTY_WEIGHT * (100 - confidence) / 100
+
+
+def _claimable_by(doctor_id, now):
+    """Not claimed, claim expired, or claimed by this doctor"""
+    return {'$or': [
+        {'review_claim': None},
+        {'review_claim.until': {'$lte': now}},
+        {'review_claim.doctor_id': ObjectId(doctor_id)}
+    ]}
+
+
 class Prediction:
-    """
-    Dummy class for storing prediction data.
-    Replace with real DB logic if needed.
-    """
     def __init__(self):
-        self.storage = []
-        self.counter = 1
+        self.collection = db_instance.get_collection('predictions')
+        self.appointments = db_instance.get_collection('appointments')
+        # Admin lists and statistics may read slightly stale data from a secondary
+        self.list_reads = db_instance.get_collection('predictions', READ_LIST)
+        self.analytics_reads = db_instance.get_collection('predictions', READ_ANALYTICS)
 
-    def create_prediction(self, data):
-        data['prediction_id'] = self.counter
-        self.storage.append(data)
-        self.counter += 1
-        return data['prediction_id']
+    def create_prediction(self, prediction_data):
+        """Store a model prediction for an uploaded scan"""
+        try:
+            patient_id = prediction_data.get('patient_id')
+            priority_base = review_priority_base(prediction_data['prediction'], prediction_data['confidence'])
+            prediction_doc = {
+                'patient_id': ObjectId(patient_id) if patient_id else None,
+                'doctor_id': None,
+                'upload_id': ObjectId(prediction_data['upload_id']),
+                'content_hash': prediction_data['content_hash'],
+                'original_filename': prediction_data.get('original_filename', ''),
+                'prediction': prediction_data['prediction'],
+                'confidence': prediction_data['confidence'],
+                'region': prediction_data.get('region', ''),
+                'model_version': prediction_data.get('model_version'),
+                'phash': prediction_data.get('phash'),
+                # Earlier prediction for a near-identical scan (see models/phash.py)
+                'near_duplicate': prediction_data.get('near_duplicate'),
+                'reviewed_by_doctor': False,
+                'doctor_notes': '',
+                'final_diagnosis': '',
+                'heatmap_status': 'pending',  # pending, ready, failed (see models/gradcam.py)
+                'review_priority_base': priority_base,
+                'review_priority': priority_base + (self._appointment_weight(patient_id) if patient_id else 0),
+                'review_claim': None,  # {'doctor_id', 'until'} while a doctor holds the case
+                'created_at': datetime.utcnow(),
+                'updated_at': datetime.utcnow()
+            }
+            result = self.collection.insert_one(prediction_doc)
+            event_bus.publish('prediction.created', [
+                user_audience(patient_id) if patient_id else None, role_audience('doctor'), role_audience('admin')
+            ], {
+                'prediction_id': result.inserted_id,
+                'prediction': prediction_doc['prediction'],
+                'confidence': prediction_doc['confidence'],
+                'review_priority': prediction_doc['review_priority']
+            })
+            return str(result.inserted_id)
+        except Exception as e:
+            logger.exception("Error creating prediction: %s", e)
+            return None
 
     def get_all_predictions(self):
-        return self.storage
+        """Get all predictions, newest first"""
+        try:
+            return list(self.list_reads.find().sort('created_at', -1))
+        except Exception as e:
+            logger.exception("Error getting predictions: %s", e)
+            return []
+
+    def get_patient_predictions(self, patient_id):
+        """Get all predictions for a patient"""
+        try:
+            return list(self.collection.find({'patient_id': ObjectId(patient_id)}).sort('created_at', -1))
+        except Exception as e:
+            logger.exception("Error getting patient predictions: %s", e)
+            return []
+
+    def get_doctor_predictions(self, doctor_id):
+        """Get predictions assigned to a doctor, plus unassigned ones awaiting review"""
+        try:
+            return list(self.collection.find({
+                '$or': [{'doctor_id': ObjectId(doctor_id)}, {'doctor_id': None}]
+            }).sort('created_at', -1))
+        except Exception as e:
+            logger.exception("Error getting doctor predictions: %s", e)
+            return []
+
+    def get_prediction_by_id(self, prediction_id):
+        """Get prediction by ID"""
+        try:
+            return self.collection.find_one({'_id': ObjectId(prediction_id)})
+        except Exception as e:
+            logger.exception("Error getting prediction by ID: %s", e)
+            return None
+
+    def get_predictions_by_ids(self, prediction_ids, projection=None):
+        """Get several predictions, in the order of prediction_ids"""
+        try:
+            ids = [ObjectId(prediction_id) for prediction_id in prediction_ids]
+            docs = {doc['_id']: doc for doc in self.collection.find({'_id': {'$in': ids}}, projection)}
+            return [docs[i] for i in ids if i in docs]
+        except Exception as e:
+            logger.exception("Error getting predictions: %s", e)
+            return []
+
+    # --- Review queue ---
+    def _appointment_weight(self, patient_id):
+        """Boost from the patient's most pressing pending or approved appointment"""
+        appointments = self.appointments.find(
+            {'patient_id': ObjectId(patient_id), 'status': {'$in': ['pending', 'approved']}},
+            {'priority': 1}
+        )
+        return max((APPOINTMENT_PRIORITY_WEIGHTS.get(a.get('priority'), 0) for a in appointments), default=0)
+
+    def refresh_review_priority(self, patient_id):
+        """Recompute queue priority of a patient's unreviewed predictions after an appointment change"""
+        try:
+            weight = self._appointment_weight(patient_id)
+            self.collection.update_many(
+                {'patient_id': ObjectId(patient_id), 'reviewed_by_doctor': False},
+                [{'$set': {'review_priority': {'$add': ['$review_priority_base', weight]}}}]
+            )
+            return True
+        except Exception as e:
+            logger.exception("Error refreshing review priority: %s", e)
+            return False
+
+    def ensure_review_queue_index(self):
+        """Partial index over unreviewed predictions in queue order"""
+        self.collection.create_index(
+            [('review_priority', -1), ('_id', 1)],
+            name='review_queue',
+            partialFilterExpression={'reviewed_by_doctor': False}
+        )
+
+    def get_review_queue(self, doctor_id, limit=20, after=None):
+        """
+        Next unreviewed predictions for a doctor, highest priority first.
+        `after` is the (review_priority, _id) of the last item of the previous
+        page, so every page is one index range scan however deep it is.
+        """
+        # Errors propagate so the caller can tell a failed query from an empty queue
+        now = datetime.utcnow()
+        conditions = [_claimable_by(doctor_id, now)]
+        if after:
+            priority, last_id = after
+            conditions.append({'$or': [
+                {'review_priority': {'$lt': priority}},
+                {'review_priority': priority, '_id': {'$gt': ObjectId(last_id)}}
+            ]})
+        return list(self.collection.find({
+            'reviewed_by_doctor': False,
+            'doctor_id': {'$in': [ObjectId(doctor_id), None]},
+            '$and': conditions
+        }, {
+            'patient_id': 1, 'prediction': 1, 'confidence': 1, 'region': 1, 'content_hash': 1,
+            'review_priority': 1, 'review_claim': 1, 'near_duplicate': 1, 'created_at': 1
+        }).sort([('review_priority', -1), ('_id', 1)]).limit(limit))
+
+    def claim_prediction(self, prediction_id, doctor_id, lease_seconds=REVIEW_LEASE_SECONDS):
+        """Take (or renew) a lease on an unreviewed prediction; None if another doctor holds it"""
+        try:
+            now = datetime.utcnow()
+            claimed = self.collection.find_one_and_update(
+                {'_id': ObjectId(prediction_id), 'reviewed_by_doctor': False, **_claimable_by(doctor_id, now)},
+                {'$set': {'review_claim': {
+                    'doctor_id': ObjectId(doctor_id), 'until': now + timedelta(seconds=lease_seconds)
+                }}},
+                projection={'review_claim': 1},
+                return_document=ReturnDocument.AFTER
+            )
+            if claimed:
+                # Other doctors drop it from their queues
+                event_bus.publish('prediction.claimed', [role_audience('doctor')], {
+                    'prediction_id': claimed['_id'], 'claim': claimed['review_claim']
+                })
+            return claimed
+        except Exception as e:
+            logger.exception("Error claiming prediction: %s", e)
+            return None
+
+    def release_prediction(self, prediction_id, doctor_id):
+        """Give up a lease held by this doctor"""
+        try:
+            result = self.collection.update_one(
+                {'_id': ObjectId(prediction_id), 'review_claim.doctor_id': ObjectId(doctor_id)},
+                {'$set': {'review_claim': None}}
+            )
+            if result.modified_count:
+                event_bus.publish('prediction.released', [role_audience('doctor')], {'prediction_id': ObjectId(prediction_id)})
+            return result.modified_count > 0
+        except Exception as e:
+            logger.exception("Error releasing prediction: %s", e)
+            return False
+
+    def get_doctor_review_counts(self, doctor_id):
+        """(total, pending review) predictions visible to a doctor, counted in the database"""
+        try:
+            visible = {'doctor_id': {'$in': [ObjectId(doctor_id), None]}}
+            return (
+                self.analytics_reads.count_documents(visible),
+                self.analytics_reads.count_documents({**visible, 'reviewed_by_doctor': False})
+            )
+        except Exception as e:
+            logger.exception("Error counting doctor predictions: %s", e)
+            return 0, 0
+
+    def update_prediction_review(self, prediction_id, doctor_notes, final_diagnosis, doctor_id=None):
+        """Record a doctor's review of a prediction"""
+        try:
+            update_data = {
+                'reviewed_by_doctor': True,
+                'doctor_notes': doctor_notes,
+                'final_diagnosis': final_diagnosis,
+                'reviewed_at': datetime.utcnow(),
+                'updated_at': datetime.utcnow(),
+                'review_claim': None
+            }
+            query = {'_id': ObjectId(prediction_id)}
+            if doctor_id:
+                update_data['doctor_id'] = ObjectId(doctor_id)
+                # Cannot review a case another doctor has claimed
+                query.update(_claimable_by(doctor_id, datetime.utcnow()))
+
+            prediction = self.collection.find_one_and_update(
+                query, {'$set': update_data}, projection={'patient_id': 1, 'reviewed_by_doctor': 1}
+            )
+            if not prediction:
+                return False
+            event_bus.publish('prediction.reviewed', [
+                user_audience(prediction['patient_id']) if prediction.get('patient_id') else None,
+                role_audience('doctor'), role_audience('admin')
+            ], {
+                'prediction_id': prediction['_id'],
+                'final_diagnosis': final_diagnosis,
+                # False when a doctor edits an earlier review, so pending counts stay put
+                'was_pending': not prediction.get('reviewed_by_doctor')
+            })
+            return True
+        except Exception as e:
+            logger.exception("Error updating prediction review: %s", e)
+            return False
+
+    def ensure_heatmap_index(self):
+        """Partial index so the heatmap backlog query only touches pending predictions"""
+        self.collection.create_index(
+            [('created_at', -1)],
+            name='heatmap_pending',
+            partialFilterExpression={'heatmap_status': 'pending'}
+        )
+
+    def get_pending_heatmaps(self, limit):
+        """Newest predictions still waiting for a Grad-CAM heatmap"""
+        try:
+            return list(self.collection.find(
+                {'heatmap_status': 'pending'},
+                {'content_hash': 1, 'prediction': 1}
+            ).sort('created_at', -1).limit(limit))
+        except Exception as e:
+            logger.exception("Error getting pending heatmaps: %s", e)
+            return []
+
+    def set_heatmap_results(self, results, model_version):
+        """Record heatmap status ('ready' or 'failed') per prediction id"""
+        try:
+            now = datetime.utcnow()
+            requests = [
+                UpdateOne({'_id': prediction_id}, {'$set': {
+                    'heatmap_status': status,
+                    'heatmap_version': model_version,
+                    'heatmap_generated_at': now
+                }})
+                for prediction_id, status in results.items()
+            ]
+            if requests:
+                self.collection.bulk_write(requests, ordered=False)
+            return True
+        except Exception as e:
+            logger.exception("Error saving heatmap results: %s", e)
+            return False
 
     def get_predictions_stats(self):
         """
         Returns statistics for admin dashboard
         """
-        total = len(self.storage)
-        # Example: count predictions by tumor type if 'result' field exists
-        benign_count = sum(1 for p in self.storage if p.get('result') == 'benign')
-        malignant_count = sum(1 for p in self.storage if p.get('result') == 'malignant')
-        return {
-            'total_predictions': total,
-            'benign_count': benign_count,
-            'malignant_count': malignant_count
-        }
+        try:
+            by_class = {
+                row['_id']: row['count']
+                for row in self.analytics_reads.aggregate([
+                    {'$group': {'_id': '$prediction', 'count': {'$sum': 1}}}
+                ])
+            }
+            total = sum(by_class.values())
+            return {
+                'total_predictions': total,
+                'tumor_count': total - by_class.get('notumor', 0),
+                'no_tumor_count': by_class.get('notumor', 0),
+                'by_class': by_class,
+                'pending_review': self.analytics_reads.count_documents({'reviewed_by_doctor': False})
+            }
+        except Exception as e:
+            logger.exception("Error getting prediction stats: %s", e)
+            return {'total_predictions': 0}
+
+
+def backfill_review_priority(predictions, batch_size=500, pause=0.0):
+    """
+    Set review_priority_base and review_priority on unreviewed predictions
+    stored before the review queue existed, in _id order. Rerunning it
+    resumes, since finished predictions no longer match.
+    """
+    updated, last_id = 0, None
+    while True:
+        query = {'reviewed_by_doctor': False, 'review_priority_base': {'$exists': False}}
+        if last_id is not None:
+            query['_id'] = {'$gt': last_id}
+        batch = list(predictions.collection.find(
+            query, {'prediction': 1, 'confidence': 1, 'patient_id': 1}
+        ).sort('_id', 1).limit(batch_size))
+        if not batch:
+            return updated
+        last_id = batch[-1]['_id']
+
+        requests = []
+        for doc in batch:
+            base = review_priority_base(doc['prediction'], doc['confidence'])
+            weight = predictions._appointment_weight(doc['patient_id']) if doc.get('patient_id') else 0
+            requests.append(UpdateOne(
+                {'_id': doc['_id'], 'review_priority_base': {'$exists': False}},
+                {'$set': {'review_priority_base': base, 'review_priority': base + weight}}
+            ))
+        updated += predictions.collection.bulk_write(requests, ordered=False).modified_count
+        logger.info("Backfilled review priority of %d predictions so far", updated)
+        if pause:
+            time.sleep(pause)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Backfill review queue priorities of older predictions")
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--pause', type=float, default=0.0, help="Seconds to sleep between batches")
+    args = parser.parse_args(argv)
+
+    if not db_instance.connect():
+        return 1
+    predictions = Prediction()
+    predictions.ensure_review_queue_index()
+    updated = backfill_review_priority(predictions, args.batch_size, args.pause)
+    print(f"Backfilled review priority of {updated} predictions")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,388 @@
+"""
+Versioned model artifacts and live model swapping.
+
+Artifacts live under MODEL_REGISTRY_ROOT/<version>/ (model.keras, plus the
+memory-mapped weight export when MODEL_WEIGHTS_MMAP is on) and are described
+in the `model_versions` collection. Which version serves, and which one (if
+any) runs in shadow, is a single document in `maintenance_state`:
+
+    python -m models.registry register v2 /path/to/model.keras --notes "retrained on 2025-09 data"
+    python -m models.registry list
+
+and from the admin API (POST /api/admin/models/<version>/activate, .../shadow).
+
+Every worker runs a ModelServer with a small sync thread that polls that
+document. When the desired version changes, the worker loads it in the
+background, warms it up and checks its output, then swaps one reference, so
+requests keep being served by the old model until the new one is ready and
+no request ever sees a half-loaded model. In shadow mode a sampled fraction
+of live requests is also run through the candidate on a background thread
+and agreement with the serving model is counted per version.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import random
+import shutil
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import numpy as np
+from models.embeddings import EmbeddingForward
+from utils.db import db_instance
+from utils.metrics import MODEL_LOADS, SHADOW_PREDICTIONS
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+MODEL_REGISTRY_ROOT = os.getenv('MODEL_REGISTRY_ROOT', os.path.join('models', 'registry'))
+MODEL_REGISTRY_POLL_SECONDS = float(os.getenv('MODEL_REGISTRY_POLL_SECONDS', '15'))
+SHADOW_SAMPLE_RATE = float(os.getenv('SHADOW_SAMPLE_RATE', '0.1'))
+STATE_ID = 'model_serving'
+ARTIFACT_NAME = 'model.keras'
+
+
+def artifact_version(path):
+    """Short content hash of a model file, cached next to it by size and mtime"""
+    stat = os.stat(path)
+    sidecar = path + '.sha256'
+    key = f"{stat.st_size}:{int(stat.st_mtime)}"
+    try:
+        with open(sidecar) as f:
+            cached_key, digest = f.read().split()
+        if cached_key == key:
+            return digest[:12]
+    except (OSError, ValueError):
+        pass
+
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            sha.update(chunk)
+    digest = sha.hexdigest()
+    try:
+        with open(sidecar, 'w') as f:
+            f.write(f"{key} {digest}")
+    except OSError:
+        pass
+    return digest[:12]
+
+
+class ModelRegistry:
+    def __init__(self, root=MODEL_REGISTRY_ROOT):
+        self.root = root
+
+    # Looked up on every use: the registry is created at import, possibly in
+    # the Gunicorn master, and must use each worker's own MongoClient
+    @property
+    def versions(self):
+        return db_instance.get_collection('model_versions')
+
+    @property
+    def state(self):
+        return db_instance.get_collection('maintenance_state')
+
+    def artifact_paths(self, version):
+        """(model, mmap weights, mmap manifest) paths for a version"""
+        directory = os.path.join(self.root, version)
+        return (
+            os.path.join(directory, ARTIFACT_NAME),
+            os.path.join(directory, 'model.weights.bin'),
+            os.path.join(directory, 'model.weights.json')
+        )
+
+    def register(self, version, source_path, notes='', export_mmap=False):
+        """Copy a model file into the registry under `version`"""
+        model_path, weights_path, manifest_path = self.artifact_paths(version)
+        if os.path.exists(model_path):
+            raise ValueError(f"Version {version} already exists")
+        os.makedirs(os.path.dirname(model_path), exist_ok=True)
+        shutil.copyfile(source_path, model_path + '.tmp')
+        os.replace(model_path + '.tmp', model_path)
+
+        if export_mmap:
+            # Exported here, once, so workers never race to write it
+            from tensorflow.keras.models import load_model
+            from models.mmap_weights import export_weights
+            from models.ml_model import input_layer_fix
+
+            export_weights(load_model(model_path, custom_objects={'InputLayer': input_layer_fix}),
+                           weights_path, manifest_path)
+
+        doc = {
+            '_id': version,
+            'path': model_path,
+            'sha256': artifact_version(model_path),
+            'size': os.path.getsize(model_path),
+            'notes': notes,
+            'created_at': datetime.utcnow(),
+            'shadow': {'agree': 0, 'disagree': 0}
+        }
+        self.versions.insert_one(doc)
+        return doc
+
+    def get_version(self, version):
+        try:
+            return self.versions.find_one({'_id': version})
+        except Exception as e:
+            logger.exception("Error getting model version: %s", e)
+            return None
+
+    def list_versions(self):
+        try:
+            return list(self.versions.find().sort('created_at', -1))
+        except Exception as e:
+            logger.exception("Error listing model versions: %s", e)
+            return []
+
+    def get_state(self):
+        """{'active': version or None, 'shadow': version or None, 'shadow_rate': float}"""
+        try:
+            state = self.state.find_one({'_id': STATE_ID}) or {}
+        except Exception as e:
+            logger.exception("Error reading model serving state: %s", e)
+            state = {}
+        # Workers that stopped reporting (restarted, scaled down) drop out after a few polls
+        cutoff = datetime.utcnow() - timedelta(seconds=3 * MODEL_REGISTRY_POLL_SECONDS)
+        return {
+            'active': state.get('active'),
+            'shadow': state.get('shadow'),
+            'shadow_rate': state.get('shadow_rate', SHADOW_SAMPLE_RATE),
+            'updated_at': state.get('updated_at'),
+            'workers': {k: w for k, w in state.get('workers', {}).items() if w['seen_at'] >= cutoff}
+        }
+
+    def set_active(self, version):
+        self.state.update_one(
+            {'_id': STATE_ID},
+            {'$set': {'active': version, 'updated_at': datetime.utcnow()}},
+            upsert=True
+        )
+
+    def set_shadow(self, version, sample_rate=SHADOW_SAMPLE_RATE):
+        self.state.update_one(
+            {'_id': STATE_ID},
+            {'$set': {'shadow': version, 'shadow_rate': sample_rate, 'updated_at': datetime.utcnow()}},
+            upsert=True
+        )
+
+    def report_worker(self, worker_id, active, shadow):
+        """Heartbeat so admins can see which version each worker is serving"""
+        self.state.update_one(
+            {'_id': STATE_ID},
+            {'$set': {f'workers.{worker_id}': {'active': active, 'shadow': shadow, 'seen_at': datetime.utcnow()}}},
+            upsert=True
+        )
+
+    def record_shadow(self, version, agrees):
+        self.versions.update_one(
+            {'_id': version},
+            {'$inc': {'shadow.agree' if agrees else 'shadow.disagree': 1}}
+        )
+
+
+class _Loaded:
+    """A model together with the version it was loaded from (swapped as one reference)"""
+
+    def __init__(self, version, model):
+        self.version = version
+        self.model = model
+        self.forward = EmbeddingForward(model)
+
+
+class ModelServer:
+    """Serves the active model version and follows registry changes"""
+
+    def __init__(self, model, version, loader, registry, num_classes):
+        self._active = _Loaded(version, model)
+        self._shadow = None
+        self._shadow_rate = 0.0
+        self.loader = loader
+        self.registry = registry
+        self.num_classes = num_classes
+        self._pid = None
+        self._loading = set()
+        self._failed = set()
+        self._state_updated_at = None
+        self._lock = threading.Lock()
+        self._load_executor = None
+        self._shadow_executor = None
+        self._shadow_slot = threading.Semaphore(1)
+
+    @property
+    def version(self):
+        return self._active.version
+
+    @property
+    def model(self):
+        return self._active.model
+
+    def predict(self, img_array, **kwargs):
+        """Same contract as model.predict; also feeds shadow mode"""
+        return self.infer(img_array)[0]
+
+    def infer(self, img_array):
+        """(class probabilities, embeddings, version) from one forward pass; also feeds shadow mode"""
+        active = self._active  # read once so a concurrent swap cannot mix versions
+        preds, embedding = active.forward(img_array)
+
+        shadow = self._shadow
+        if shadow and random.random() < self._shadow_rate and self._shadow_slot.acquire(blocking=False):
+            self._shadow_executor.submit(self._run_shadow, shadow, np.array(img_array), int(np.argmax(preds[0])))
+        return preds, embedding, active.version
+
+    def _run_shadow(self, shadow, img_array, serving_index):
+        try:
+            preds = shadow.forward(img_array)[0]
+            agrees = int(np.argmax(preds[0])) == serving_index
+            SHADOW_PREDICTIONS.labels(shadow.version, 'agree' if agrees else 'disagree').inc()
+            self.registry.record_shadow(shadow.version, agrees)
+        except Exception as e:
+            logger.exception("Shadow prediction error: %s", e)
+        finally:
+            self._shadow_slot.release()
+
+    # --- Loading ---
+    def _load(self, version):
+        """Load and warm up a registered version; raises if it is unusable"""
+        model_path, weights_path, manifest_path = self.registry.artifact_paths(version)
+        if not os.path.exists(model_path):
+            raise FileNotFoundError(model_path)
+        loaded = _Loaded(version, self.loader(model_path, weights_path, manifest_path))
+
+        # Warmup: traces the graph and checks the output before the model serves anything
+        sample = np.zeros((1, 224, 224, 3), dtype=np.float32)
+        for _ in range(3):
+            preds, embedding = loaded.forward(sample)
+        if preds.shape != (1, self.num_classes) or not np.all(np.isfinite(preds)):
+            raise ValueError(f"Version {version} produced output of shape {preds.shape}")
+        if not np.all(np.isfinite(embedding)):
+            raise ValueError(f"Version {version} produced non-finite embeddings")
+        return loaded
+
+    def _load_in_background(self, version, role):
+        started = time.monotonic()
+        try:
+            loaded = self._load(version)
+            if role == 'active':
+                self._active = loaded
+            else:
+                self._shadow = loaded
+            MODEL_LOADS.labels('success').inc()
+            logger.info("Model %s loaded as %s in %.1fs", version, role, time.monotonic() - started)
+        except Exception as e:
+            MODEL_LOADS.labels('failure').inc()
+            self._failed.add(version)
+            logger.exception("Loading model %s failed, keeping %s: %s", version, self.version, e)
+        finally:
+            with self._lock:
+                self._loading.discard((version, role))
+
+    def _request_load(self, version, role):
+        with self._lock:
+            if (version, role) in self._loading or version in self._failed:
+                return
+            self._loading.add((version, role))
+        self._load_executor.submit(self._load_in_background, version, role)
+
+    def sync(self):
+        """Bring this worker in line with the registry state"""
+        state = self.registry.get_state()
+        if state['updated_at'] != self._state_updated_at:
+            # An admin changed something; give previously failed versions another chance
+            self._state_updated_at = state['updated_at']
+            self._failed.clear()
+        if state['active'] and state['active'] != self.version:
+            self._request_load(state['active'], 'active')
+
+        shadow_version = state['shadow']
+        if not shadow_version or shadow_version == self.version:
+            self._shadow = None
+        elif not self._shadow or self._shadow.version != shadow_version:
+            self._request_load(shadow_version, 'shadow')
+        self._shadow_rate = state['shadow_rate']
+
+        self.registry.report_worker(
+            f"{socket.gethostname()}:{os.getpid()}".replace('.', '_'),
+            self.version, self._shadow.version if self._shadow else None
+        )
+
+    def _sync_loop(self):
+        while True:
+            try:
+                self.sync()
+            except Exception as e:
+                logger.exception("Model registry sync error: %s", e)
+            time.sleep(MODEL_REGISTRY_POLL_SECONDS)
+
+    def start(self):
+        """
+        Switch to the registry's active version and start the sync thread
+        (once per process; threads do not survive fork)
+        """
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._load_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='model-load')
+        self._shadow_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='model-shadow')
+
+        # Resolved here, in the worker, so the first request is already served
+        # by the active version rather than the bundled model
+        active = self.registry.get_state()['active']
+        if active and active != self.version:
+            try:
+                self._active = self._load(active)
+                MODEL_LOADS.labels('success').inc()
+                logger.info("Serving model %s", active)
+            except Exception as e:
+                MODEL_LOADS.labels('failure').inc()
+                self._failed.add(active)
+                logger.exception("Loading model %s failed, serving %s: %s", active, self.version, e)
+        threading.Thread(target=self._sync_loop, name='model-registry-sync', daemon=True).start()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage versioned model artifacts")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    register_parser = subparsers.add_parser('register', help="Add a model file as a new version")
+    register_parser.add_argument('version')
+    register_parser.add_argument('path')
+    register_parser.add_argument('--notes', default='')
+    register_parser.add_argument('--export-mmap', action='store_true',
+                                 help="Also write the memory-mapped weight files (for MODEL_WEIGHTS_MMAP=true)")
+
+    subparsers.add_parser('list', help="List versions and the serving state")
+
+    activate_parser = subparsers.add_parser('activate', help="Serve a version on all workers")
+    activate_parser.add_argument('version')
+    args = parser.parse_args(argv)
+
+    registry = ModelRegistry()
+    if args.command == 'register':
+        doc = registry.register(args.version, args.path, args.notes, args.export_mmap)
+        print(f"Registered {doc['_id']} ({doc['size'] / 1024 / 1024:.1f} MB, sha256 {doc['sha256']})")
+    elif args.command == 'activate':
+        if not registry.get_version(args.version):
+            print(f"Unknown version {args.version}")
+            return 1
+        registry.set_active(args.version)
+        print(f"Workers will switch to {args.version} within {MODEL_REGISTRY_POLL_SECONDS:.0f}s")
+    else:
+        state = registry.get_state()
+        for doc in registry.list_versions():
+            marks = [m for m, v in (('active', state['active']), ('shadow', state['shadow'])) if v == doc['_id']]
+            shadow = doc.get('shadow', {})
+            print(f"{doc['_id']:<16}{doc['created_at']:%Y-%m-%d %H:%M}  {', '.join(marks):<14}"
+                  f"shadow agree/disagree {shadow.get('agree', 0)}/{shadow.get('disagree', 0)}  {doc.get('notes', '')}")
+        print(json.dumps(state['workers'], default=str, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
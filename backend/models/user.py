@@ -1,14 +1,78 @@
 # models/user.py
 
+import re
+import unicodedata
 from datetime import datetime
 from bson import ObjectId
+from pymongo import UpdateOne
 import bcrypt
-from utils.db import db_instance
+from utils.db import READ_LIST, db_instance
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+# Admin search. Every user carries normalized `search_keys` ('<tag>:<value>',
+# matched by anchored regex for prefixes) and their trigrams in `search_grams`
+# (narrowed by index for substrings, then checked against the keys)
+SEARCH_FIELDS = {'name': 'n', 'email': 'e', 'phone': 'p', 'specialization': 's'}
+SEARCH_GRAM = 3
+MIN_PREFIX_LENGTH = 2
+SEARCH_PROJECTION = {
+    'email': 1, 'first_name': 1, 'last_name': 1, 'phone': 1, 'user_type': 1, 'gender': 1,
+    'specialization': 1, 'license_number': 1, 'experience_years': 1,
+    'approved_by_admin': 1, 'is_active': 1, 'created_at': 1
+}
+
+
+def normalize_search_text(value):
+    """Lowercase, accents stripped, whitespace collapsed"""
+    text = unicodedata.normalize('NFKD', str(value or ''))
+    text = ''.join(ch for ch in text if not unicodedata.combining(ch))
+    return ' '.join(text.lower().split())
+
+
+def _normalize_query(field, value):
+    if field == 'phone':
+        return re.sub(r'\D', '', str(value or ''))
+    return normalize_search_text(value)
+
+
+def _grams(text):
+    return {text[i:i + SEARCH_GRAM] for i in range(len(text) - SEARCH_GRAM + 1)}
+
+
+def search_fields(user):
+    """search_keys / search_grams for a user document"""
+    first = normalize_search_text(user.get('first_name'))
+    last = normalize_search_text(user.get('last_name'))
+    full_name = f"{first} {last}".strip()
+    values = {
+        # Every word too, so 'john' finds 'Dr. John Smith' and 'Mary Jane'
+        'name': {first, last, full_name, *full_name.split()},
+        'email': {normalize_search_text(user.get('email'))},
+        'phone': {_normalize_query('phone', user.get('phone'))}
+    }
+    if user.get('user_type') == 'doctor':
+        specialization = normalize_search_text(user.get('specialization'))
+        values['specialization'] = {specialization, *specialization.split()}
+
+    keys, grams = set(), set()
+    for field, texts in values.items():
+        tag = SEARCH_FIELDS[field]
+        for text in texts:
+            if text:
+                keys.add(f"{tag}:{text}")
+                grams |= {f"{tag}:{gram}" for gram in _grams(text)}
+    return {'search_keys': sorted(keys), 'search_grams': sorted(grams)}
+
 
 class User:
     def __init__(self):
         self.collection = db_instance.get_collection('users')
-        print("DEBUG: users collection is", self.collection)
+        # The admin patient list may read slightly stale data from a secondary;
+        # booking and the doctor and user lists admins re-read after changes stay on the primary
+        self.list_reads = db_instance.get_collection('users', READ_LIST)
+        logger.debug("users collection is %s", self.collection)
 
     def create_user(self, user_data):
         """Create a new user (admin/doctor/patient)"""
@@ -44,11 +108,12 @@ class User:
                     'medical_history': user_data.get('medical_history', []),
                     'emergency_contact': user_data.get('emergency_contact', {})
                 })
+            user_doc.update(search_fields(user_doc))
             # print("New user doc in user.py:", user_doc)
             result = self.collection.insert_one(user_doc)
             return str(result.inserted_id)
         except Exception as e:
-            print(f"Error creating user: {e}")
+            logger.exception("Error creating user: %s", e)
             return None
 
     def find_user_by_email(self, email):
@@ -56,7 +121,7 @@ class User:
         try:
             return self.collection.find_one({'email': email})
         except Exception as e:
-            print(f"Error finding user: {e}")
+            logger.exception("Error finding user: %s", e)
             return None
 
     def find_user_by_id(self, user_id):
@@ -64,7 +129,7 @@ class User:
         try:
             return self.collection.find_one({'_id': ObjectId(user_id)})
         except Exception as e:
-            print(f"Error finding user by ID: {e}")
+            logger.exception("Error finding user by ID: %s", e)
             return None
 
     def verify_password(self, password, hashed_password):
@@ -72,7 +137,7 @@ class User:
         try:
             return bcrypt.checkpw(password.encode('utf-8'), hashed_password)
         except Exception as e:
-            print(f"Error verifying password: {e}")
+            logger.exception("Error verifying password: %s", e)
             return False
 
     def get_all_doctors(self):
@@ -80,7 +145,7 @@ class User:
         try:
             return list(self.collection.find({'user_type': 'doctor'}))
         except Exception as e:
-            print(f"Error getting doctors: {e}")
+            logger.exception("Error getting doctors: %s", e)
             return []
 
     def approve_doctor(self, doctor_id):
@@ -92,7 +157,7 @@ class User:
             )
             return result.modified_count > 0
         except Exception as e:
-            print(f"Error approving doctor: {e}")
+            logger.exception("Error approving doctor: %s", e)
             return False
 
     def update_doctor_time_slots(self, doctor_id, time_slots):
@@ -104,7 +169,7 @@ class User:
             )
             return result.modified_count > 0
         except Exception as e:
-            print(f"Error updating time slots: {e}")
+            logger.exception("Error updating time slots: %s", e)
             return False
 
     def get_approved_doctors(self):
@@ -116,15 +181,77 @@ class User:
                 'is_active': True
             }))
         except Exception as e:
-            print(f"Error getting approved doctors: {e}")
+            logger.exception("Error getting approved doctors: %s", e)
             return []
 
     def get_all_patients(self):
         """Get all patients"""
         try:
-            return list(self.collection.find({'user_type': 'patient'}))
+            return list(self.list_reads.find({'user_type': 'patient'}))
+        except Exception as e:
+            logger.exception("Error getting patients: %s", e)
+            return []
+
+    def ensure_search_indexes(self):
+        """Indexes for search_users; backfills search keys of users created before them"""
+        # _id last, so a branch with equality on a key or gram reads in _id order
+        # and MongoDB merges the $or branches instead of sorting in memory
+        self.collection.create_index([('user_type', 1), ('search_keys', 1), ('_id', 1)])
+        self.collection.create_index([('user_type', 1), ('search_grams', 1), ('_id', 1)])
+        self.collection.create_index([('user_type', 1), ('_id', 1)])
+        existing = self.collection.index_information()
+        for name in ('user_type_1_search_keys_1', 'user_type_1_search_grams_1'):
+            if name in existing:
+                self.collection.drop_index(name)  # superseded by the indexes above
+        missing = self.collection.find(
+            {'search_keys': {'$exists': False}},
+            {'email': 1, 'first_name': 1, 'last_name': 1, 'phone': 1, 'user_type': 1, 'specialization': 1}
+        )
+        requests = []
+        for doc in missing:
+            requests.append(UpdateOne({'_id': doc['_id']}, {'$set': search_fields(doc)}))
+            if len(requests) >= 1000:
+                self.collection.bulk_write(requests, ordered=False)
+                requests = []
+        if requests:
+            self.collection.bulk_write(requests, ordered=False)
+
+    def search_users(self, query, user_types, fields=tuple(SEARCH_FIELDS), match='prefix', limit=20, after=None):
+        """
+        Users of the given types whose name, email, phone or specialization
+        starts with (match='prefix') or contains (match='contains') the query,
+        in _id order; `after` is the last _id of the previous page. An empty
+        query lists every user of those types.
+        """
+        try:
+            branches = []
+            for field in fields:
+                text = _normalize_query(field, query)
+                tag = SEARCH_FIELDS[field]
+                if match == 'prefix' and len(text) >= SEARCH_GRAM:
+                    # The leading trigram is an equality the index can serve in _id order
+                    branches.append({
+                        'search_grams': f"{tag}:{text[:SEARCH_GRAM]}",
+                        'search_keys': {'$regex': f"^{tag}:{re.escape(text)}"}
+                    })
+                elif match == 'prefix' and len(text) >= MIN_PREFIX_LENGTH:
+                    branches.append({'search_keys': {'$regex': f"^{tag}:{re.escape(text)}"}})
+                elif match == 'contains' and len(text) >= SEARCH_GRAM:
+                    branches.append({
+                        'search_grams': {'$all': sorted(f"{tag}:{gram}" for gram in _grams(text))},
+                        'search_keys': {'$regex': f"^{tag}:.*{re.escape(text)}"}
+                    })
+            if query and not branches:
+                return []
+
+            base = {'user_type': {'$in': list(user_types)}}
+            if after:
+                base['_id'] = {'$gt': ObjectId(after)}
+            # Each $or branch carries the whole filter so it can use its own index
+            criteria = {'$or': [{**base, **branch} for branch in branches]} if branches else base
+            return list(self.collection.find(criteria, SEARCH_PROJECTION).sort('_id', 1).limit(limit))
         except Exception as e:
-            print(f"Error getting patients: {e}")
+            logger.exception("Error searching users: %s", e)
             return []
 
     def deactivate_user(self, user_id):
@@ -136,5 +263,5 @@ class User:
             )
             return result.modified_count > 0
         except Exception as e:
-            print(f"Error deactivating user: {e}")
+            logger.exception("Error deactivating user: %s", e)
             return False
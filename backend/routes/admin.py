@@ -1,13 +1,27 @@
-from flask import Blueprint, request, jsonify
-from models.user import User
+from flask import Blueprint, request, jsonify, send_from_directory
+import os
+from bson import ObjectId
+from models.user import SEARCH_FIELDS, User
 from models.appointment import Appointment
 from models.prediction import Prediction
+from models.registry import ModelRegistry, MODEL_REGISTRY_POLL_SECONDS, SHADOW_SAMPLE_RATE
 from utils.auth_utils import login_required, admin_required
+from utils.profiling import PROFILE_DIR, PROFILE_EXTENSIONS, list_profiles
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
 
 admin_bp = Blueprint('admin', __name__)
 user_model = User()
 appointment_model = Appointment()
 prediction_model = Prediction()
+model_registry = ModelRegistry()
+MAX_SEARCH_RESULTS = 100
+
+
+@admin_bp.record_once
+def create_indexes(state):
+    user_model.ensure_search_indexes()
 
 @admin_bp.route('/dashboard', methods=['GET'])
 @login_required
@@ -21,13 +35,13 @@ def admin_dashboard():
         pending_doctors = [doc for doc in all_doctors if not doc.get('approved_by_admin', False)]
         
         # Get patient count
-        from utils.db import db_instance
-        users_collection = db_instance.get_collection('users')
+        from utils.db import READ_ANALYTICS, db_instance
+        users_collection = db_instance.get_collection('users', READ_ANALYTICS)
         patient_count = users_collection.count_documents({'user_type': 'patient'})
         
         # Get appointment statistics
         pending_appointments = appointment_model.get_pending_appointments()
-        appointments_collection = db_instance.get_collection('appointments')
+        appointments_collection = db_instance.get_collection('appointments', READ_ANALYTICS)
         total_appointments = appointments_collection.count_documents({})
         
         # Get prediction statistics
@@ -50,7 +64,7 @@ def admin_dashboard():
         }), 200
         
     except Exception as e:
-        print(f"Admin dashboard error: {e}")
+        logger.exception("Admin dashboard error: %s", e)
         return jsonify({'error': 'Internal server error'}), 500
 
 @admin_bp.route('/doctors', methods=['GET'])
@@ -83,7 +97,7 @@ def get_all_doctors():
         return jsonify({'doctors': doctors_data}), 200
         
     except Exception as e:
-        print(f"Get doctors error: {e}")
+        logger.exception("Get doctors error: %s", e)
         return jsonify({'error': 'Internal server error'}), 500
 
 @admin_bp.route('/doctors/<doctor_id>/approve', methods=['PUT'])
@@ -99,7 +113,7 @@ def approve_doctor(doctor_id):
             return jsonify({'error': 'Failed to approve doctor'}), 400
         
     except Exception as e:
-        print(f"Approve doctor error: {e}")
+        logger.exception("Approve doctor error: %s", e)
         return jsonify({'error': 'Internal server error'}), 500
 
 @admin_bp.route('/doctors', methods=['POST'])
@@ -109,7 +123,7 @@ def add_doctor():
     """Add a new doctor"""
     try:
         data = request.get_json()
-        print("Incoming doctor data:", request.get_json())
+        logger.debug("Incoming doctor data for %s", data.get('email'))
         # Required fields
         required_fields = ['email', 'password', 'first_name', 'last_name', 'phone', 'specialization', 'license_number']
         for field in required_fields:
@@ -150,7 +164,7 @@ def add_doctor():
         }), 201
         
     except Exception as e:
-        print(f"Add doctor error: {e}")
+        logger.exception("Add doctor error: %s", e)
         return jsonify({'error': 'Internal server error'}), 500
 
 @admin_bp.route('/patients', methods=['GET'])
@@ -159,8 +173,8 @@ def add_doctor():
 def get_all_patients():
     """Get all patients"""
     try:
-        from utils.db import db_instance
-        users_collection = db_instance.get_collection('users')
+        from utils.db import READ_LIST, db_instance
+        users_collection = db_instance.get_collection('users', READ_LIST)
         patients = list(users_collection.find({'user_type': 'patient'}))
         
         # Remove passwords and format response
@@ -182,7 +196,44 @@ def get_all_patients():
         return jsonify({'patients': patients_data}), 200
         
     except Exception as e:
-        print(f"Get patients error: {e}")
+        logger.exception("Get patients error: %s", e)
+        return jsonify({'error': 'Internal server error'}), 500
+
+@admin_bp.route('/users/search', methods=['GET'])
+@login_required
+@admin_required
+def search_users():
+    """
+    Search doctors and patients: ?q=&type=doctor|patient&field=name,email,phone,specialization
+    &match=prefix|contains&limit=&cursor= (cursor is the next_cursor of the previous page)
+    """
+    try:
+        query = request.args.get('q', '').strip()
+        match = request.args.get('match', 'prefix')
+        if match not in ('prefix', 'contains'):
+            return jsonify({'error': 'match must be prefix or contains'}), 400
+        
+        user_type = request.args.get('type')
+        if user_type and user_type not in ('doctor', 'patient'):
+            return jsonify({'error': 'type must be doctor or patient'}), 400
+        user_types = [user_type] if user_type else ['doctor', 'patient']
+        
+        fields = request.args.get('field', ','.join(SEARCH_FIELDS)).split(',')
+        if not all(field in SEARCH_FIELDS for field in fields):
+            return jsonify({'error': f"field must be one of {', '.join(SEARCH_FIELDS)}"}), 400
+        
+        cursor = request.args.get('cursor')
+        if cursor and not ObjectId.is_valid(cursor):
+            return jsonify({'error': 'Invalid cursor'}), 400
+        limit = min(max(request.args.get('limit', 20, type=int), 1), MAX_SEARCH_RESULTS)
+        
+        users = user_model.search_users(query, user_types, fields, match, limit, cursor)
+        next_cursor = str(users[-1]['_id']) if len(users) == limit else None
+        
+        return jsonify({'users': users, 'next_cursor': next_cursor}), 200
+        
+    except Exception as e:
+        logger.exception("Search users error: %s", e)
         return jsonify({'error': 'Internal server error'}), 500
 
 @admin_bp.route('/appointments', methods=['GET'])
@@ -191,31 +242,12 @@ def get_all_patients():
 def get_all_appointments():
     """Get all appointments"""
     try:
-        from utils.db import db_instance
-        appointments_collection = db_instance.get_collection('appointments')
-        
-        pipeline = [
-            {'$lookup': {
-                'from': 'users',
-                'localField': 'doctor_id',
-                'foreignField': '_id',
-                'as': 'doctor_info'
-            }},
-            {'$lookup': {
-                'from': 'users',
-                'localField': 'patient_id',
-                'foreignField': '_id',
-                'as': 'patient_info'
-            }},
-            {'$sort': {'created_at': -1}}
-        ]
-        
-        appointments = list(appointments_collection.aggregate(pipeline))
+        appointments = appointment_model.get_all_appointments()
         
         return jsonify({'appointments': appointments}), 200
         
     except Exception as e:
-        print(f"Get appointments error: {e}")
+        logger.exception("Get appointments error: %s", e)
         return jsonify({'error': 'Internal server error'}), 500
 
 @admin_bp.route('/predictions', methods=['GET'])
@@ -228,7 +260,7 @@ def get_all_predictions():
         return jsonify({'predictions': predictions}), 200
         
     except Exception as e:
-        print(f"Get predictions error: {e}")
+        logger.exception("Get predictions error: %s", e)
         return jsonify({'error': 'Internal server error'}), 500
 
 @admin_bp.route('/doctors/<doctor_id>/time-slots', methods=['PUT'])
@@ -247,5 +279,94 @@ def update_doctor_time_slots(doctor_id):
             return jsonify({'error': 'Failed to update time slots'}), 400
         
     except Exception as e:
-        print(f"Update time slots error: {e}")
-        return jsonify({'error': 'Internal server error'}), 500
\ No newline at end of file
+        logger.exception("Update time slots error: %s", e)
+        return jsonify({'error': 'Internal server error'}), 500
+
+@admin_bp.route('/profiles', methods=['GET'])
+@login_required
+@admin_required
+def get_profiles():
+    """List recent request profiles"""
+    try:
+        limit = min(max(request.args.get('limit', 50, type=int), 1), 500)
+        return jsonify({'profiles': list_profiles()[:limit]}), 200
+
+    except Exception as e:
+        logger.exception("Get profiles error: %s", e)
+        return jsonify({'error': 'Internal server error'}), 500
+
+@admin_bp.route('/profiles/<name>', methods=['GET'])
+@login_required
+@admin_required
+def download_profile(name):
+    """Download a request profile (.prof for pstats/snakeviz, .collapsed for flamegraph.pl)"""
+    if not name.endswith(PROFILE_EXTENSIONS):
+        return jsonify({'error': 'Profile not found'}), 404
+    return send_from_directory(os.path.abspath(PROFILE_DIR), name, as_attachment=True)
+
+
+@admin_bp.route('/models', methods=['GET'])
+@login_required
+@admin_required
+def list_models():
+    """Registered model versions, the serving state, and what each worker is running"""
+    try:
+        return jsonify({
+            'versions': model_registry.list_versions(),
+            'state': model_registry.get_state()
+        }), 200
+    except Exception as e:
+        logger.exception("List models error: %s", e)
+        return jsonify({'error': 'Internal server error'}), 500
+
+
+@admin_bp.route('/models/<version>/activate', methods=['POST'])
+@login_required
+@admin_required
+def activate_model(version):
+    """Switch all workers to a registered version (loaded and warmed up in the background)"""
+    try:
+        if not model_registry.get_version(version):
+            return jsonify({'error': 'Model version not found'}), 404
+
+        model_registry.set_active(version)
+        return jsonify({
+            'message': f'Workers will load and switch to {version} within {MODEL_REGISTRY_POLL_SECONDS:.0f} seconds'
+        }), 202
+    except Exception as e:
+        logger.exception("Activate model error: %s", e)
+        return jsonify({'error': 'Internal server error'}), 500
+
+
+@admin_bp.route('/models/<version>/shadow', methods=['POST'])
+@login_required
+@admin_required
+def shadow_model(version):
+    """Run a version in shadow on a sample of live traffic (body: {"sample_rate": 0.1})"""
+    try:
+        if not model_registry.get_version(version):
+            return jsonify({'error': 'Model version not found'}), 404
+
+        data = request.get_json(silent=True) or {}
+        sample_rate = float(data.get('sample_rate', SHADOW_SAMPLE_RATE))
+        if not 0 < sample_rate <= 1:
+            return jsonify({'error': 'sample_rate must be between 0 and 1'}), 400
+
+        model_registry.set_shadow(version, sample_rate)
+        return jsonify({'message': f'Shadowing {version} on {sample_rate:.0%} of predictions'}), 202
+    except Exception as e:
+        logger.exception("Shadow model error: %s", e)
+        return jsonify({'error': 'Internal server error'}), 500
+
+
+@admin_bp.route('/models/shadow', methods=['DELETE'])
+@login_required
+@admin_required
+def stop_shadow_model():
+    """Stop shadow inference"""
+    try:
+        model_registry.set_shadow(None, 0.0)
+        return jsonify({'message': 'Shadow mode stopped'}), 200
+    except Exception as e:
+        logger.exception("Stop shadow error: %s", e)
+        return jsonify({'error': 'Internal server error'}), 500
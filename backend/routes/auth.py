@@ -1,6 +1,9 @@
 from flask import Blueprint, request, jsonify
 from models.user import User
 from utils.auth_utils import generate_token, verify_token as verify_jwt_token
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
 
 auth_bp = Blueprint('auth', __name__)
 user_model = User()
@@ -67,7 +70,7 @@ def login():
         return jsonify({'message': 'Login successful', 'token': token, 'user': user_data}), 200
 
     except Exception as e:
-        print(f"Login error: {e}")
+        logger.exception("Login error: %s", e)
         return jsonify({'error': 'Internal server error'}), 500
 
 
@@ -106,7 +109,7 @@ def signup():
         return jsonify({'message': 'Patient account created successfully', 'user_id': user_id}), 201
 
     except Exception as e:
-        print(f"Signup error: {e}")
+        logger.exception("Signup error: %s", e)
         return jsonify({'error': 'Internal server error'}), 500
 
 
@@ -140,5 +143,5 @@ def verify_token():
         return jsonify({'valid': True, 'user': user_data}), 200
 
     except Exception as e:
-        print(f"Token verification error: {e}")
+        logger.exception("Token verification error: %s", e)
         return jsonify({'error': 'Internal server error'}), 500
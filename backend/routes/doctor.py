@@ -1,12 +1,27 @@
+from datetime import datetime
+import numpy as np
+from bson import ObjectId
 from flask import Blueprint, request, jsonify
 from models.appointment import Appointment
 from models.prediction import Prediction
+from models.embeddings import embedding_index
 from utils.auth_utils import login_required, doctor_required
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
 
 doctor_bp = Blueprint('doctor', __name__)
+MAX_CALENDAR_DAYS = 92
 appointment_model = Appointment()
 prediction_model = Prediction()
 
+
+@doctor_bp.record_once
+def create_indexes(state):
+    prediction_model.ensure_review_queue_index()
+    appointment_model.ensure_indexes()
+
+
 @doctor_bp.route('/appointments', methods=['GET'])
 @login_required
 @doctor_required
@@ -19,7 +34,7 @@ def get_doctor_appointments():
         return jsonify({'appointments': appointments}), 200
         
     except Exception as e:
-        print(f"Get doctor appointments error: {e}")
+        logger.exception("Get doctor appointments error: %s", e)
         return jsonify({'error': 'Internal server error'}), 500
 
 @doctor_bp.route('/appointments/<appointment_id>/approve', methods=['PUT'])
@@ -41,7 +56,7 @@ def approve_appointment(appointment_id):
             return jsonify({'error': 'Failed to approve appointment'}), 400
         
     except Exception as e:
-        print(f"Approve appointment error: {e}")
+        logger.exception("Approve appointment error: %s", e)
         return jsonify({'error': 'Internal server error'}), 500
 
 @doctor_bp.route('/appointments/<appointment_id>/reject', methods=['PUT'])
@@ -63,7 +78,7 @@ def reject_appointment(appointment_id):
             return jsonify({'error': 'Failed to reject appointment'}), 400
         
     except Exception as e:
-        print(f"Reject appointment error: {e}")
+        logger.exception("Reject appointment error: %s", e)
         return jsonify({'error': 'Internal server error'}), 500
 
 @doctor_bp.route('/appointments/<appointment_id>/complete', methods=['PUT'])
@@ -85,7 +100,7 @@ def complete_appointment(appointment_id):
             return jsonify({'error': 'Failed to complete appointment'}), 400
         
     except Exception as e:
-        print(f"Complete appointment error: {e}")
+        logger.exception("Complete appointment error: %s", e)
         return jsonify({'error': 'Internal server error'}), 500
 
 @doctor_bp.route('/predictions', methods=['GET'])
@@ -100,7 +115,7 @@ def get_doctor_predictions():
         return jsonify({'predictions': predictions}), 200
         
     except Exception as e:
-        print(f"Get doctor predictions error: {e}")
+        logger.exception("Get doctor predictions error: %s", e)
         return jsonify({'error': 'Internal server error'}), 500
 
 @doctor_bp.route('/predictions/<prediction_id>/review', methods=['PUT'])
@@ -117,16 +132,108 @@ def review_prediction(prediction_id):
             return jsonify({'error': 'Doctor notes and final diagnosis are required'}), 400
         
         success = prediction_model.update_prediction_review(
-            prediction_id, doctor_notes, final_diagnosis
+            prediction_id, doctor_notes, final_diagnosis, request.user['user_id']
         )
         
         if success:
+            embedding_index.mark_reviewed(prediction_id)
             return jsonify({'message': 'Prediction reviewed successfully'}), 200
         else:
-            return jsonify({'error': 'Failed to review prediction'}), 400
+            return jsonify({'error': 'Failed to review prediction (it may be claimed by another doctor)'}), 400
         
     except Exception as e:
-        print(f"Review prediction error: {e}")
+        logger.exception("Review prediction error: %s", e)
+        return jsonify({'error': 'Internal server error'}), 500
+
+@doctor_bp.route('/review-queue', methods=['GET'])
+@login_required
+@doctor_required
+def get_review_queue():
+    """Unreviewed predictions by priority, paginated with an opaque cursor"""
+    try:
+        limit = min(max(request.args.get('limit', 20, type=int), 1), 100)
+        after = None
+        cursor = request.args.get('cursor')
+        if cursor:
+            try:
+                priority, last_id = cursor.split('_')
+                after = (float(priority), last_id)
+            except ValueError:
+                return jsonify({'error': 'Invalid cursor'}), 400
+            if not ObjectId.is_valid(last_id):
+                return jsonify({'error': 'Invalid cursor'}), 400
+
+        predictions = prediction_model.get_review_queue(request.user['user_id'], limit, after)
+        next_cursor = None
+        if len(predictions) == limit:
+            last = predictions[-1]
+            next_cursor = f"{last['review_priority']!r}_{last['_id']}"
+
+        return jsonify({'predictions': predictions, 'next_cursor': next_cursor}), 200
+
+    except Exception as e:
+        logger.exception("Get review queue error: %s", e)
+        return jsonify({'error': 'Internal server error'}), 500
+
+@doctor_bp.route('/predictions/<prediction_id>/claim', methods=['POST'])
+@login_required
+@doctor_required
+def claim_prediction(prediction_id):
+    """Lease a prediction for review so no other doctor picks it up"""
+    try:
+        claimed = prediction_model.claim_prediction(prediction_id, request.user['user_id'])
+        if not claimed:
+            return jsonify({'error': 'Prediction is already reviewed or claimed by another doctor'}), 409
+
+        return jsonify({'claim': claimed['review_claim']}), 200
+
+    except Exception as e:
+        logger.exception("Claim prediction error: %s", e)
+        return jsonify({'error': 'Internal server error'}), 500
+
+@doctor_bp.route('/predictions/<prediction_id>/claim', methods=['DELETE'])
+@login_required
+@doctor_required
+def release_prediction(prediction_id):
+    """Release a prediction claim back to the queue"""
+    try:
+        if prediction_model.release_prediction(prediction_id, request.user['user_id']):
+            return jsonify({'message': 'Claim released'}), 200
+        return jsonify({'error': 'No claim held on this prediction'}), 404
+
+    except Exception as e:
+        logger.exception("Release prediction error: %s", e)
+        return jsonify({'error': 'Internal server error'}), 500
+
+@doctor_bp.route('/predictions/<prediction_id>/similar', methods=['GET'])
+@login_required
+@doctor_required
+def similar_predictions(prediction_id):
+    """Most similar reviewed cases to a prediction, by scan embedding"""
+    try:
+        k = min(max(request.args.get('k', 5, type=int), 1), 50)
+        embedding = embedding_index.get(prediction_id)
+        if not embedding:
+            return jsonify({'error': 'No embedding for this prediction'}), 404
+
+        # Over-fetch so dropping re-uploads of the same scan still leaves k results
+        matches = embedding_index.search(
+            np.frombuffer(embedding['vector'], dtype=np.float16), embedding['model_version'],
+            k=k + 5, exclude={embedding['_id']}
+        )
+        scores = {str(match_id): score for match_id, score in matches}
+        cases = prediction_model.get_predictions_by_ids(list(scores), {
+            'content_hash': 1, 'prediction': 1, 'confidence': 1, 'region': 1,
+            'final_diagnosis': 1, 'doctor_notes': 1, 'created_at': 1
+        })
+        cases = [case for case in cases if case['content_hash'] != embedding['content_hash']][:k]
+        for case in cases:
+            case['similarity'] = scores[str(case['_id'])]
+
+        return jsonify({'model_version': embedding['model_version'], 'similar': cases}), 200
+
+    except Exception as e:
+        logger.exception("Similar predictions error: %s", e)
         return jsonify({'error': 'Internal server error'}), 500
 
 @doctor_bp.route('/dashboard', methods=['GET'])
@@ -143,9 +250,8 @@ def doctor_dashboard():
         approved_appointments = [apt for apt in appointments if apt['status'] == 'approved']
         completed_appointments = [apt for apt in appointments if apt['status'] == 'completed']
         
-        # Get prediction statistics
-        predictions = prediction_model.get_doctor_predictions(doctor_id)
-        pending_reviews = [pred for pred in predictions if not pred['reviewed_by_doctor']]
+        # Get prediction statistics (counted in the database)
+        total_predictions, pending_reviews = prediction_model.get_doctor_review_counts(doctor_id)
         
         return jsonify({
             'appointments': {
@@ -155,14 +261,14 @@ def doctor_dashboard():
                 'completed': len(completed_appointments)
             },
             'predictions': {
-                'total': len(predictions),
-                'pending_review': len(pending_reviews),
-                'reviewed': len(predictions) - len(pending_reviews)
+                'total': total_predictions,
+                'pending_review': pending_reviews,
+                'reviewed': total_predictions - pending_reviews
             }
         }), 200
         
     except Exception as e:
-        print(f"Doctor dashboard error: {e}")
+        logger.exception("Doctor dashboard error: %s", e)
         return jsonify({'error': 'Internal server error'}), 500
 
 @doctor_bp.route('/schedule', methods=['GET'])
@@ -175,30 +281,38 @@ def get_doctor_schedule():
         if not date:
             return jsonify({'error': 'Date parameter is required'}), 400
         
-        doctor_id = request.user['user_id']
-        
-        # Get appointments for the specific date
-        from utils.db import db_instance
-        appointments_collection = db_instance.get_collection('appointments')
-        
-        pipeline = [
-            {'$match': {
-                'doctor_id': appointment_model.collection.database.client.get_database().get_collection('users').find_one({'_id': doctor_id})['_id'],
-                'appointment_date': date,
-                'status': {'$in': ['pending', 'approved']}
-            }},
-            {'$lookup': {
-                'from': 'users',
-                'localField': 'patient_id',
-                'foreignField': '_id',
-                'as': 'patient_info'
-            }}
-        ]
-        
-        scheduled_appointments = list(appointments_collection.aggregate(pipeline))
+        days = appointment_model.get_doctor_calendar(request.user['user_id'], date, date)
+        scheduled_appointments = days[0]['appointments'] if days else []
         
         return jsonify({'schedule': scheduled_appointments}), 200
         
     except Exception as e:
-        print(f"Get doctor schedule error: {e}")
-        return jsonify({'error': 'Internal server error'}), 500
\ No newline at end of file
+        logger.exception("Get doctor schedule error: %s", e)
+        return jsonify({'error': 'Internal server error'}), 500
+
+@doctor_bp.route('/calendar', methods=['GET'])
+@login_required
+@doctor_required
+def get_doctor_calendar():
+    """Get doctor's appointments over a date range, grouped by day"""
+    try:
+        start = request.args.get('start')
+        end = request.args.get('end')
+        if not start or not end:
+            return jsonify({'error': 'start and end parameters are required (YYYY-MM-DD)'}), 400
+        try:
+            start_day = datetime.strptime(start, '%Y-%m-%d')
+            end_day = datetime.strptime(end, '%Y-%m-%d')
+        except ValueError:
+            return jsonify({'error': 'Dates must be in YYYY-MM-DD format'}), 400
+        if end_day < start_day or (end_day - start_day).days > MAX_CALENDAR_DAYS:
+            return jsonify({'error': f'Date range must be between 1 and {MAX_CALENDAR_DAYS + 1} days'}), 400
+
+        statuses = request.args.get('status', 'pending,approved').split(',')
+        days = appointment_model.get_doctor_calendar(request.user['user_id'], start, end, statuses)
+        
+        return jsonify({'start': start, 'end': end, 'days': days}), 200
+        
+    except Exception as e:
+        logger.exception("Get doctor calendar error: %s", e)
+        return jsonify({'error': 'Internal server error'}), 500
@@ -0,0 +1,102 @@
+import os
+import threading
+import time
+from flask import Blueprint, Response, current_app, jsonify, request, stream_with_context
+from utils.admission import ML_MAX_CONCURRENCY, ML_MAX_QUEUE
+from utils.auth_utils import (
+    STREAM_TICKET_SECONDS, generate_stream_ticket, get_token_payload, login_required, verify_stream_ticket
+)
+from utils.events import event_bus, role_audience, user_audience
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+events_bp = Blueprint('events', __name__)
+
+# Every open stream holds a worker thread, so cap them per process and end
+# each stream after a while; EventSource reconnects and resumes by event id.
+# The cap leaves threads for running and queued predictions plus one for
+# everything else (login, booking, dashboards).
+WORKER_THREADS = int(os.getenv('GUNICORN_THREADS', '4'))
+MAX_EVENT_STREAMS = max(0, WORKER_THREADS - ML_MAX_CONCURRENCY - ML_MAX_QUEUE - 1)
+EVENT_STREAM_LIMIT = min(int(os.getenv('EVENT_STREAM_LIMIT', MAX_EVENT_STREAMS)), MAX_EVENT_STREAMS)
+EVENT_STREAM_MAX_SECONDS = int(os.getenv('EVENT_STREAM_MAX_SECONDS', '300'))
+EVENT_HEARTBEAT_SECONDS = 15
+stream_slots = threading.BoundedSemaphore(EVENT_STREAM_LIMIT)
+
+
+@events_bp.record_once
+def create_event_collection(state):
+    event_bus.ensure_collection()
+    if EVENT_STREAM_LIMIT == 0:
+        logger.warning(
+            "Event streams disabled: GUNICORN_THREADS=%s leaves no thread after %s prediction and %s queue slots",
+            WORKER_THREADS, ML_MAX_CONCURRENCY, ML_MAX_QUEUE
+        )
+    elif int(os.getenv('EVENT_STREAM_LIMIT', EVENT_STREAM_LIMIT)) > EVENT_STREAM_LIMIT:
+        logger.warning("EVENT_STREAM_LIMIT lowered to %s to leave threads for other requests", EVENT_STREAM_LIMIT)
+
+
+def _format(event):
+    data = current_app.json.dumps(event['data'])
+    return f"id: {event['_id']}\nevent: {event['type']}\ndata: {data}\n\n"
+
+
+@events_bp.route('/ticket', methods=['POST'])
+@login_required
+def stream_ticket():
+    """Short-lived ticket for opening the stream, since EventSource cannot send the Authorization header"""
+    return jsonify({
+        'ticket': generate_stream_ticket(request.user),
+        'expires_in': STREAM_TICKET_SECONDS
+    }), 200
+
+
+@events_bp.route('/stream', methods=['GET'])
+def stream():
+    """Server-sent events for the logged-in user (Authorization header, or ?ticket= from /ticket)"""
+    user = get_token_payload() or verify_stream_ticket(request.args.get('ticket', ''))
+    if not user:
+        return jsonify({'error': 'Invalid or expired token'}), 401
+
+    if not stream_slots.acquire(blocking=False):
+        response = jsonify({'error': 'Too many open event streams, retry shortly'})
+        response.headers['Retry-After'] = '10'
+        return response, 503
+
+    try:
+        audiences = [user_audience(user['user_id']), role_audience(user['user_type'])]
+        subscription = event_bus.subscribe(audiences)
+        last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    except Exception:
+        stream_slots.release()
+        raise
+
+    def generate():
+        try:
+            yield 'retry: 5000\n\n'
+            # Subscribed before replaying, so skip queued events the replay already sent
+            replayed = set()
+            for event in event_bus.replay(audiences, last_event_id):
+                replayed.add(event['_id'])
+                yield _format(event)
+
+            deadline = time.monotonic() + EVENT_STREAM_MAX_SECONDS
+            while time.monotonic() < deadline:
+                event = subscription.get(timeout=EVENT_HEARTBEAT_SECONDS)
+                if subscription.overflowed:
+                    subscription.overflowed = False
+                    yield 'event: resync\ndata: {}\n\n'
+                if event is None:
+                    yield ': keepalive\n\n'
+                elif event['_id'] not in replayed:
+                    yield _format(event)
+        finally:
+            event_bus.unsubscribe(subscription)
+            stream_slots.release()
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
@@ -1,37 +1,117 @@
-from flask import Blueprint, request, jsonify
 import os
-import uuid
-from models.ml_model import predict_mri
+from flask import Blueprint, request, jsonify, send_file
+from models.ml_model import predict_mri, model_server
+from models.gradcam import heatmap_path, render_overlay
+from models.embeddings import embedding_index
+from models.phash import near_duplicate_index
+from models.prediction import Prediction
+from utils.admission import ml_admission, ml_admission_required, ml_rate_limiter
+from utils.auth_utils import get_token_payload, login_required
+from utils.metrics import record_upload
+from utils.upload_store import get_upload_store
+from utils.upload_ingest import UploadRejected, ingest_image_upload
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
 
 ml_bp = Blueprint('ml', __name__)
+upload_store = None  # created once the app is set up, after the database connects
+prediction_model = Prediction()
+
 
-UPLOAD_FOLDER = 'uploads/mri_images'
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+@ml_bp.record_once
+def start_model_sync(state):
+    """Follow model registry changes in this worker (see models/registry.py)"""
+    global upload_store
+    upload_store = get_upload_store()
+    upload_store.ensure_indexes()
+    model_server.start()
+    embedding_index.ensure_indexes()
+    near_duplicate_index.ensure_indexes()
+    ml_rate_limiter.ensure_indexes()
 
 @ml_bp.route('/predict', methods=['POST'])
+@ml_admission_required
 def predict():
-    if 'image' not in request.files:
-        return jsonify({"success": False, "error": "No image uploaded"}), 400
+    user = get_token_payload()
+    user_id = user['user_id'] if user else None
 
-    file = request.files['image']
-    if file.filename == '':
-        return jsonify({"success": False, "error": "No file selected"}), 400
-
-    # Save uploaded image
-    filename = f"{uuid.uuid4().hex}_{file.filename}"
-    filepath = os.path.join(UPLOAD_FOLDER, filename)
-    file.save(filepath)
+    # Stream the uploaded image into storage (validated and deduplicated by content hash)
+    try:
+        upload = ingest_image_upload(upload_store, 'image', uploaded_by=user_id)
+    except UploadRejected as e:
+        return jsonify({"success": False, "error": e.message}), e.status_code
+    record_upload(upload['size'])
+    filepath = upload_store.local_path(upload['content_hash'])
 
     try:
-        result = predict_mri(filepath)
+        patient_id = user_id if user and user['user_type'] == 'patient' else None
+        result = predict_mri(filepath, upload['content_hash'], patient_id)
+        embedding = result.pop('embedding')
+        prediction_id = prediction_model.create_prediction({
+            'patient_id': patient_id,
+            'upload_id': upload['_id'],
+            'content_hash': upload['content_hash'],
+            'original_filename': upload['original_filename'],
+            **result
+        })
+        if prediction_id and embedding is not None:
+            embedding_index.add(prediction_id, embedding, result['model_version'], upload['content_hash'])
+        near_duplicate = result['near_duplicate']
+        if prediction_id and not (near_duplicate and near_duplicate['reused']):
+            near_duplicate_index.add(prediction_id, int(result['phash'], 16), upload['content_hash'], result, patient_id)
         return jsonify({
             "success": True,
             "data": {
                 "prediction": result["prediction"],
                 "confidence": result["confidence"],  # as number for frontend
                 "region": result["region"],
-                "image": filepath
+                "image": filepath,
+                "prediction_id": prediction_id,
+                "upload_id": str(upload['_id']),
+                "content_hash": upload['content_hash'],
+                "near_duplicate": near_duplicate and {
+                    "prediction_id": str(near_duplicate['prediction_id']),
+                    "distance": near_duplicate['distance'],
+                    "reused": near_duplicate['reused']
+                }
             }
         })
     except Exception as e:
+        logger.exception("Prediction error: %s", e)
         return jsonify({"success": False, "error": str(e)}), 500
+
+
+@ml_bp.route('/predictions/<prediction_id>/heatmap', methods=['GET'])
+@login_required
+def prediction_heatmap(prediction_id):
+    """Grad-CAM heatmap PNG for a prediction (?overlay=1 blends it over the scan)"""
+    try:
+        prediction = prediction_model.get_prediction_by_id(prediction_id)
+        if not prediction:
+            return jsonify({'error': 'Prediction not found'}), 404
+
+        if request.user['user_type'] == 'patient' and str(prediction.get('patient_id')) != request.user['user_id']:
+            return jsonify({'error': 'Unauthorized access to prediction'}), 403
+
+        status = prediction.get('heatmap_status')
+        if status == 'pending':
+            return jsonify({'status': 'pending'}), 202
+        if status != 'ready':
+            return jsonify({'error': 'No heatmap available for this prediction'}), 404
+
+        path = os.path.abspath(heatmap_path(prediction['heatmap_version'], prediction['content_hash']))
+        if request.args.get('overlay') == '1':
+            scan_path = upload_store.local_path(prediction['content_hash'])
+            return send_file(render_overlay(path, scan_path), mimetype='image/png', max_age=86400)
+        return send_file(path, mimetype='image/png', max_age=86400)
+
+    except Exception as e:
+        logger.exception("Heatmap error: %s", e)
+        return jsonify({'error': 'Internal server error'}), 500
+
+
+@ml_bp.route('/admission', methods=['GET'])
+def admission_status():
+    """In-flight and queued predictions in this worker (all workers: ml_admission_* in /api/metrics)"""
+    return jsonify({'pid': os.getpid(), **ml_admission.snapshot()})
@@ -1,9 +1,11 @@
 from flask import Blueprint, request, jsonify
 from models.user import User
-from models.appointment import Appointment
+from models.appointment import Appointment, parse_day, slot_start
 from models.prediction import Prediction
 from utils.auth_utils import login_required, patient_required
-from datetime import datetime
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
 
 patient_bp = Blueprint('patient', __name__)
 user_model = User()
@@ -34,7 +36,7 @@ def get_available_doctors():
         return jsonify({'doctors': doctors_data}), 200
         
     except Exception as e:
-        print(f"Get available doctors error: {e}")
+        logger.exception("Get available doctors error: %s", e)
         return jsonify({'error': 'Internal server error'}), 500
 
 @patient_bp.route('/appointments', methods=['POST'])
@@ -52,6 +54,11 @@ def book_appointment():
             if not data.get(field):
                 return jsonify({'error': f'{field} is required'}), 400
         
+        try:
+            slot_start(parse_day(data['appointment_date']), data['time_slot'])
+        except ValueError:
+            return jsonify({'error': 'appointment_date must be YYYY-MM-DD and time_slot HH:MM'}), 400
+        
         # Check if time slot is available
         if not appointment_model.check_time_slot_availability(
             data['doctor_id'], data['appointment_date'], data['time_slot']
@@ -80,7 +87,7 @@ def book_appointment():
         }), 201
         
     except Exception as e:
-        print(f"Book appointment error: {e}")
+        logger.exception("Book appointment error: %s", e)
         return jsonify({'error': 'Internal server error'}), 500
 
 @patient_bp.route('/appointments', methods=['GET'])
@@ -95,7 +102,7 @@ def get_patient_appointments():
         return jsonify({'appointments': appointments}), 200
         
     except Exception as e:
-        print(f"Get patient appointments error: {e}")
+        logger.exception("Get patient appointments error: %s", e)
         return jsonify({'error': 'Internal server error'}), 500
 
 @patient_bp.route('/appointments/<appointment_id>', methods=['GET'])
@@ -115,7 +122,7 @@ def get_appointment_details(appointment_id):
         return jsonify({'appointment': appointment}), 200
         
     except Exception as e:
-        print(f"Get appointment details error: {e}")
+        logger.exception("Get appointment details error: %s", e)
         return jsonify({'error': 'Internal server error'}), 500
 
 @patient_bp.route('/appointments/<appointment_id>/cancel', methods=['PUT'])
@@ -146,7 +153,7 @@ def cancel_appointment(appointment_id):
             return jsonify({'error': 'Failed to cancel appointment'}), 400
         
     except Exception as e:
-        print(f"Cancel appointment error: {e}")
+        logger.exception("Cancel appointment error: %s", e)
         return jsonify({'error': 'Internal server error'}), 500
 
 @patient_bp.route('/predictions', methods=['GET'])
@@ -161,7 +168,7 @@ def get_patient_predictions():
         return jsonify({'predictions': predictions}), 200
         
     except Exception as e:
-        print(f"Get patient predictions error: {e}")
+        logger.exception("Get patient predictions error: %s", e)
         return jsonify({'error': 'Internal server error'}), 500
 
 @patient_bp.route('/predictions/<prediction_id>', methods=['GET'])
@@ -181,7 +188,7 @@ def get_prediction_details(prediction_id):
         return jsonify({'prediction': prediction}), 200
         
     except Exception as e:
-        print(f"Get prediction details error: {e}")
+        logger.exception("Get prediction details error: %s", e)
         return jsonify({'error': 'Internal server error'}), 500
 
 @patient_bp.route('/dashboard', methods=['GET'])
@@ -202,13 +209,8 @@ def patient_dashboard():
         predictions = prediction_model.get_patient_predictions(patient_id)
         recent_predictions = sorted(predictions, key=lambda x: x['created_at'], reverse=True)[:5]
         
-        # Get next appointment
-        upcoming_appointments = [
-            apt for apt in appointments 
-            if apt['status'] in ['pending', 'approved'] and 
-            datetime.strptime(apt['appointment_date'], '%Y-%m-%d') >= datetime.now()
-        ]
-        next_appointment = upcoming_appointments[0] if upcoming_appointments else None
+        # Get next appointment (indexed on slot_start)
+        next_appointment = appointment_model.get_next_appointment(patient_id)
         
         return jsonify({
             'appointments': {
@@ -225,7 +227,7 @@ def patient_dashboard():
         }), 200
         
     except Exception as e:
-        print(f"Patient dashboard error: {e}")
+        logger.exception("Patient dashboard error: %s", e)
         return jsonify({'error': 'Internal server error'}), 500
 
 @patient_bp.route('/doctors/<doctor_id>/available-slots', methods=['GET'])
@@ -246,21 +248,15 @@ def get_doctor_available_slots(doctor_id):
         all_slots = doctor.get('available_time_slots', [])
         
         # Get booked slots for the date
-        from utils.db import db_instance
-        appointments_collection = db_instance.get_collection('appointments')
-        from bson import ObjectId
-        
-        booked_slots = appointments_collection.find({
-            'doctor_id': ObjectId(doctor_id),
-            'appointment_date': date,
-            'status': {'$in': ['pending', 'approved']}
-        })
-        
-        booked_time_slots = [apt['time_slot'] for apt in booked_slots]
+        try:
+            day = parse_day(date)
+        except ValueError:
+            return jsonify({'error': 'Date must be in YYYY-MM-DD format'}), 400
+        booked_time_slots = appointment_model.get_booked_slots(doctor_id, day)
         available_slots = [slot for slot in all_slots if slot not in booked_time_slots]
         
         return jsonify({'available_slots': available_slots}), 200
         
     except Exception as e:
-        print(f"Get doctor available slots error: {e}")
+        logger.exception("Get doctor available slots error: %s", e)
         return jsonify({'error': 'Internal server error'}), 500
\ No newline at end of file
@@ -0,0 +1,298 @@
+from flask import Blueprint, Response, request, jsonify, send_file, stream_with_context
+import csv
+import io
+import json
+import tempfile
+from datetime import datetime
+from bson import ObjectId
+from models.appointment import format_day
+from utils.db import READ_ANALYTICS, db_instance
+from utils.auth_utils import login_required, admin_required
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+reports_bp = Blueprint('reports', __name__)
+
+# Rows fetched from MongoDB per round trip; keeps memory flat for any export size
+EXPORT_BATCH_SIZE = 500
+
+PREDICTION_FIELDS = [
+    'id', 'created_at', 'patient_id', 'patient_name', 'patient_email', 'prediction', 'confidence',
+    'region', 'reviewed_by_doctor', 'final_diagnosis', 'doctor_notes', 'original_filename', 'content_hash'
+]
+APPOINTMENT_FIELDS = [
+    'id', 'appointment_date', 'time_slot', 'status', 'priority', 'reason', 'symptoms',
+    'patient_id', 'patient_name', 'patient_email', 'doctor_id', 'doctor_name', 'created_at', 'updated_at'
+]
+
+
+def _json_default(value):
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+def _csv_value(value):
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    return _json_default(value)
+
+
+def _date_filter(field):
+    """Range filter on `field` from the ?from= / ?to= (YYYY-MM-DD) query args"""
+    date_range = {}
+    if request.args.get('from'):
+        date_range['$gte'] = datetime.strptime(request.args['from'], '%Y-%m-%d')
+    if request.args.get('to'):
+        date_range['$lt'] = datetime.strptime(request.args['to'], '%Y-%m-%d')
+    return {field: date_range} if date_range else {}
+
+
+def _user_lookup(local_field, prefix):
+    """$lookup that keeps only the name and email of the matched user"""
+    return [
+        {'$lookup': {
+            'from': 'users',
+            'localField': local_field,
+            'foreignField': '_id',
+            'as': f'{prefix}_info'
+        }},
+        {'$set': {f'{prefix}_info': {'$first': f'${prefix}_info'}}},
+        {'$project': {f'{prefix}_info.password': 0}}
+    ]
+
+
+def _full_name(user):
+    return f"{user.get('first_name', '')} {user.get('last_name', '')}".strip() if user else ''
+
+
+def _prediction_row(doc):
+    patient = doc.get('patient_info')
+    return {
+        'id': doc['_id'],
+        'created_at': doc.get('created_at'),
+        'patient_id': doc.get('patient_id'),
+        'patient_name': _full_name(patient),
+        'patient_email': patient.get('email', '') if patient else '',
+        'prediction': doc.get('prediction'),
+        'confidence': doc.get('confidence'),
+        'region': doc.get('region'),
+        'reviewed_by_doctor': doc.get('reviewed_by_doctor', False),
+        'final_diagnosis': doc.get('final_diagnosis', ''),
+        'doctor_notes': doc.get('doctor_notes', ''),
+        'original_filename': doc.get('original_filename', ''),
+        'content_hash': doc.get('content_hash', '')
+    }
+
+
+def _appointment_row(doc):
+    patient = doc.get('patient_info')
+    doctor = doc.get('doctor_info')
+    return {
+        'id': doc['_id'],
+        'appointment_date': format_day(doc.get('appointment_date')),
+        'time_slot': doc.get('time_slot'),
+        'status': doc.get('status'),
+        'priority': doc.get('priority'),
+        'reason': doc.get('reason', ''),
+        'symptoms': doc.get('symptoms', ''),
+        'patient_id': doc.get('patient_id'),
+        'patient_name': _full_name(patient),
+        'patient_email': patient.get('email', '') if patient else '',
+        'doctor_id': doc.get('doctor_id'),
+        'doctor_name': _full_name(doctor),
+        'created_at': doc.get('created_at'),
+        'updated_at': doc.get('updated_at')
+    }
+
+
+def _stream_rows(cursor, to_row, fields, export_format):
+    """Generator that encodes cursor rows as CSV or NDJSON, one batch at a time"""
+    try:
+        if export_format == 'csv':
+            buffer = io.StringIO()
+            writer = csv.DictWriter(buffer, fieldnames=fields)
+            writer.writeheader()
+            for i, doc in enumerate(cursor, 1):
+                writer.writerow({k: _csv_value(v) for k, v in to_row(doc).items()})
+                if i % EXPORT_BATCH_SIZE == 0:
+                    yield buffer.getvalue()
+                    buffer.seek(0)
+                    buffer.truncate()
+            yield buffer.getvalue()
+        else:
+            lines = []
+            for doc in cursor:
+                lines.append(json.dumps(to_row(doc), default=_json_default))
+                if len(lines) >= EXPORT_BATCH_SIZE:
+                    yield '\n'.join(lines) + '\n'
+                    lines = []
+            if lines:
+                yield '\n'.join(lines) + '\n'
+    except Exception as e:
+        # Headers are already sent; all we can do is stop the stream
+        logger.exception("Export stream error: %s", e)
+    finally:
+        cursor.close()
+
+
+def _export_response(name, cursor, to_row, fields):
+    export_format = request.args.get('format', 'csv')
+    mimetype = 'text/csv' if export_format == 'csv' else 'application/x-ndjson'
+    extension = 'csv' if export_format == 'csv' else 'ndjson'
+    filename = f"{name}-{datetime.utcnow().strftime('%Y%m%d')}.{extension}"
+    return Response(
+        stream_with_context(_stream_rows(cursor, to_row, fields, export_format)),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'}
+    )
+
+
+@reports_bp.route('/predictions', methods=['GET'])
+@login_required
+@admin_required
+def export_predictions():
+    """Stream all predictions as CSV (?format=csv) or NDJSON (?format=ndjson)"""
+    try:
+        if request.args.get('format', 'csv') not in ('csv', 'ndjson'):
+            return jsonify({'error': 'format must be csv or ndjson'}), 400
+
+        predictions_collection = db_instance.get_collection('predictions', READ_ANALYTICS)
+        pipeline = [
+            {'$match': _date_filter('created_at')},
+            {'$sort': {'_id': 1}},
+            *_user_lookup('patient_id', 'patient')
+        ]
+        cursor = predictions_collection.aggregate(pipeline, batchSize=EXPORT_BATCH_SIZE, allowDiskUse=True)
+        return _export_response('predictions', cursor, _prediction_row, PREDICTION_FIELDS)
+
+    except ValueError:
+        return jsonify({'error': 'Dates must be YYYY-MM-DD'}), 400
+    except Exception as e:
+        logger.exception("Export predictions error: %s", e)
+        return jsonify({'error': 'Internal server error'}), 500
+
+
+@reports_bp.route('/appointments', methods=['GET'])
+@login_required
+@admin_required
+def export_appointments():
+    """Stream all appointments as CSV (?format=csv) or NDJSON (?format=ndjson)"""
+    try:
+        if request.args.get('format', 'csv') not in ('csv', 'ndjson'):
+            return jsonify({'error': 'format must be csv or ndjson'}), 400
+
+        match = _date_filter('created_at')
+        if request.args.get('status'):
+            match['status'] = request.args['status']
+
+        appointments_collection = db_instance.get_collection('appointments', READ_ANALYTICS)
+        pipeline = [
+            {'$match': match},
+            {'$sort': {'_id': 1}},
+            *_user_lookup('patient_id', 'patient'),
+            *_user_lookup('doctor_id', 'doctor')
+        ]
+        cursor = appointments_collection.aggregate(pipeline, batchSize=EXPORT_BATCH_SIZE, allowDiskUse=True)
+        return _export_response('appointments', cursor, _appointment_row, APPOINTMENT_FIELDS)
+
+    except ValueError:
+        return jsonify({'error': 'Dates must be YYYY-MM-DD'}), 400
+    except Exception as e:
+        logger.exception("Export appointments error: %s", e)
+        return jsonify({'error': 'Internal server error'}), 500
+
+
+@reports_bp.route('/patients/<patient_id>/summary.pdf', methods=['GET'])
+@login_required
+def patient_summary_pdf(patient_id):
+    """PDF summary of a patient's appointments and predictions (admins, or the patient themselves)"""
+    try:
+        if request.user['user_type'] != 'admin' and request.user['user_id'] != patient_id:
+            return jsonify({'error': 'Unauthorized access to patient report'}), 403
+        if not ObjectId.is_valid(patient_id):
+            return jsonify({'error': 'Invalid patient id'}), 400
+
+        users_collection = db_instance.get_collection('users')
+        patient = users_collection.find_one(
+            {'_id': ObjectId(patient_id), 'user_type': 'patient'},
+            {'password': 0}
+        )
+        if not patient:
+            return jsonify({'error': 'Patient not found'}), 404
+
+        appointments = db_instance.get_collection('appointments', READ_ANALYTICS).aggregate([
+            {'$match': {'patient_id': patient['_id']}},
+            {'$sort': {'appointment_date': -1}},
+            *_user_lookup('doctor_id', 'doctor')
+        ], batchSize=EXPORT_BATCH_SIZE)
+        predictions = db_instance.get_collection('predictions', READ_ANALYTICS).find(
+            {'patient_id': patient['_id']}
+        ).sort('created_at', -1).batch_size(EXPORT_BATCH_SIZE)
+
+        # Spool to disk past 1 MB so long histories do not sit in memory
+        output = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+        _write_patient_pdf(output, patient, appointments, predictions)
+        output.seek(0)
+        return send_file(
+            output,
+            mimetype='application/pdf',
+            as_attachment=True,
+            download_name=f"patient-{patient_id}-summary.pdf"
+        )
+
+    except Exception as e:
+        logger.exception("Patient summary error: %s", e)
+        return jsonify({'error': 'Internal server error'}), 500
+
+
+def _write_patient_pdf(output, patient, appointments, predictions):
+    """Draw the summary page by page straight from the cursors"""
+    from reportlab.lib.pagesizes import A4
+    from reportlab.pdfgen import canvas
+
+    pdf = canvas.Canvas(output, pagesize=A4)
+    width, height = A4
+    margin = 50
+    y = height - margin
+
+    def line(text, size=10, gap=14, bold=False):
+        nonlocal y
+        if y < margin:
+            pdf.showPage()
+            y = height - margin
+        pdf.setFont('Helvetica-Bold' if bold else 'Helvetica', size)
+        pdf.drawString(margin, y, str(text)[:110])
+        y -= gap
+
+    line('Healthcare Brain Tumor Detection System - Patient Summary', 14, 22, bold=True)
+    line(f"Patient: {_full_name(patient)} ({patient.get('email', '')})")
+    line(f"Phone: {patient.get('phone', '')}   Date of birth: {patient.get('date_of_birth') or '-'}   "
+         f"Gender: {patient.get('gender') or '-'}")
+    line(f"Generated: {datetime.utcnow().strftime('%Y-%m-%d %H:%M')} UTC", gap=24)
+
+    line('Appointments', 12, 18, bold=True)
+    count = 0
+    for apt in appointments:
+        count += 1
+        line(f"{format_day(apt.get('appointment_date'))} {apt.get('time_slot')}  {apt.get('status', ''):<10}  "
+             f"Dr. {_full_name(apt.get('doctor_info'))}  -  {apt.get('reason', '')}")
+    if not count:
+        line('No appointments')
+    y -= 10
+
+    line('MRI Predictions', 12, 18, bold=True)
+    count = 0
+    for pred in predictions:
+        count += 1
+        created = pred['created_at'].strftime('%Y-%m-%d') if pred.get('created_at') else ''
+        review = f"reviewed: {pred.get('final_diagnosis')}" if pred.get('reviewed_by_doctor') else 'awaiting review'
+        line(f"{created}  {pred.get('prediction', ''):<11} {pred.get('confidence', 0):5.1f}%  "
+             f"{pred.get('region', '')}  ({review})")
+    if not count:
+        line('No predictions')
+
+    pdf.save()
@@ -0,0 +1,344 @@
+"""
+Synthetic data for load testing.
+
+    python seed_data.py --doctors 500 --patients 100000 --appointments 2000000 --predictions 200000
+    python seed_data.py --purge
+
+Generates approved doctors with available_time_slots, patients, appointments
+and prediction records and writes them with unordered insert_many from a pool
+of worker processes. Distributions are skewed the way real traffic is: a few
+hot doctors take most bookings (Zipf), weekdays are busier than weekends, a
+handful of peak dates get several times the normal volume, and statuses
+depend on whether the date is past or upcoming.
+
+Every generated document carries a `synthetic_tag`, so --purge removes them
+all without touching real data. Synthetic users log in with SEED_PASSWORD;
+by default it is hashed once at a low bcrypt cost and shared, since hashing
+100k passwords at the production cost would take most of an hour.
+"""
+
+import argparse
+import multiprocessing
+import random
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+import bcrypt
+from bson import ObjectId
+from models.appointment import slot_start
+from models.user import search_fields
+from utils.db import Database
+
+SEED_PASSWORD = 'password123'
+
+FIRST_NAMES = [
+    'James', 'Mary', 'Robert', 'Patricia', 'John', 'Jennifer', 'Michael', 'Linda', 'David', 'Elizabeth',
+    'William', 'Barbara', 'Richard', 'Susan', 'Joseph', 'Jessica', 'Thomas', 'Sarah', 'Aarav', 'Priya',
+    'Wei', 'Mei', 'Carlos', 'Sofia', 'Ahmed', 'Fatima', 'Yuki', 'Hana', 'Olu', 'Amara'
+]
+LAST_NAMES = [
+    'Smith', 'Johnson', 'Williams', 'Brown', 'Jones', 'Garcia', 'Miller', 'Davis', 'Rodriguez', 'Martinez',
+    'Sharma', 'Patel', 'Chen', 'Wang', 'Kim', 'Nguyen', 'Khan', 'Ali', 'Tanaka', 'Okafor'
+]
+SPECIALIZATIONS = ['Neurology', 'Neurosurgery', 'Neuro-oncology', 'Radiology', 'Oncology']
+SLOT_TEMPLATES = [
+    ['09:00', '10:00', '11:00', '14:00', '15:00', '16:00'],
+    ['08:00', '09:00', '10:00', '11:00'],
+    ['13:00', '14:00', '15:00', '16:00', '17:00'],
+    ['09:00', '09:30', '10:00', '10:30', '11:00', '11:30', '14:00', '14:30', '15:00', '15:30']
+]
+REASONS = [
+    'Persistent headaches', 'Follow-up consultation', 'MRI results review', 'Dizziness', 'Blurred vision',
+    'Seizure episode', 'Memory problems', 'Post-surgery check', 'Second opinion', 'Routine check-up'
+]
+SYMPTOMS = ['', 'Headache', 'Nausea', 'Vision changes', 'Fatigue', 'Numbness', 'Balance problems']
+
+# Weekday multipliers, Monday first
+WEEKDAY_WEIGHTS = [1.3, 1.15, 1.1, 1.05, 1.0, 0.35, 0.15]
+PRIORITIES = (['normal', 'urgent', 'emergency'], [0.85, 0.12, 0.03])
+PAST_STATUSES = (['completed', 'cancelled', 'rejected', 'pending'], [0.72, 0.15, 0.08, 0.05])
+UPCOMING_STATUSES = (['pending', 'approved', 'cancelled'], [0.55, 0.40, 0.05])
+
+# Same label/region order as models.ml_model
+CLASS_LABELS = ['glioma', 'meningioma', 'notumor', 'pituitary']
+CLASS_WEIGHTS = [0.25, 0.22, 0.33, 0.20]
+REGIONS = ['Frontal Lobe', 'Parietal Lobe', 'Occipital Lobe', 'Temporal Lobe']
+
+# Populated in each worker by _init_worker
+_context = {}
+
+
+def _password_hasher(mode, rounds):
+    """Returns a function that produces the stored password for one user"""
+    if mode == 'none':
+        return lambda rng: None
+    if mode == 'bcrypt':
+        password = SEED_PASSWORD.encode('utf-8')
+        return lambda rng: bcrypt.hashpw(password, bcrypt.gensalt(rounds))
+    shared = bcrypt.hashpw(SEED_PASSWORD.encode('utf-8'), bcrypt.gensalt(rounds))
+    return lambda rng: shared
+
+
+def _zipf_cum_weights(count, skew, rng):
+    """Cumulative Zipf weights over `count` items in random rank order"""
+    ranks = list(range(1, count + 1))
+    rng.shuffle(ranks)
+    total = 0.0
+    cum_weights = []
+    for rank in ranks:
+        total += 1.0 / rank ** skew
+        cum_weights.append(total)
+    return cum_weights
+
+
+def _day_weights(days, peak_days, rng):
+    """Weekday pattern, a slow upward trend, and a few peak dates"""
+    weights = [WEEKDAY_WEIGHTS[day.weekday()] * (0.7 + 0.6 * i / max(len(days) - 1, 1))
+               for i, day in enumerate(days)]
+    for i in rng.sample(range(len(days)), min(peak_days, len(days))):
+        weights[i] *= rng.uniform(3, 6)
+    return weights
+
+
+def _name(rng):
+    return rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+
+
+def _doctor_doc(i, rng, ctx):
+    first_name, last_name = _name(rng)
+    doc = {
+        '_id': ctx['doctor_ids'][i],
+        'email': f"doctor.{ctx['tag']}.{i}@synthetic.local",
+        'password': ctx['hash_password'](rng),
+        'user_type': 'doctor',
+        'first_name': f"Dr. {first_name}",
+        'last_name': last_name,
+        'phone': f"+1555{rng.randrange(10 ** 7):07d}",
+        'created_at': ctx['start'] - timedelta(days=rng.randrange(30, 720)),
+        'is_active': True,
+        'specialization': rng.choice(SPECIALIZATIONS),
+        'license_number': f"MD{rng.randrange(10 ** 6):06d}",
+        'experience_years': rng.randrange(1, 35),
+        'available_time_slots': ctx['doctor_slots'][i],
+        'approved_by_admin': rng.random() < 0.97,
+        'synthetic_tag': ctx['tag']
+    }
+    doc.update(search_fields(doc))
+    return doc
+
+
+def _patient_doc(i, rng, ctx):
+    first_name, last_name = _name(rng)
+    birth = ctx['now'] - timedelta(days=rng.randrange(18 * 365, 90 * 365))
+    doc = {
+        '_id': ctx['patient_ids'][i],
+        'email': f"patient.{ctx['tag']}.{i}@synthetic.local",
+        'password': ctx['hash_password'](rng),
+        'user_type': 'patient',
+        'first_name': first_name,
+        'last_name': last_name,
+        'phone': f"+1555{rng.randrange(10 ** 7):07d}",
+        'created_at': ctx['start'] + timedelta(seconds=rng.randrange(int((ctx['now'] - ctx['start']).total_seconds()))),
+        'is_active': True,
+        'date_of_birth': birth.strftime('%Y-%m-%d'),
+        'gender': rng.choice(['Male', 'Female']),
+        'medical_history': [],
+        'emergency_contact': {},
+        'synthetic_tag': ctx['tag']
+    }
+    doc.update(search_fields(doc))
+    return doc
+
+
+def _appointment_doc(i, rng, ctx):
+    doctor_index = rng.choices(range(len(ctx['doctor_ids'])), cum_weights=ctx['doctor_weights'])[0]
+    day = rng.choices(ctx['days'], cum_weights=ctx['day_weights'])[0]
+    upcoming = day.date() >= ctx['now'].date()
+    statuses, status_weights = UPCOMING_STATUSES if upcoming else PAST_STATUSES
+
+    # Booked 0-30 days ahead, never in the future
+    created_at = min(day - timedelta(days=rng.randrange(0, 31), seconds=rng.randrange(86400)), ctx['now'])
+    status = rng.choices(statuses, status_weights)[0]
+    updated_at = created_at if status == 'pending' else min(created_at + timedelta(hours=rng.randrange(1, 72)), ctx['now'])
+    time_slot = rng.choice(ctx['doctor_slots'][doctor_index])
+    return {
+        'patient_id': ctx['patient_ids'][rng.randrange(len(ctx['patient_ids']))],
+        'doctor_id': ctx['doctor_ids'][doctor_index],
+        'appointment_date': day,
+        'time_slot': time_slot,
+        'slot_start': slot_start(day, time_slot),
+        'reason': rng.choice(REASONS),
+        'symptoms': rng.choice(SYMPTOMS),
+        'status': status,
+        'created_at': created_at,
+        'updated_at': updated_at,
+        'notes': '',
+        'priority': rng.choices(*PRIORITIES)[0],
+        'synthetic_tag': ctx['tag']
+    }
+
+
+def _prediction_doc(i, rng, ctx):
+    created_at = ctx['start'] + timedelta(seconds=rng.randrange(int((ctx['now'] - ctx['start']).total_seconds())))
+    class_index = rng.choices(range(len(CLASS_LABELS)), CLASS_WEIGHTS)[0]
+    age_days = (ctx['now'] - created_at).days
+    reviewed = rng.random() < (0.3 if age_days < 7 else 0.9)
+    doc = {
+        'patient_id': ctx['patient_ids'][rng.randrange(len(ctx['patient_ids']))] if rng.random() < 0.9 else None,
+        'doctor_id': None,
+        'upload_id': ObjectId(),
+        'content_hash': f"{rng.getrandbits(256):064x}",
+        'original_filename': f"scan_{rng.randrange(10 ** 6)}.jpg",
+        'prediction': CLASS_LABELS[class_index],
+        'confidence': round(rng.triangular(40.0, 100.0, 95.0), 2),
+        'region': REGIONS[class_index],
+        'reviewed_by_doctor': reviewed,
+        'doctor_notes': '',
+        'final_diagnosis': '',
+        'created_at': created_at,
+        'updated_at': created_at,
+        'synthetic_tag': ctx['tag']
+    }
+    if reviewed:
+        doctor_index = rng.choices(range(len(ctx['doctor_ids'])), cum_weights=ctx['doctor_weights'])[0]
+        reviewed_at = min(created_at + timedelta(hours=rng.randrange(1, 96)), ctx['now'])
+        agrees = rng.random() < 0.9
+        doc.update({
+            'doctor_id': ctx['doctor_ids'][doctor_index],
+            'doctor_notes': 'Consistent with model output' if agrees else 'Disagree with model output',
+            'final_diagnosis': CLASS_LABELS[class_index] if agrees else rng.choice(CLASS_LABELS),
+            'reviewed_at': reviewed_at,
+            'updated_at': reviewed_at
+        })
+    return doc
+
+
+GENERATORS = {
+    'doctors': ('users', _doctor_doc),
+    'patients': ('users', _patient_doc),
+    'appointments': ('appointments', _appointment_doc),
+    'predictions': ('predictions', _prediction_doc)
+}
+
+
+def _init_worker(ctx):
+    _context.update(ctx)
+    _context['hash_password'] = _password_hasher(ctx['password_mode'], ctx['bcrypt_rounds'])
+    db = Database()
+    db.connect()
+    _context['db'] = db
+
+
+def _run_chunk(task):
+    """Generate and insert documents [start, start + count) of one kind"""
+    kind, start, count = task
+    collection_name, make_doc = GENERATORS[kind]
+    collection = _context['db'].get_collection(collection_name)
+    rng = random.Random(f"{_context['seed']}-{kind}-{start}")
+    batch_size = _context['batch_size']
+
+    for offset in range(start, start + count, batch_size):
+        docs = [make_doc(i, rng, _context) for i in range(offset, min(offset + batch_size, start + count))]
+        collection.insert_many(docs, ordered=False)
+    return count
+
+
+def _build_context(args):
+    rng = random.Random(args.seed)
+    now = datetime.utcnow().replace(microsecond=0)
+    start = now - timedelta(days=args.days_back)
+    first_day = datetime(start.year, start.month, start.day)
+    days = [first_day + timedelta(days=d) for d in range(args.days_back + args.days_ahead + 1)]
+    doctors = max(args.doctors, 1)
+    return {
+        'tag': args.tag,
+        'seed': args.seed,
+        'now': now,
+        'start': start,
+        'batch_size': args.batch_size,
+        'password_mode': args.password_mode,
+        'bcrypt_rounds': args.bcrypt_rounds,
+        'doctor_ids': [ObjectId() for _ in range(doctors)],
+        'doctor_slots': [rng.choice(SLOT_TEMPLATES) for _ in range(doctors)],
+        'doctor_weights': _zipf_cum_weights(doctors, args.doctor_skew, rng),
+        'patient_ids': [ObjectId() for _ in range(max(args.patients, 1))],
+        'days': days,
+        'day_weights': list(_accumulate(_day_weights(days, args.peak_days, rng)))
+    }
+
+
+def _accumulate(values):
+    total = 0.0
+    for value in values:
+        total += value
+        yield total
+
+
+def _seed(pool, kind, total, chunk_size):
+    if total <= 0:
+        return
+    tasks = [(kind, start, min(chunk_size, total - start)) for start in range(0, total, chunk_size)]
+    started = time.monotonic()
+    done = 0
+    for count in pool.imap_unordered(_run_chunk, tasks):
+        done += count
+        elapsed = max(time.monotonic() - started, 1e-6)
+        print(f"\r{kind}: {done:,}/{total:,}  {done / elapsed:,.0f} docs/s", end='', flush=True)
+    print(f"\n{kind} finished in {time.monotonic() - started:.1f}s")
+
+
+def purge(tag=None):
+    db = Database()
+    if not db.connect():
+        return 1
+    query = {'synthetic_tag': tag} if tag else {'synthetic_tag': {'$exists': True}}
+    for name in ('users', 'appointments', 'predictions'):
+        result = db.get_collection(name).delete_many(query)
+        print(f"{name}: removed {result.deleted_count:,}")
+    db.close_connection()
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate synthetic healthcare_system data for load testing")
+    parser.add_argument('--doctors', type=int, default=200)
+    parser.add_argument('--patients', type=int, default=10000)
+    parser.add_argument('--appointments', type=int, default=100000)
+    parser.add_argument('--predictions', type=int, default=20000)
+    parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count())
+    parser.add_argument('--batch-size', type=int, default=1000, help="Documents per insert_many")
+    parser.add_argument('--password-mode', choices=['shared', 'bcrypt', 'none'], default='shared',
+                        help="shared: one hash for every user (default); bcrypt: hash each user; "
+                             "none: no password, users cannot log in")
+    parser.add_argument('--bcrypt-rounds', type=int, default=4, help="bcrypt cost factor (production uses 12)")
+    parser.add_argument('--days-back', type=int, default=365, help="History covered by past appointments")
+    parser.add_argument('--days-ahead', type=int, default=60, help="Range covered by upcoming appointments")
+    parser.add_argument('--doctor-skew', type=float, default=1.1, help="Zipf exponent; higher means hotter hot doctors")
+    parser.add_argument('--peak-days', type=int, default=10, help="Number of dates with 3-6x normal volume")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--tag', help="Value of synthetic_tag, also used in emails (random by default)")
+    parser.add_argument('--purge', action='store_true', help="Delete synthetic documents (only --tag if given)")
+    args = parser.parse_args(argv)
+
+    if args.purge:
+        return purge(args.tag)
+
+    args.tag = args.tag or uuid.uuid4().hex[:8]
+    ctx = _build_context(args)
+    print(f"Seeding with tag {args.tag} using {args.workers} workers")
+    # Chunks are large enough to amortize task overhead but small enough to balance across workers
+    chunk_size = args.batch_size * 20
+
+    with multiprocessing.Pool(args.workers, initializer=_init_worker, initargs=(ctx,)) as pool:
+        _seed(pool, 'doctors', args.doctors, chunk_size)
+        _seed(pool, 'patients', args.patients, chunk_size)
+        _seed(pool, 'appointments', args.appointments, chunk_size)
+        _seed(pool, 'predictions', args.predictions, chunk_size)
+    print(f"Done. Synthetic users log in with password '{SEED_PASSWORD}'"
+          if args.password_mode != 'none' else "Done.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
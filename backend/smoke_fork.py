@@ -0,0 +1,95 @@
+"""
+Smoke check for serving predictions from forked Gunicorn workers.
+
+    python smoke_fork.py                   # model preloaded in the master (default)
+    PRELOAD_MODEL=0 python smoke_fork.py   # model loaded in each worker
+
+Starts Gunicorn from gunicorn.conf.py with two workers against the MongoDB in
+MONGODB_URI, then sends /api/ml/predict requests with the sample scans until
+every worker has answered one. Each request first asks /api/ml/admission on
+the same keep-alive connection which worker it is talking to. Exits 1 if a
+worker fails, hangs past --timeout or never gets a request.
+"""
+
+import argparse
+import glob
+import os
+import signal
+import subprocess
+import sys
+import time
+
+WORKERS = 2
+SCAN_GLOB = os.path.join('samples', 'mri_scans', '*.jp*g')
+
+
+def wait_until_healthy(requests, base_url, server, deadline):
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            return False
+        try:
+            if requests.get(f"{base_url}/api/health", timeout=2).status_code == 200:
+                return True
+        except requests.RequestException:
+            pass
+        time.sleep(1)
+    return False
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check that forked Gunicorn workers serve predictions")
+    parser.add_argument('--port', type=int, default=5099)
+    parser.add_argument('--timeout', type=float, default=120, help="Seconds allowed for startup and per prediction")
+    parser.add_argument('--attempts', type=int, default=20, help="Predictions to send before giving up")
+    args = parser.parse_args(argv)
+
+    import requests
+
+    scans = sorted(glob.glob(SCAN_GLOB))
+    if not scans:
+        print(f"No sample scans match {SCAN_GLOB}", file=sys.stderr)
+        return 1
+
+    base_url = f"http://127.0.0.1:{args.port}"
+    env = dict(os.environ, WEB_CONCURRENCY=str(WORKERS), GUNICORN_THREADS='4',
+               GUNICORN_BIND=f"127.0.0.1:{args.port}")
+    server = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'wsgi:app'], env=env)
+    served = {}
+    try:
+        if not wait_until_healthy(requests, base_url, server, time.monotonic() + args.timeout):
+            print("Gunicorn did not become healthy", file=sys.stderr)
+            return 1
+
+        for attempt in range(args.attempts):
+            if len(served) == WORKERS:
+                break
+            # A fresh keep-alive connection, so both requests reach the same worker
+            with requests.Session() as session:
+                pid = session.get(f"{base_url}/api/ml/admission", timeout=10).json()['pid']
+                scan = scans[attempt % len(scans)]
+                with open(scan, 'rb') as f:
+                    response = session.post(f"{base_url}/api/ml/predict", timeout=args.timeout,
+                                             files={'image': (os.path.basename(scan), f, 'image/jpeg')})
+            body = response.json() if response.headers.get('Content-Type', '').startswith('application/json') else {}
+            if response.status_code != 200 or not body.get('success'):
+                print(f"Worker {pid} failed: {response.status_code} {body or response.text[:200]}", file=sys.stderr)
+                return 1
+            if pid not in served:
+                served[pid] = body['data']['prediction']
+                print(f"Worker {pid} predicted {served[pid]} for {os.path.basename(scan)}")
+    except requests.RequestException as e:
+        print(f"Request failed: {e}", file=sys.stderr)
+        return 1
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait(timeout=60)
+
+    if len(served) < WORKERS:
+        print(f"Only {len(served)} of {WORKERS} workers answered in {args.attempts} attempts", file=sys.stderr)
+        return 1
+    print(f"All {WORKERS} workers served predictions")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,172 @@
+"""
+Admission control for expensive endpoints (model inference).
+
+Each worker runs at most ML_MAX_CONCURRENCY predictions at once. Up to
+ML_MAX_QUEUE more wait up to ML_QUEUE_TIMEOUT seconds for a slot; anything
+beyond that is turned away at once with 503 and a Retry-After estimated from
+recent service times, before the upload body is read. Keep concurrency plus
+queue below GUNICORN_THREADS so login, booking and dashboards always have
+threads left.
+
+Every caller (user id, or client address for anonymous requests) is also
+limited to ML_RATE_LIMIT requests per ML_RATE_WINDOW seconds, counted in
+MongoDB so the limit holds across workers; over the limit gets 429. Requests
+turned away with 503 are not counted.
+"""
+
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from functools import wraps
+from flask import jsonify, request
+from pymongo import ReturnDocument
+from utils.auth_utils import get_token_payload
+from utils.db import db_instance
+from utils.metrics import ADMISSION_IN_FLIGHT, ADMISSION_QUEUED, ADMISSION_REJECTIONS
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+ML_MAX_CONCURRENCY = int(os.getenv('ML_MAX_CONCURRENCY', '1'))
+ML_MAX_QUEUE = int(os.getenv('ML_MAX_QUEUE', '1'))
+ML_QUEUE_TIMEOUT = float(os.getenv('ML_QUEUE_TIMEOUT', '10'))
+ML_RATE_LIMIT = int(os.getenv('ML_RATE_LIMIT', '20'))
+ML_RATE_WINDOW = int(os.getenv('ML_RATE_WINDOW', '60'))
+SERVICE_TIME_EWMA_ALPHA = 0.2
+
+
+class AdmissionController:
+    """Concurrency limit with a bounded, time-limited wait queue"""
+
+    def __init__(self, limit, queue_size, timeout):
+        self.limit = limit
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.in_flight = 0
+        self.queued = 0
+        self.service_time = None
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        """True once a slot is held; False if the queue is full or the wait timed out"""
+        with self._cond:
+            if self.in_flight < self.limit:
+                self.in_flight += 1
+                ADMISSION_IN_FLIGHT.inc()
+                return True
+            if self.queued >= self.queue_size:
+                return False
+
+            self.queued += 1
+            ADMISSION_QUEUED.inc()
+            try:
+                admitted = self._cond.wait_for(lambda: self.in_flight < self.limit, self.timeout)
+            finally:
+                self.queued -= 1
+                ADMISSION_QUEUED.dec()
+            if admitted:
+                self.in_flight += 1
+                ADMISSION_IN_FLIGHT.inc()
+            return admitted
+
+    def release(self, elapsed):
+        with self._cond:
+            self.in_flight -= 1
+            ADMISSION_IN_FLIGHT.dec()
+            if self.service_time is None:
+                self.service_time = elapsed
+            else:
+                self.service_time += SERVICE_TIME_EWMA_ALPHA * (elapsed - self.service_time)
+            self._cond.notify()
+
+    def retry_after(self):
+        """Seconds until the current backlog should have drained"""
+        per_request = self.service_time or 1.0
+        return max(1, int(per_request * (self.in_flight + self.queued) / self.limit + 0.999))
+
+    def snapshot(self):
+        return {
+            'in_flight': self.in_flight,
+            'queued': self.queued,
+            'max_concurrency': self.limit,
+            'max_queue': self.queue_size,
+            'avg_service_seconds': round(self.service_time, 3) if self.service_time else None
+        }
+
+
+class RateLimiter:
+    """Fixed-window request counter per caller, shared by all workers through MongoDB"""
+
+    def __init__(self, limit, window):
+        self.limit = limit
+        self.window = window
+        self.collection = db_instance.get_collection('rate_limits')
+
+    def ensure_indexes(self):
+        self.collection.create_index('expires_at', expireAfterSeconds=0)
+
+    def hit(self, key):
+        """(allowed, seconds until the window resets, counter id for refund())"""
+        now = time.time()
+        window_start = int(now // self.window * self.window)
+        counter_id = f"{key}:{window_start}"
+        try:
+            doc = self.collection.find_one_and_update(
+                {'_id': counter_id},
+                {'$inc': {'count': 1},
+                 '$setOnInsert': {'expires_at': datetime.utcfromtimestamp(window_start) + timedelta(seconds=2 * self.window)}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+        except Exception as e:
+            # Never block inference because the counter is unavailable
+            logger.exception("Rate limit check failed: %s", e)
+            return True, 0, None
+        return doc['count'] <= self.limit, max(1, int(window_start + self.window - now + 0.999)), counter_id
+
+    def refund(self, counter_id):
+        """Take back a hit for a request that was never served"""
+        if counter_id is None:
+            return
+        try:
+            self.collection.update_one({'_id': counter_id, 'count': {'$gt': 0}}, {'$inc': {'count': -1}})
+        except Exception as e:
+            logger.exception("Rate limit refund failed: %s", e)
+
+
+ml_admission = AdmissionController(ML_MAX_CONCURRENCY, ML_MAX_QUEUE, ML_QUEUE_TIMEOUT)
+ml_rate_limiter = RateLimiter(ML_RATE_LIMIT, ML_RATE_WINDOW)
+
+
+def _reject(message, status_code, retry_after, reason):
+    ADMISSION_REJECTIONS.labels(reason).inc()
+    response = jsonify({'success': False, 'error': message})
+    response.headers['Retry-After'] = str(retry_after)
+    return response, status_code
+
+
+def ml_admission_required(f):
+    """Decorator: per-caller rate limit, then a concurrency slot for the duration of the request"""
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        user = get_token_payload()
+        key = f"user:{user['user_id']}" if user else f"ip:{request.remote_addr}"
+        counter_id = None
+        if ML_RATE_LIMIT:
+            allowed, reset_in, counter_id = ml_rate_limiter.hit(key)
+            if not allowed:
+                return _reject('Too many prediction requests, please slow down', 429, reset_in, 'rate_limited')
+
+        if not ml_admission.acquire():
+            # Turned away for our capacity, not the caller's rate, so it must not use up their quota
+            ml_rate_limiter.refund(counter_id)
+            return _reject('Prediction service is busy, please retry shortly', 503,
+                           ml_admission.retry_after(), 'overloaded')
+        started = time.monotonic()
+        try:
+            return f(*args, **kwargs)
+        finally:
+            ml_admission.release(time.monotonic() - started)
+
+    return decorated
@@ -4,8 +4,13 @@ from datetime import datetime, timedelta
 from functools import wraps
 from flask import request, jsonify, current_app
 from models.user import User
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
 
 SECRET_KEY = os.getenv('SECRET_KEY', 'your-secret-key-change-in-production')
+STREAM_TICKET_PURPOSE = 'event_stream'
+STREAM_TICKET_SECONDS = 60
 
 def generate_token(user_data):
     """Generate JWT token for user"""
@@ -19,19 +24,49 @@ def generate_token(user_data):
         token = jwt.encode(payload, SECRET_KEY, algorithm='HS256')
         return token
     except Exception as e:
-        print(f"Error generating token: {e}")
+        logger.exception("Error generating token: %s", e)
         return None
 
+def generate_stream_ticket(user):
+    """Short-lived token that only opens the event stream (it ends up in URLs, so it must not be a login token)"""
+    payload = {
+        'user_id': user['user_id'],
+        'user_type': user['user_type'],
+        'purpose': STREAM_TICKET_PURPOSE,
+        'exp': datetime.utcnow() + timedelta(seconds=STREAM_TICKET_SECONDS)
+    }
+    return jwt.encode(payload, SECRET_KEY, algorithm='HS256')
+
 def verify_token(token):
     """Verify JWT token"""
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=['HS256'])
+        # Single-purpose tokens such as stream tickets are not logins
+        if 'purpose' in payload:
+            return None
         return payload
     except jwt.ExpiredSignatureError:
         return None
     except jwt.InvalidTokenError:
         return None
 
+def verify_stream_ticket(ticket):
+    """Decoded stream ticket, or None"""
+    try:
+        payload = jwt.decode(ticket, SECRET_KEY, algorithms=['HS256'])
+    except jwt.InvalidTokenError:
+        return None
+    return payload if payload.get('purpose') == STREAM_TICKET_PURPOSE else None
+
+def get_token_payload():
+    """Decoded token from the Authorization header, or None (for routes where login is optional)"""
+    token = request.headers.get('Authorization')
+    if not token:
+        return None
+    if token.startswith('Bearer '):
+        token = token[7:]
+    return verify_token(token)
+
 def login_required(f):
     """Decorator to require login for protected routes"""
     @wraps(f)
@@ -1,44 +1,160 @@
-from pymongo import MongoClient
+"""
+MongoDB client and read routing.
+
+get_collection(name, profile) returns the collection bound to a read
+preference. READ_PRIMARY (default) is for authentication, booking, slot
+checks and anything a user reads straight after writing it. READ_LIST
+(staff list pages) and READ_ANALYTICS (dashboards, statistics, exports)
+prefer secondaries no more than LIST_MAX_STALENESS / ANALYTICS_MAX_STALENESS
+seconds behind the primary, and fall back to the primary when none qualify.
+Against a standalone server every profile reads from it.
+
+python -m utils.db replset starts a three-member replica set on this machine
+for trying the routing out; python -m utils.db routes shows which member
+serves each profile.
+"""
+
+import argparse
 import os
+import subprocess
+import sys
+import time
+from pymongo import MongoClient, ReadPreference
+from pymongo.read_preferences import SecondaryPreferred
 from dotenv import load_dotenv
+from utils.metrics import MongoCommandMetrics
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
 
 load_dotenv()
 
+READ_PRIMARY = 'primary'
+READ_LIST = 'list'
+READ_ANALYTICS = 'analytics'
+
+READ_ROUTING = os.getenv('READ_ROUTING', 'true').lower() == 'true'
+# MongoDB rejects a maxStalenessSeconds below 90
+MIN_MAX_STALENESS = 90
+LIST_MAX_STALENESS = max(MIN_MAX_STALENESS, int(os.getenv('LIST_MAX_STALENESS', '90')))
+ANALYTICS_MAX_STALENESS = max(MIN_MAX_STALENESS, int(os.getenv('ANALYTICS_MAX_STALENESS', '300')))
+
+READ_PREFERENCES = {
+    READ_PRIMARY: ReadPreference.PRIMARY,
+    READ_LIST: SecondaryPreferred(max_staleness=LIST_MAX_STALENESS),
+    READ_ANALYTICS: SecondaryPreferred(max_staleness=ANALYTICS_MAX_STALENESS)
+}
+
+
 class Database:
     def __init__(self):
         self.client = None
         self.db = None
+        self.pid = None
 
     def connect(self):
         """Connect to MongoDB using the URI from .env file"""
         try:
             mongo_uri = os.getenv('MONGODB_URI', 'mongodb://127.0.0.1:27017')
-            self.client = MongoClient(mongo_uri)
+            self.client = MongoClient(mongo_uri, event_listeners=[MongoCommandMetrics()])
             self.db = self.client['healthcare_system']
-            print("Connected to MongoDB successfully!")
+            self.pid = os.getpid()
+            logger.info("Connected to MongoDB successfully!")
             return True
         except Exception as e:
-            print(f"Error connecting to MongoDB: {e}")
+            logger.exception("Error connecting to MongoDB: %s", e)
             return False
 
-    def get_collection(self, collection_name):
+    def get_collection(self, collection_name, profile=READ_PRIMARY):
         """
-        Get a collection by name.
+        Get a collection by name, reading with the given routing profile.
         Automatically tries to reconnect if the database is not connected.
         """
+        read_preference = READ_PREFERENCES[profile]
         if self.db is None:
-            print("WARNING: db_instance.db is None. Trying to reconnect...")
+            logger.warning("db_instance.db is None. Trying to reconnect...")
             connected = self.connect()
             if not connected:
-                print("ERROR: Could not connect to MongoDB.")
+                logger.error("Could not connect to MongoDB.")
                 return None
-        return self.db[collection_name]
+        elif self.pid != os.getpid():
+            # MongoClient is not fork-safe; never reuse the parent's client
+            logger.warning("db_instance was created before fork. Reconnecting...")
+            if not self.connect():
+                logger.error("Could not connect to MongoDB.")
+                return None
+        collection = self.db[collection_name]
+        if READ_ROUTING and profile != READ_PRIMARY:
+            collection = collection.with_options(read_preference=read_preference)
+        return collection
 
     def close_connection(self):
         """Close the MongoDB connection"""
         if self.client:
             self.client.close()
-            print("MongoDB connection closed.")
+            logger.info("MongoDB connection closed.")
 
 # Global database instance
 db_instance = Database()
+
+
+def start_local_replica_set(data_dir, port, members, name):
+    """Start `members` mongod processes on consecutive ports and initiate them as one replica set"""
+    hosts = [f"127.0.0.1:{port + i}" for i in range(members)]
+    for i, host in enumerate(hosts):
+        member_dir = os.path.join(data_dir, f"member{i}")
+        os.makedirs(member_dir, exist_ok=True)
+        subprocess.run([
+            'mongod', '--replSet', name, '--port', str(port + i), '--bind_ip', '127.0.0.1',
+            '--dbpath', member_dir, '--logpath', os.path.join(member_dir, 'mongod.log'), '--fork'
+        ], check=True)
+
+    client = MongoClient(hosts[0], directConnection=True)
+    try:
+        client.admin.command('replSetInitiate', {
+            '_id': name,
+            # The first member is the only one that can be elected, so it stays primary
+            'members': [{'_id': i, 'host': host, 'priority': 1 if i == 0 else 0}
+                        for i, host in enumerate(hosts)]
+        })
+    finally:
+        client.close()
+    return f"mongodb://{','.join(hosts)}/?replicaSet={name}"
+
+
+def show_read_routes():
+    """Print the member that serves a read for each routing profile"""
+    if not db_instance.connect():
+        return 1
+    db_instance.client.admin.command('ping')
+    time.sleep(1)  # let the client discover the secondaries
+    for profile, read_preference in READ_PREFERENCES.items():
+        if not READ_ROUTING:
+            read_preference = ReadPreference.PRIMARY
+        hello = db_instance.db.command('hello', read_preference=read_preference)
+        role = 'primary' if hello.get('isWritablePrimary') else 'secondary' if hello.get('secondary') else 'standalone'
+        print(f"{profile:<10} {read_preference.mode_name:<18} -> {hello.get('me', 'standalone')} ({role})")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="MongoDB read routing tools")
+    sub = parser.add_subparsers(dest='command', required=True)
+    replset = sub.add_parser('replset', help="Start a local replica set for testing read routing")
+    replset.add_argument('--dir', default='mongo-replset', help="Data directory for the members")
+    # Not 27017, so it does not collide with a local standalone mongod
+    replset.add_argument('--port', type=int, default=27018, help="Port of the first member")
+    replset.add_argument('--members', type=int, default=3)
+    replset.add_argument('--name', default='rs0', help="Replica set name")
+    sub.add_parser('routes', help="Show which member serves each read profile (uses MONGODB_URI)")
+    args = parser.parse_args(argv)
+
+    if args.command == 'replset':
+        uri = start_local_replica_set(args.dir, args.port, args.members, args.name)
+        print(f"Replica set started. Set MONGODB_URI={uri}")
+        return 0
+    return show_read_routes()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
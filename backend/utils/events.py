@@ -0,0 +1,194 @@
+"""
+Event bus behind the server-sent event stream (routes/events.py).
+
+Models publish small change notifications addressed to audiences:
+`user:<id>` for one patient or doctor, `role:<user_type>` for every doctor
+or every admin. Each open stream subscribes with its user's audiences and
+receives only matching events.
+
+A stream may be held by a different process than the one that published
+(several Gunicorn workers, the Grad-CAM worker). With EVENT_RELAY=mongo
+(default) events are appended to a small capped collection that every
+process tails and dispatches to its own subscribers; the same collection
+lets a reconnecting client replay what it missed (Last-Event-ID).
+EVENT_RELAY=local dispatches in-process only, for single-process setups.
+"""
+
+import os
+import queue
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import CursorType
+from pymongo.errors import CollectionInvalid
+from utils.db import db_instance
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+EVENT_RELAY = os.getenv('EVENT_RELAY', 'mongo').lower()
+EVENT_QUEUE_SIZE = 100
+EVENTS_COLLECTION = 'events'
+EVENTS_CAPPED_BYTES = 16 * 1024 * 1024
+# Events are replayed on reconnect only this far back
+EVENT_REPLAY_SECONDS = 300
+
+
+def user_audience(user_id):
+    return f"user:{user_id}"
+
+
+def role_audience(user_type):
+    return f"role:{user_type}"
+
+
+class Subscription:
+    """Bounded queue of events for one open stream"""
+
+    def __init__(self, audiences):
+        self.audiences = set(audiences)
+        self.queue = queue.Queue(maxsize=EVENT_QUEUE_SIZE)
+        self.overflowed = False
+
+    def deliver(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            # Slow client: drop the event and tell it to refetch instead
+            self.overflowed = True
+
+    def get(self, timeout):
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class EventBus:
+    def __init__(self, relay=EVENT_RELAY):
+        self.relay = relay
+        self._subscribers = {}  # audience -> set of Subscription
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def _collection(self):
+        return db_instance.get_collection(EVENTS_COLLECTION)
+
+    def ensure_collection(self):
+        if self.relay != 'mongo':
+            return
+        try:
+            self._collection().database.create_collection(
+                EVENTS_COLLECTION, capped=True, size=EVENTS_CAPPED_BYTES
+            )
+        except CollectionInvalid:
+            pass  # already exists
+        except Exception as e:
+            logger.exception("Error creating events collection: %s", e)
+
+    # --- Publishing ---
+    def publish(self, event_type, audiences, data):
+        """Send an event to every stream subscribed to any of the audiences"""
+        event = {
+            'type': event_type,
+            'audiences': [a for a in audiences if a],
+            'data': data,
+            'created_at': datetime.utcnow()
+        }
+        if self.relay == 'mongo':
+            try:
+                self._collection().insert_one(event)  # the tailer of every process dispatches it
+                return
+            except Exception as e:
+                logger.exception("Error relaying event, delivering locally only: %s", e)
+        event.setdefault('_id', ObjectId())
+        self._dispatch(event)
+
+    def _dispatch(self, event):
+        with self._lock:
+            targets = set()
+            for audience in event['audiences']:
+                targets |= self._subscribers.get(audience, set())
+        for subscription in targets:
+            subscription.deliver(event)
+
+    # --- Subscribing ---
+    def subscribe(self, audiences):
+        self._start()
+        subscription = Subscription(audiences)
+        with self._lock:
+            for audience in subscription.audiences:
+                self._subscribers.setdefault(audience, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            for audience in subscription.audiences:
+                subscribers = self._subscribers.get(audience)
+                if subscribers:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self._subscribers[audience]
+
+    def replay(self, audiences, last_event_id):
+        """Recent relayed events after last_event_id for these audiences"""
+        if self.relay != 'mongo' or not last_event_id:
+            return []
+        try:
+            after = ObjectId(last_event_id)
+        except (InvalidId, TypeError):
+            return []
+        cutoff = ObjectId.from_datetime(datetime.utcnow() - timedelta(seconds=EVENT_REPLAY_SECONDS))
+        try:
+            return list(self._collection().find({
+                '_id': {'$gt': max(after, cutoff)},
+                'audiences': {'$in': list(audiences)}
+            }).sort('$natural', 1))
+        except Exception as e:
+            logger.exception("Error replaying events: %s", e)
+            return []
+
+    # --- Relay ---
+    def _start(self):
+        """Start the tailing thread (once per process; threads do not survive fork)"""
+        if self.relay != 'mongo' or self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+        threading.Thread(target=self._tail, name='event-relay', daemon=True).start()
+
+    def _tail(self):
+        # ObjectIds from different processes are only ordered to the second,
+        # so a reopened cursor looks back a little and skips events already seen
+        seen = deque(maxlen=1000)
+        resume_from = datetime.utcnow()
+        while True:
+            try:
+                collection = self._collection()
+                lookback = ObjectId.from_datetime(resume_from - timedelta(seconds=2))
+                # A tailable cursor whose first batch is empty dies at once, so
+                # start at the newest event if nothing is newer than the lookback
+                newest = collection.find_one(sort=[('$natural', -1)], projection={'_id': 1})
+                if newest is not None:
+                    cursor = collection.find(
+                        {'_id': {'$gte': min(lookback, newest['_id'])}},
+                        cursor_type=CursorType.TAILABLE_AWAIT
+                    )
+                    while cursor.alive:
+                        for event in cursor:
+                            if event['_id'] in seen or event['_id'] < lookback:
+                                continue
+                            seen.append(event['_id'])
+                            resume_from = max(resume_from, event['_id'].generation_time.replace(tzinfo=None))
+                            self._dispatch(event)
+            except Exception as e:
+                logger.exception("Event relay error: %s", e)
+            time.sleep(1)  # empty collection or lost connection: reopen the cursor
+
+
+event_bus = EventBus()
@@ -0,0 +1,169 @@
+import atexit
+import copy
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from flask import g, has_request_context, request
+
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json')  # json or text
+# At most LOG_ERROR_BURST identical errors are written per LOG_ERROR_WINDOW seconds
+LOG_ERROR_BURST = int(os.getenv('LOG_ERROR_BURST', '5'))
+LOG_ERROR_WINDOW = float(os.getenv('LOG_ERROR_WINDOW', '60'))
+
+REQUEST_ID_HEADER = 'X-Request-ID'
+
+# Attributes every LogRecord has; anything else was passed through `extra`
+_RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime', 'request_id'}
+
+_listener = None
+_listener_pid = None
+_setup_lock = threading.Lock()
+
+
+class JsonFormatter(logging.Formatter):
+    """Format records as one JSON object per line"""
+
+    def format(self, record):
+        entry = {
+            'timestamp': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'request_id': getattr(record, 'request_id', None),
+            'process': record.process,
+            'thread': record.threadName
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS:
+                entry[key] = value
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class _QueueHandler(QueueHandler):
+    """Enqueue records without merging the traceback into the message"""
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class RequestIdFilter(logging.Filter):
+    """Attach the current request id to every record"""
+
+    def filter(self, record):
+        if has_request_context():
+            record.request_id = g.get('request_id')
+        elif not hasattr(record, 'request_id'):
+            record.request_id = None
+        return True
+
+
+class ErrorRateLimitFilter(logging.Filter):
+    """Drop repeats of the same error beyond a burst per time window"""
+
+    def __init__(self, burst=LOG_ERROR_BURST, window=LOG_ERROR_WINDOW):
+        super().__init__()
+        self.burst = burst
+        self.window = window
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno < logging.ERROR:
+            return True
+
+        key = (record.name, record.pathname, record.lineno, str(record.msg))
+        now = time.monotonic()
+        with self._lock:
+            started, count, suppressed = self._windows.get(key, (now, 0, 0))
+            if now - started >= self.window:
+                if suppressed:
+                    record.suppressed = suppressed  # reported on the first record of the next window
+                started, count, suppressed = now, 0, 0
+            count += 1
+            allowed = count <= self.burst
+            if not allowed:
+                suppressed += 1
+            self._windows[key] = (started, count, suppressed)
+        return allowed
+
+
+def setup_logging():
+    """
+    Route all logging through a queue drained by a background thread.
+    Safe to call repeatedly; after fork it starts a new listener in the child.
+    """
+    global _listener, _listener_pid
+    with _setup_lock:
+        if _listener_pid == os.getpid():
+            return
+
+        log_queue = queue.SimpleQueue()
+        queue_handler = _QueueHandler(log_queue)
+        queue_handler.addFilter(RequestIdFilter())
+        queue_handler.addFilter(ErrorRateLimitFilter())
+
+        stream_handler = logging.StreamHandler(sys.stdout)
+        if LOG_FORMAT == 'json':
+            stream_handler.setFormatter(JsonFormatter())
+        else:
+            stream_handler.setFormatter(logging.Formatter(
+                '%(asctime)s %(levelname)s [%(name)s] [%(request_id)s] %(message)s'
+            ))
+
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            if isinstance(handler, QueueHandler):
+                root.removeHandler(handler)
+        root.addHandler(queue_handler)
+        root.setLevel(LOG_LEVEL)
+
+        # The parent's listener thread does not survive fork, so never stop it here
+        _listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+        _listener.start()
+        _listener_pid = os.getpid()
+
+
+def _stop_listener():
+    if _listener is not None and _listener_pid == os.getpid():
+        _listener.stop()
+
+
+atexit.register(_stop_listener)
+
+
+def get_logger(name):
+    """Get a logger that writes through the queue-based pipeline"""
+    setup_logging()
+    return logging.getLogger(name)
+
+
+def init_request_logging(app):
+    """Assign every request an id (or reuse X-Request-ID) and echo it back"""
+    setup_logging()
+
+    @app.before_request
+    def assign_request_id():
+        g.request_id = request.headers.get(REQUEST_ID_HEADER) or uuid.uuid4().hex
+
+    @app.after_request
+    def add_request_id_header(response):
+        if 'request_id' in g:
+            response.headers[REQUEST_ID_HEADER] = g.request_id
+        return response
@@ -0,0 +1,154 @@
+import os
+import threading
+import time
+from flask import Response, g, request
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+)
+from prometheus_client import REGISTRY
+from pymongo import monitoring
+
+# When running under Gunicorn, set PROMETHEUS_MULTIPROC_DIR so every worker
+# writes its samples there and /api/metrics aggregates all of them
+MULTIPROC_DIR = os.getenv('PROMETHEUS_MULTIPROC_DIR')
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+
+# --- HTTP ---
+REQUEST_LATENCY = Histogram(
+    'http_request_duration_seconds', 'Request latency by blueprint and endpoint',
+    ['blueprint', 'endpoint', 'method']
+)
+REQUEST_COUNT = Counter(
+    'http_requests_total', 'Requests by blueprint, endpoint and status code',
+    ['blueprint', 'endpoint', 'method', 'status']
+)
+
+# --- MongoDB ---
+MONGO_COMMAND_LATENCY = Histogram(
+    'mongodb_command_duration_seconds', 'MongoDB command latency by collection and command',
+    ['collection', 'command', 'outcome'],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+)
+
+# --- ML inference ---
+INFERENCE_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+PREPROCESS_LATENCY = Histogram(
+    'ml_preprocess_duration_seconds', 'Image decode, resize and preprocess_input time',
+    buckets=INFERENCE_BUCKETS
+)
+MODEL_LATENCY = Histogram(
+    'ml_model_duration_seconds', 'Model forward pass time',
+    buckets=INFERENCE_BUCKETS
+)
+
+TENSOR_CACHE_REQUESTS = Counter(
+    'ml_tensor_cache_requests_total', 'Preprocessed tensor cache lookups', ['result']
+)
+
+# Two-stage cascade (models/cascade.py). Escalation rate is
+# ml_cascade_predictions_total{stage="full"} / sum(ml_cascade_predictions_total)
+SCREENING_LATENCY = Histogram(
+    'ml_screening_duration_seconds', 'Screening model forward pass time',
+    buckets=INFERENCE_BUCKETS
+)
+CASCADE_PREDICTIONS = Counter(
+    'ml_cascade_predictions_total', 'Cascade predictions by the stage that produced them', ['stage']
+)
+CASCADE_LATENCY_SAVED = Counter(
+    'ml_cascade_latency_saved_seconds_total', 'Estimated full-model time avoided by confident screens'
+)
+CASCADE_AUDITS = Counter(
+    'ml_cascade_audits_total', 'Confident screens re-checked against the full model', ['result']
+)
+
+# Model registry (models/registry.py)
+MODEL_LOADS = Counter('ml_model_loads_total', 'Background model version loads', ['outcome'])
+SHADOW_PREDICTIONS = Counter(
+    'ml_shadow_predictions_total', 'Shadow model predictions by agreement with the serving model',
+    ['version', 'result']
+)
+
+# Near-duplicate scans (models/phash.py)
+NEAR_DUPLICATES = Counter(
+    'ml_near_duplicates_total', 'Uploads matching an earlier scan by perceptual hash', ['action']
+)
+
+# Admission control (utils/admission.py); gauges are summed over live workers
+ADMISSION_IN_FLIGHT = Gauge(
+    'ml_admission_in_flight', 'Predictions currently running', multiprocess_mode='livesum'
+)
+ADMISSION_QUEUED = Gauge(
+    'ml_admission_queued', 'Predictions waiting for a slot', multiprocess_mode='livesum'
+)
+ADMISSION_REJECTIONS = Counter(
+    'ml_admission_rejections_total', 'Prediction requests turned away', ['reason']
+)
+
+# --- Uploads ---
+UPLOAD_BYTES = Counter('upload_bytes_total', 'Bytes received in uploaded files', ['endpoint'])
+UPLOAD_COUNT = Counter('uploads_total', 'Number of uploaded files', ['endpoint'])
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """pymongo command listener that records command timings"""
+
+    def __init__(self):
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        collection = event.command.get(event.command_name)
+        if not isinstance(collection, str):
+            collection = 'none'
+        with self._lock:
+            self._pending[(event.connection_id, event.request_id)] = collection
+
+    def _finish(self, event, outcome):
+        with self._lock:
+            collection = self._pending.pop((event.connection_id, event.request_id), 'none')
+        MONGO_COMMAND_LATENCY.labels(collection, event.command_name, outcome).observe(
+            event.duration_micros / 1e6
+        )
+
+    def succeeded(self, event):
+        self._finish(event, 'succeeded')
+
+    def failed(self, event):
+        self._finish(event, 'failed')
+
+
+def record_upload(num_bytes):
+    """Count an uploaded file against the current endpoint"""
+    endpoint = request.endpoint or 'unmatched'
+    UPLOAD_BYTES.labels(endpoint).inc(num_bytes)
+    UPLOAD_COUNT.labels(endpoint).inc()
+
+
+def init_metrics(app):
+    """Instrument every request and expose /api/metrics"""
+
+    @app.before_request
+    def start_timer():
+        g.request_start = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        start = g.pop('request_start', None)
+        if start is not None:
+            blueprint = request.blueprint or 'app'
+            endpoint = request.endpoint or 'unmatched'
+            REQUEST_LATENCY.labels(blueprint, endpoint, request.method).observe(time.perf_counter() - start)
+            REQUEST_COUNT.labels(blueprint, endpoint, request.method, str(response.status_code)).inc()
+        return response
+
+    @app.route('/api/metrics', methods=['GET'])
+    def metrics():
+        if METRICS_TOKEN and request.headers.get('Authorization') != f'Bearer {METRICS_TOKEN}':
+            return Response('Unauthorized\n', status=401)
+
+        if MULTIPROC_DIR:
+            registry = CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+        else:
+            registry = REGISTRY
+        return Response(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
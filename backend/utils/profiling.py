@@ -0,0 +1,157 @@
+import cProfile
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime
+from flask import g, request
+from utils.auth_utils import verify_token
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+# --- Configuration ---
+PROFILING_ENABLED = os.getenv('PROFILING_ENABLED', 'false').lower() == 'true'
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', '0.01'))
+PROFILE_DIR = os.getenv('PROFILE_DIR', 'profiles')
+PROFILE_FORMAT = os.getenv('PROFILE_FORMAT', 'cprofile')  # cprofile or collapsed
+PROFILE_MAX_FILES = int(os.getenv('PROFILE_MAX_FILES', '200'))
+PROFILE_SAMPLE_INTERVAL = float(os.getenv('PROFILE_SAMPLE_INTERVAL', '0.005'))
+# Comma-separated path prefixes, e.g. "/api/doctor/dashboard,/api/ml/predict"
+PROFILE_PATHS = [p.strip() for p in os.getenv('PROFILE_PATHS', '').split(',') if p.strip()]
+
+PROFILE_HEADER = 'X-Profile'
+PROFILE_EXTENSIONS = ('.prof', '.collapsed')
+
+# Only one profiler can be active per process (cProfile shares a global hook on 3.12+)
+_profile_lock = threading.Lock()
+
+
+class StackSampler:
+    """Sample one thread's Python stack at a fixed interval (flamegraph collapsed format)"""
+
+    def __init__(self, thread_id, interval=PROFILE_SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def enable(self):
+        self._thread.start()
+
+    def disable(self):
+        self._stop.set()
+        self._thread.join()
+
+    def dump_stats(self, path):
+        with open(path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+def _requested_by_admin():
+    """True if an admin explicitly asked for this request to be profiled"""
+    if request.headers.get(PROFILE_HEADER, '').lower() not in ('1', 'true'):
+        return False
+    token = request.headers.get('Authorization', '')
+    if token.startswith('Bearer '):
+        token = token[7:]
+    payload = verify_token(token) if token else None
+    return bool(payload and payload.get('user_type') == 'admin')
+
+
+def _should_profile():
+    if _requested_by_admin():
+        return True
+    if not PROFILING_ENABLED:
+        return False
+    if PROFILE_PATHS and not any(request.path.startswith(p) for p in PROFILE_PATHS):
+        return False
+    return random.random() < PROFILE_SAMPLE_RATE
+
+
+def _profile_filename(elapsed):
+    endpoint = re.sub(r'[^A-Za-z0-9_.-]', '_', request.endpoint or 'unmatched')
+    timestamp = datetime.utcnow().strftime('%Y%m%dT%H%M%S')
+    extension = '.collapsed' if PROFILE_FORMAT == 'collapsed' else '.prof'
+    return f"{timestamp}_{request.method}_{endpoint}_{int(elapsed * 1000)}ms_{uuid.uuid4().hex[:8]}{extension}"
+
+
+def _prune_profiles():
+    """Keep only the most recent PROFILE_MAX_FILES dumps"""
+    profiles = sorted(list_profiles(), key=lambda p: p['created_at'], reverse=True)
+    for profile in profiles[PROFILE_MAX_FILES:]:
+        try:
+            os.remove(os.path.join(PROFILE_DIR, profile['name']))
+        except OSError:
+            pass
+
+
+def list_profiles():
+    """List profile dumps in PROFILE_DIR, newest first"""
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    profiles = []
+    for name in os.listdir(PROFILE_DIR):
+        if not name.endswith(PROFILE_EXTENSIONS):
+            continue
+        stat = os.stat(os.path.join(PROFILE_DIR, name))
+        profiles.append({
+            'name': name,
+            'size': stat.st_size,
+            'created_at': datetime.utcfromtimestamp(stat.st_mtime).isoformat()
+        })
+    return sorted(profiles, key=lambda p: p['created_at'], reverse=True)
+
+
+def init_profiling(app):
+    """Profile sampled or admin-requested requests and dump them to PROFILE_DIR"""
+
+    @app.before_request
+    def start_profiler():
+        if not _should_profile() or not _profile_lock.acquire(blocking=False):
+            return
+        try:
+            if PROFILE_FORMAT == 'collapsed':
+                profiler = StackSampler(threading.get_ident())
+            else:
+                profiler = cProfile.Profile()
+            profiler.enable()
+        except Exception as e:
+            _profile_lock.release()
+            logger.exception("Error starting profiler: %s", e)
+            return
+        g.profiler = profiler
+        g.profile_start = time.perf_counter()
+
+    @app.teardown_request
+    def stop_profiler(exc=None):
+        profiler = g.pop('profiler', None)
+        if profiler is None:
+            return
+        try:
+            profiler.disable()
+            elapsed = time.perf_counter() - g.pop('profile_start')
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            profiler.dump_stats(os.path.join(PROFILE_DIR, _profile_filename(elapsed)))
+            _prune_profiles()
+        except Exception as e:
+            logger.exception("Error writing profile: %s", e)
+        finally:
+            _profile_lock.release()
@@ -0,0 +1,359 @@
+"""
+Retention and compaction job for uploaded scans.
+
+Phases, each resumable from a checkpoint in the `maintenance_state` collection:
+
+1. orphans  - uploads older than the grace period that no prediction
+              references are released; files whose reference
+              count drops to zero are deleted from the store that holds
+              them (filesystem or GridFS).
+2. archive  - files not referenced for ARCHIVE_AFTER_DAYS whose predictions
+              have all been reviewed (or that are older than
+              ARCHIVE_UNREVIEWED_AFTER_DAYS) are moved into compressed ZIP
+              bundles under UPLOAD_ARCHIVE_ROOT. The ZIP central directory is
+              the per-bundle index and `upload_blobs.archive` records the
+              bundle, so any file can be read back without unpacking the rest.
+              Filesystem store only.
+3. compact  - bundles where most members are no longer referenced are
+              rewritten with the live members only.
+
+Before the phases, cached preprocessed tensors of preprocessing versions
+other than the serving one (see utils/tensor_cache.py) are removed.
+
+Disk I/O is throttled to --max-mb-per-sec so the job does not compete with
+live traffic. Run it from cron, e.g. nightly:
+
+    python -m utils.retention --max-mb-per-sec 20
+"""
+
+import argparse
+import os
+import sys
+import time
+import zipfile
+from datetime import datetime, timedelta
+from utils.db import db_instance
+from utils.tensor_cache import TENSOR_CACHE_ROOT, TensorCache, current_version
+from utils.upload_store import (
+    ARCHIVE_ROOT, UPLOAD_ROOT, FileSystemUploadStore, GridFSUploadStore, shard_path
+)
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+ARCHIVE_AFTER_DAYS = int(os.getenv('ARCHIVE_AFTER_DAYS', '90'))
+ARCHIVE_UNREVIEWED_AFTER_DAYS = int(os.getenv('ARCHIVE_UNREVIEWED_AFTER_DAYS', '365'))
+ORPHAN_GRACE_HOURS = int(os.getenv('ORPHAN_GRACE_HOURS', '24'))
+BUNDLE_MAX_BYTES = 256 * 1024 * 1024
+BATCH_SIZE = 500
+COMPACT_DEAD_RATIO = 0.5
+STATE_ID = 'upload_retention'
+PHASES = ['orphans', 'archive', 'compact']
+
+
+class Throttle:
+    """Sleep as needed to keep I/O under a byte rate"""
+
+    def __init__(self, max_bytes_per_sec):
+        self.max_bytes_per_sec = max_bytes_per_sec
+        self.started = time.monotonic()
+        self.bytes = 0
+
+    def consume(self, num_bytes):
+        if not self.max_bytes_per_sec:
+            return
+        self.bytes += num_bytes
+        ahead = self.bytes / self.max_bytes_per_sec - (time.monotonic() - self.started)
+        if ahead > 0:
+            time.sleep(ahead)
+
+
+class RetentionJob:
+    def __init__(self, max_bytes_per_sec=20 * 1024 * 1024, dry_run=False):
+        self.store = FileSystemUploadStore()
+        self._stores = {FileSystemUploadStore.storage: self.store}
+        self.uploads = self.store.uploads
+        self.blobs = self.store.blobs
+        self.predictions = db_instance.get_collection('predictions')
+        self.state = db_instance.get_collection('maintenance_state')
+        self.throttle = Throttle(max_bytes_per_sec)
+        self.dry_run = dry_run
+        self.report = {
+            'orphans_released': 0, 'files_deleted': 0, 'files_archived': 0,
+            'bundles_written': 0, 'bundles_compacted': 0, 'bytes_reclaimed': 0,
+            'tensor_versions_pruned': 0
+        }
+        os.makedirs(ARCHIVE_ROOT, exist_ok=True)
+
+    def ensure_indexes(self):
+        self.store.ensure_indexes()
+        self.predictions.create_index('upload_id')
+        self.predictions.create_index([('content_hash', 1), ('reviewed_by_doctor', 1)])
+        self.blobs.create_index('archive.bundle', sparse=True)
+
+    # --- Checkpointing ---
+    def _load_state(self):
+        state = self.state.find_one({'_id': STATE_ID})
+        if state and state.get('phase') in PHASES:
+            logger.info("Resuming retention job at phase %s after %s", state['phase'], state.get('last_id'))
+            self.report.update(state.get('report', {}))
+            return state['phase'], state.get('last_id')
+        return PHASES[0], None
+
+    def _checkpoint(self, phase, last_id):
+        if self.dry_run:
+            return
+        self.state.update_one(
+            {'_id': STATE_ID},
+            {'$set': {'phase': phase, 'last_id': last_id, 'report': self.report, 'updated_at': datetime.utcnow()}},
+            upsert=True
+        )
+
+    def _batches(self, collection, query, last_id):
+        """Yield batches of documents in _id order starting after last_id"""
+        while True:
+            batch_query = dict(query)
+            if last_id is not None:
+                batch_query['_id'] = {'$gt': last_id}
+            batch = list(collection.find(batch_query).sort('_id', 1).limit(BATCH_SIZE))
+            if not batch:
+                return
+            yield batch
+            last_id = batch[-1]['_id']
+
+    def _store_for(self, blob):
+        """The store that holds a blob, as recorded in its `storage` field"""
+        storage = (blob or {}).get('storage', FileSystemUploadStore.storage)
+        if storage not in self._stores:
+            if storage != GridFSUploadStore.storage:
+                raise ValueError(f"Unknown upload storage {storage!r}")
+            self._stores[storage] = GridFSUploadStore()
+        return self._stores[storage]
+
+    # --- Phase 1: orphans ---
+    def release_orphans(self, last_id):
+        cutoff = datetime.utcnow() - timedelta(hours=ORPHAN_GRACE_HOURS)
+        for batch in self._batches(self.uploads, {'created_at': {'$lt': cutoff}}, last_id):
+            ids = [u['_id'] for u in batch]
+            referenced = set(self.predictions.distinct('upload_id', {'upload_id': {'$in': ids}}))
+            # Predictions stored without an upload_id only know the file by its hash
+            legacy_hashes = set(self.predictions.distinct('content_hash', {
+                'content_hash': {'$in': list({u['content_hash'] for u in batch})},
+                'upload_id': {'$exists': False}
+            }))
+
+            for upload in batch:
+                if upload['_id'] in referenced or upload['content_hash'] in legacy_hashes:
+                    continue
+                blob = self.blobs.find_one({'_id': upload['content_hash']})
+                if self.dry_run:
+                    self.report['orphans_released'] += 1
+                    continue
+                if self._store_for(blob).release(upload['_id']):
+                    self.report['orphans_released'] += 1
+                    if blob and blob.get('ref_count', 0) <= 1:
+                        self._delete_cached_tensors(upload['content_hash'])
+                        self.report['files_deleted'] += 1
+                        if not blob.get('archive'):
+                            self.report['bytes_reclaimed'] += blob.get('size', 0)
+                self.throttle.consume(4096)  # metadata work still costs I/O
+            self._checkpoint('orphans', batch[-1]['_id'])
+
+    def _delete_cached_tensors(self, content_hash):
+        """Remove cached preprocessed tensors for a deleted file, in every preprocessing version"""
+        if not os.path.isdir(TENSOR_CACHE_ROOT):
+            return
+        for version in os.listdir(TENSOR_CACHE_ROOT):
+            try:
+                os.remove(shard_path(os.path.join(TENSOR_CACHE_ROOT, version), content_hash) + '.npy')
+            except OSError:
+                pass
+
+    def prune_tensor_versions(self):
+        """Drop tensor cache directories of preprocessing versions no longer served"""
+        version = current_version()
+        if not version:
+            return  # serving version unknown; keep everything
+        if self.dry_run:
+            stale = [n for n in os.listdir(TENSOR_CACHE_ROOT)
+                     if n != version and os.path.isdir(os.path.join(TENSOR_CACHE_ROOT, n))]
+        else:
+            stale = TensorCache(version).prune_stale_versions()
+        if stale:
+            logger.info("Pruned tensor cache versions: %s", ', '.join(stale))
+        self.report['tensor_versions_pruned'] += len(stale)
+
+    # --- Phase 2: archive ---
+    def archive_old(self, last_id):
+        now = datetime.utcnow()
+        query = {
+            'storage': 'filesystem',
+            'archive': {'$exists': False},
+            'last_referenced_at': {'$lt': now - timedelta(days=ARCHIVE_AFTER_DAYS)}
+        }
+        unreviewed_cutoff = now - timedelta(days=ARCHIVE_UNREVIEWED_AFTER_DAYS)
+
+        for batch in self._batches(self.blobs, query, last_id):
+            hashes = [b['_id'] for b in batch]
+            awaiting_review = set(self.predictions.distinct(
+                'content_hash', {'content_hash': {'$in': hashes}, 'reviewed_by_doctor': False}
+            ))
+            candidates = [
+                b for b in batch
+                if b['_id'] not in awaiting_review or b['last_referenced_at'] < unreviewed_cutoff
+            ]
+            if candidates:
+                self._write_bundle(candidates)
+            self._checkpoint('archive', batch[-1]['_id'])
+
+    def _bundle_name(self):
+        return f"bundle-{datetime.utcnow().strftime('%Y%m%dT%H%M%S')}-{os.getpid()}-{self.report['bundles_written']}.zip"
+
+    def _write_bundle(self, blobs):
+        """Pack live files into one or more bundles, then drop the live copies"""
+        pending = []
+        pending_bytes = 0
+        for blob in blobs:
+            path = self.store.path(blob['_id'])
+            if not os.path.exists(path):
+                continue
+            pending.append(blob)
+            pending_bytes += blob.get('size', 0)
+            if pending_bytes >= BUNDLE_MAX_BYTES:
+                self._flush_bundle(pending)
+                pending, pending_bytes = [], 0
+        if pending:
+            self._flush_bundle(pending)
+
+    def _flush_bundle(self, blobs):
+        if self.dry_run:
+            self.report['files_archived'] += len(blobs)
+            return
+
+        name = self._bundle_name()
+        bundle_path = os.path.join(ARCHIVE_ROOT, name)
+        tmp_path = bundle_path + '.partial'
+        with zipfile.ZipFile(tmp_path, 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=9) as bundle:
+            for blob in blobs:
+                bundle.write(self.store.path(blob['_id']), arcname=blob['_id'])
+                self.throttle.consume(blob.get('size', 0))
+        with open(tmp_path, 'rb') as f:
+            os.fsync(f.fileno())
+        os.replace(tmp_path, bundle_path)
+        bundle_size = os.path.getsize(bundle_path)
+
+        archived_at = datetime.utcnow()
+        for blob in blobs:
+            result = self.blobs.update_one(
+                {'_id': blob['_id'], 'archive': {'$exists': False}},
+                {'$set': {'archive': {'bundle': name, 'archived_at': archived_at}}}
+            )
+            if result.modified_count:
+                try:
+                    os.remove(self.store.path(blob['_id']))
+                except FileNotFoundError:
+                    pass
+        original_size = sum(b.get('size', 0) for b in blobs)
+        self.report['files_archived'] += len(blobs)
+        self.report['bundles_written'] += 1
+        self.report['bytes_reclaimed'] += max(original_size - bundle_size, 0)
+
+    # --- Phase 3: compact ---
+    def compact_bundles(self, last_name):
+        names = sorted(n for n in os.listdir(ARCHIVE_ROOT) if n.endswith('.zip'))
+        for name in names:
+            if last_name is not None and name <= last_name:
+                continue
+            bundle_path = os.path.join(ARCHIVE_ROOT, name)
+            live = {b['_id'] for b in self.blobs.find({'archive.bundle': name}, {'_id': 1})}
+            with zipfile.ZipFile(bundle_path) as bundle:
+                members = bundle.namelist()
+
+            if not live:
+                if not self.dry_run:
+                    size = os.path.getsize(bundle_path)
+                    os.remove(bundle_path)
+                    self.report['bytes_reclaimed'] += size
+                self.report['bundles_compacted'] += 1
+            elif 1 - len(live) / max(len(members), 1) >= COMPACT_DEAD_RATIO:
+                self._rewrite_bundle(name, live)
+            self._checkpoint('compact', name)
+
+    def _rewrite_bundle(self, name, live):
+        if self.dry_run:
+            self.report['bundles_compacted'] += 1
+            return
+
+        bundle_path = os.path.join(ARCHIVE_ROOT, name)
+        new_name = self._bundle_name()
+        new_path = os.path.join(ARCHIVE_ROOT, new_name)
+        old_size = os.path.getsize(bundle_path)
+        with zipfile.ZipFile(bundle_path) as src, \
+                zipfile.ZipFile(new_path + '.partial', 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=9) as dst:
+            for member in live:
+                with src.open(member) as data:
+                    content = data.read()
+                dst.writestr(member, content)
+                self.throttle.consume(len(content))
+        os.replace(new_path + '.partial', new_path)
+
+        self.blobs.update_many(
+            {'_id': {'$in': list(live)}, 'archive.bundle': name},
+            {'$set': {'archive.bundle': new_name}}
+        )
+        os.remove(bundle_path)
+        self.report['bundles_compacted'] += 1
+        self.report['bundles_written'] += 1
+        self.report['bytes_reclaimed'] += max(old_size - os.path.getsize(new_path), 0)
+
+    def run(self):
+        """Run (or resume) all phases and return the report"""
+        started = time.monotonic()
+        self.ensure_indexes()
+        phase, last_id = self._load_state()
+        self.prune_tensor_versions()
+
+        for current in PHASES[PHASES.index(phase):]:
+            logger.info("Retention job phase: %s", current)
+            if current == 'orphans':
+                self.release_orphans(last_id)
+            elif current == 'archive':
+                self.archive_old(last_id)
+            else:
+                self.compact_bundles(last_id)
+            last_id = None
+            next_index = PHASES.index(current) + 1
+            if next_index < len(PHASES):
+                self._checkpoint(PHASES[next_index], None)
+
+        if not self.dry_run:
+            self.state.update_one(
+                {'_id': STATE_ID},
+                {'$set': {'phase': None, 'last_id': None, 'last_report': self.report,
+                          'finished_at': datetime.utcnow()},
+                 '$unset': {'report': ''}},
+                upsert=True
+            )
+        self.report['duration_seconds'] = round(time.monotonic() - started, 1)
+        return self.report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Archive, deduplicate and compact uploaded scans")
+    parser.add_argument('--max-mb-per-sec', type=float, default=20, help="I/O budget (0 = unthrottled)")
+    parser.add_argument('--dry-run', action='store_true', help="Report what would be done without changing anything")
+    args = parser.parse_args(argv)
+
+    if not db_instance.connect():
+        return 1
+    logger.info("Running retention job on %s", UPLOAD_ROOT)
+    report = RetentionJob(int(args.max_mb_per_sec * 1024 * 1024), args.dry_run).run()
+    logger.info("Retention job finished: %s", report)
+    print(f"Reclaimed {report['bytes_reclaimed'] / 1024 / 1024:.1f} MB "
+          f"({report['files_deleted']} files deleted, {report['files_archived']} archived, "
+          f"{report['bundles_compacted']} bundles compacted) in {report['duration_seconds']}s")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,103 @@
+"""
+Cache of preprocessed model inputs stored as .npy files next to the uploads.
+
+Each upload's preprocessed tensor (224x224x3 float32 for VGG16) is written
+once, keyed by the upload's content hash, and later loaded zero-copy with
+np.load(mmap_mode='r'). Files live under a directory named after the
+preprocessing version, so changing the preprocessing invalidates the whole
+cache at once. The serving version is recorded in a CURRENT file so the
+retention job (utils/retention.py) can remove the other directories with
+prune_stale_versions() without importing the model code.
+"""
+
+import os
+import shutil
+import tempfile
+import numpy as np
+from utils.upload_store import shard_path
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+TENSOR_CACHE_ROOT = os.getenv('TENSOR_CACHE_ROOT', 'uploads/tensors')
+TENSOR_CACHE_ENABLED = os.getenv('TENSOR_CACHE_ENABLED', 'true').lower() == 'true'
+CURRENT_VERSION_FILE = 'CURRENT'
+
+
+def current_version(root=TENSOR_CACHE_ROOT):
+    """Preprocessing version last recorded by the serving processes, or None"""
+    try:
+        with open(os.path.join(root, CURRENT_VERSION_FILE)) as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+class TensorCache:
+    """Memory-mapped .npy store keyed by content hash and preprocessing version"""
+
+    def __init__(self, version, root=TENSOR_CACHE_ROOT):
+        self.version = version
+        self.root = root
+        self.version_root = os.path.join(root, version)
+
+    def path(self, content_hash):
+        return shard_path(self.version_root, content_hash) + '.npy'
+
+    def mark_current(self):
+        """Record this version as the one in use (read by current_version())"""
+        os.makedirs(self.root, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            f.write(self.version)
+        os.replace(tmp_path, os.path.join(self.root, CURRENT_VERSION_FILE))
+
+    def get(self, content_hash):
+        """Read-only memory-mapped tensor, or None if not cached"""
+        path = self.path(content_hash)
+        if not os.path.exists(path):
+            return None
+        try:
+            return np.load(path, mmap_mode='r')
+        except Exception as e:
+            # Truncated or corrupt file; drop it so it is rebuilt
+            logger.warning("Discarding unreadable cached tensor %s: %s", path, e)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+
+    def put(self, content_hash, array):
+        """Write a tensor atomically (readers never see a partial file)"""
+        path = self.path(content_hash)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.save(f, np.ascontiguousarray(array, dtype=np.float32))
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return path
+
+    def delete(self, content_hash):
+        try:
+            os.remove(self.path(content_hash))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def prune_stale_versions(self):
+        """Remove cache directories written by other preprocessing versions"""
+        if not os.path.isdir(self.root):
+            return []
+        removed = []
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if name != self.version and os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+                removed.append(name)
+        return removed
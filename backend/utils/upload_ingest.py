@@ -0,0 +1,182 @@
+"""
+Streaming ingestion of image uploads.
+
+Reads the request body in chunks instead of letting Werkzeug buffer the whole
+multipart form. The image type and dimensions are checked from the first
+bytes so bad input is rejected before the rest of the body is read, and every
+chunk goes straight into an upload store writer, which hashes it on the way.
+"""
+
+import io
+import os
+from flask import request
+from PIL import Image
+from werkzeug.sansio.multipart import Data, Epilogue, File, MultipartDecoder, NeedData
+from utils.upload_store import CHUNK_SIZE
+
+IMAGE_MIN_DIM = int(os.getenv('IMAGE_MIN_DIM', '32'))
+IMAGE_MAX_DIM = int(os.getenv('IMAGE_MAX_DIM', '8192'))
+# Give up reading the header after this many bytes (large EXIF blocks come before JPEG SOF)
+HEADER_LIMIT = 256 * 1024
+
+IMAGE_SIGNATURES = [
+    (b'\xff\xd8\xff', 'JPEG'),
+    (b'\x89PNG\r\n\x1a\n', 'PNG'),
+    (b'GIF87a', 'GIF'),
+    (b'GIF89a', 'GIF'),
+    (b'BM', 'BMP'),
+    (b'II*\x00', 'TIFF'),
+    (b'MM\x00*', 'TIFF'),
+]
+
+
+class UploadRejected(Exception):
+    """Upload failed validation; carries the HTTP status to return"""
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
+def sniff_format(head):
+    """Image format from magic bytes, or None"""
+    for signature, image_format in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return image_format
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'WEBP'
+    return None
+
+
+class ImageHeaderValidator:
+    """Collects the first bytes of an upload until its header can be validated"""
+
+    def __init__(self):
+        self.head = bytearray()
+        self.validated = False
+        self.format = None
+        self.width = None
+        self.height = None
+
+    def feed(self, chunk):
+        if self.validated:
+            return
+        self.head += chunk[:HEADER_LIMIT - len(self.head)]
+
+        if len(self.head) >= 12 and self.format is None:
+            self.format = sniff_format(bytes(self.head))
+            if self.format is None:
+                raise UploadRejected('Unsupported file type. Please upload a JPEG, PNG, GIF, BMP, TIFF or WEBP image', 415)
+        if self.format is None:
+            return
+
+        try:
+            with Image.open(io.BytesIO(bytes(self.head))) as img:
+                self.width, self.height = img.size
+        except Exception:
+            if len(self.head) >= HEADER_LIMIT:
+                raise UploadRejected('Could not read image header')
+            return  # header not complete yet
+
+        if min(self.width, self.height) < IMAGE_MIN_DIM:
+            raise UploadRejected(f'Image too small. Minimum size: {IMAGE_MIN_DIM}x{IMAGE_MIN_DIM} pixels')
+        if max(self.width, self.height) > IMAGE_MAX_DIM:
+            raise UploadRejected(f'Image too large. Maximum size: {IMAGE_MAX_DIM}x{IMAGE_MAX_DIM} pixels')
+        self.validated = True
+        self.head = bytearray()
+
+    def finish(self):
+        if not self.validated:
+            raise UploadRejected('Uploaded file is not a valid image')
+
+
+def _read_chunks():
+    """Request body in chunks (request.stream enforces MAX_CONTENT_LENGTH)"""
+    while True:
+        chunk = request.stream.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        yield chunk
+
+
+def _multipart_file_parts(field_name):
+    """
+    Yield ('file', filename, content_type) when the wanted file field starts,
+    then ('data', bytes) for its content; other fields are skipped.
+    """
+    boundary = request.mimetype_params.get('boundary')
+    if not boundary:
+        raise UploadRejected('Missing multipart boundary')
+
+    decoder = MultipartDecoder(boundary.encode('latin-1'))
+    in_file = False
+    found = False
+    chunks = _read_chunks()
+    ended = False
+    while True:
+        try:
+            event = decoder.next_event()
+        except ValueError:
+            raise UploadRejected('Malformed multipart body')
+        if isinstance(event, NeedData):
+            if ended:
+                raise UploadRejected('Incomplete multipart body')
+            chunk = next(chunks, None)
+            ended = chunk is None
+            decoder.receive_data(chunk)
+        elif isinstance(event, File):
+            in_file = event.name == field_name and not found
+            if in_file:
+                found = True
+                yield 'file', event.filename, event.headers.get('Content-Type')
+        elif isinstance(event, Data):
+            if in_file:
+                yield 'data', event.data
+                if not event.more_data:
+                    return  # stop reading as soon as the file part ends
+        elif isinstance(event, Epilogue):
+            return
+        else:
+            in_file = False
+
+
+def ingest_image_upload(store, field_name='image', uploaded_by=None):
+    """
+    Stream an image upload from the current request into `store`.
+    Accepts multipart/form-data (file in `field_name`) or a raw image body
+    (filename in the X-Filename header). Returns the upload document.
+    """
+    if request.mimetype == 'multipart/form-data':
+        parts = _multipart_file_parts(field_name)
+        first = next(parts, None)
+        if first is None:
+            raise UploadRejected('No image uploaded')
+        _, filename, content_type = first
+        data = (part[1] for part in parts)
+    elif request.mimetype.startswith('image/') or request.mimetype == 'application/octet-stream':
+        filename = request.headers.get('X-Filename') or request.args.get('filename') or 'upload'
+        content_type = request.mimetype
+        data = _read_chunks()
+    else:
+        raise UploadRejected('Expected multipart/form-data or an image body', 415)
+
+    if not filename:
+        raise UploadRejected('No file selected')
+
+    validator = ImageHeaderValidator()
+    writer = store.begin(filename)
+    try:
+        for chunk in data:
+            validator.feed(chunk)
+            writer.write(chunk)
+        validator.finish()
+    except Exception:
+        writer.abort()
+        raise
+
+    upload = store.commit(writer, os.path.basename(filename), content_type, uploaded_by)
+    upload['image_format'] = validator.format
+    upload['width'] = validator.width
+    upload['height'] = validator.height
+    return upload
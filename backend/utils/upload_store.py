@@ -0,0 +1,423 @@
+"""
+Content-addressed storage for uploaded files.
+
+Files are named by the SHA-256 of their content, so identical uploads are
+stored once. Content is hashed while it is written (see BlobWriter), so an
+upload can be streamed straight to its storage location. `upload_blobs` holds one document per stored file with a
+reference count; `uploads` holds one document per upload with the original
+filename. Two backends share that metadata layout:
+
+- FileSystemUploadStore: files live under UPLOAD_ROOT, sharded into nested
+  directories by hash prefix (ab/cd/abcd...), so no directory grows huge.
+- GridFSUploadStore: files live in a GridFS bucket; the blob document maps
+  the hash to the GridFS file id.
+"""
+
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+import zipfile
+from datetime import datetime
+from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from utils.db import db_instance
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+UPLOAD_ROOT = os.getenv('UPLOAD_ROOT', 'uploads/mri_images')
+UPLOAD_STORAGE = os.getenv('UPLOAD_STORAGE', 'filesystem')  # filesystem or gridfs
+GRIDFS_BUCKET = os.getenv('UPLOAD_GRIDFS_BUCKET', 'mri_images')
+# Compressed bundles of old uploads written by the retention job (utils/retention.py)
+ARCHIVE_ROOT = os.getenv('UPLOAD_ARCHIVE_ROOT', 'uploads/archive')
+CHUNK_SIZE = 1024 * 1024
+SHARD_DEPTH = 2  # two levels of two hex characters: 65,536 leaf directories
+# How long a commit waits for a concurrent deletion of the same content to finish
+DELETE_WAIT_SECONDS = 10
+
+
+def shard_path(root, content_hash):
+    """Nested path for a content hash, e.g. root/ab/cd/abcd..."""
+    parts = [content_hash[i * 2:i * 2 + 2] for i in range(SHARD_DEPTH)]
+    return os.path.join(root, *parts, content_hash)
+
+
+class BlobWriter:
+    """Incrementally hashes and writes one upload to its storage location"""
+
+    def __init__(self):
+        self.digest = hashlib.sha256()
+        self.size = 0
+
+    @property
+    def content_hash(self):
+        return self.digest.hexdigest()
+
+    def write(self, chunk):
+        self.digest.update(chunk)
+        self.size += len(chunk)
+        self._write(chunk)
+
+    def _write(self, chunk):
+        raise NotImplementedError
+
+    def close(self):
+        """Finish writing; returns fields to store on a newly created blob document"""
+        return {}
+
+    def finish(self, blob):
+        """Keep or discard the written data once the blob document is known"""
+        raise NotImplementedError
+
+    def abort(self):
+        raise NotImplementedError
+
+
+class UploadStore:
+    """Reference-counted, content-addressed upload storage (metadata in MongoDB)"""
+
+    storage = None
+
+    # Looked up on every use: stores may be created at import, possibly in the
+    # Gunicorn master, and must use each worker's own MongoClient
+    @property
+    def uploads(self):
+        return db_instance.get_collection('uploads')
+
+    @property
+    def blobs(self):
+        return db_instance.get_collection('upload_blobs')
+
+    def ensure_indexes(self):
+        """Indexes, plus the directory uploads are written to before they are committed"""
+        self.uploads.create_index('content_hash')
+        os.makedirs(os.path.join(UPLOAD_ROOT, '.tmp'), exist_ok=True)
+
+    # --- Backend hooks ---
+    def begin(self, original_filename=None):
+        """Start writing a new upload; returns a BlobWriter"""
+        raise NotImplementedError
+
+    def _delete_blob(self, blob):
+        raise NotImplementedError
+
+    def open(self, content_hash):
+        """Open a stored file for reading"""
+        raise NotImplementedError
+
+    def local_path(self, content_hash):
+        """Path to a local copy of the file (for libraries that need a filename)"""
+        raise NotImplementedError
+
+    # --- Shared logic ---
+    def _add_reference(self, content_hash, size, content_type, blob_fields):
+        """Count one more reference to a blob, creating its document if needed"""
+        deadline = time.monotonic() + DELETE_WAIT_SECONDS
+        while True:
+            try:
+                return self._upsert_reference(content_hash, size, content_type, blob_fields)
+            except DuplicateKeyError:
+                # The blob is being deleted (see _delete_unreferenced); once its
+                # document is gone the upsert creates a fresh one
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.05)
+
+    def _upsert_reference(self, content_hash, size, content_type, blob_fields):
+        return self.blobs.find_one_and_update(
+            {'_id': content_hash, 'deleting': {'$ne': True}},
+            {
+                '$inc': {'ref_count': 1},
+                '$set': {'last_referenced_at': datetime.utcnow()},
+                '$setOnInsert': {
+                    'size': size,
+                    'content_type': content_type,
+                    'storage': self.storage,
+                    'created_at': datetime.utcnow(),
+                    **blob_fields
+                }
+            },
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+
+    def commit(self, writer, original_filename, content_type=None, uploaded_by=None):
+        """
+        Finish a written upload and record it.
+        Returns the upload document, with `duplicate` set if the content was already stored.
+        """
+        blob = None
+        finished = False
+        try:
+            blob_fields = writer.close()
+            blob = self._add_reference(writer.content_hash, writer.size, content_type, blob_fields)
+            writer.finish(blob)
+            finished = True
+
+            upload_doc = {
+                'content_hash': writer.content_hash,
+                'original_filename': original_filename,
+                'content_type': content_type,
+                'size': writer.size,
+                'uploaded_by': ObjectId(uploaded_by) if uploaded_by else None,
+                'created_at': datetime.utcnow()
+            }
+            result = self.uploads.insert_one(upload_doc)
+        except Exception:
+            if not finished:
+                writer.abort()
+            if blob is not None:
+                # No upload document points at the reference taken above
+                self._drop_reference(writer.content_hash)
+            raise
+
+        upload_doc['_id'] = result.inserted_id
+        upload_doc['duplicate'] = blob['ref_count'] > 1
+        return upload_doc
+
+    def save(self, stream, original_filename, content_type=None, uploaded_by=None):
+        """Store a file-like object in one go"""
+        writer = self.begin(original_filename)
+        try:
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                writer.write(chunk)
+        except Exception:
+            writer.abort()
+            raise
+        return self.commit(writer, original_filename, content_type, uploaded_by)
+
+    def get_upload(self, upload_id):
+        """Get upload metadata by ID"""
+        try:
+            return self.uploads.find_one({'_id': ObjectId(upload_id)})
+        except Exception as e:
+            logger.exception("Error getting upload: %s", e)
+            return None
+
+    def release(self, upload_id):
+        """Drop an upload; the stored file is deleted when no upload references it"""
+        try:
+            upload = self.uploads.find_one_and_delete({'_id': ObjectId(upload_id)})
+            if not upload:
+                return False
+
+            self._drop_reference(upload['content_hash'])
+            return True
+        except Exception as e:
+            logger.exception("Error releasing upload: %s", e)
+            return False
+
+    def _drop_reference(self, content_hash):
+        blob = self.blobs.find_one_and_update(
+            {'_id': content_hash},
+            {'$inc': {'ref_count': -1}},
+            return_document=ReturnDocument.AFTER
+        )
+        if blob and blob['ref_count'] <= 0:
+            self._delete_unreferenced(content_hash)
+
+    def _delete_unreferenced(self, content_hash):
+        """
+        Delete a blob nobody references. It is marked `deleting` first, so a
+        concurrent commit of the same content cannot take a reference to the
+        file being removed; that commit waits until the document is gone and
+        then stores the content afresh.
+        """
+        blob = self.blobs.find_one_and_update(
+            {'_id': content_hash, 'ref_count': {'$lte': 0}, 'deleting': {'$ne': True}},
+            {'$set': {'deleting': True}},
+            return_document=ReturnDocument.AFTER
+        )
+        if not blob:
+            return  # referenced again, or another caller is deleting it
+        try:
+            self._delete_blob(blob)
+        except Exception:
+            self.blobs.update_one({'_id': content_hash}, {'$unset': {'deleting': ''}})
+            raise
+        self.blobs.delete_one({'_id': content_hash, 'deleting': True})
+
+
+class _FileBlobWriter(BlobWriter):
+    """Writes to a temp file on the same filesystem, renamed into place on finish"""
+
+    def __init__(self, store):
+        super().__init__()
+        self.store = store
+        fd, self.tmp_path = tempfile.mkstemp(dir=os.path.join(UPLOAD_ROOT, '.tmp'))
+        self.file = os.fdopen(fd, 'wb')
+
+    def _write(self, chunk):
+        self.file.write(chunk)
+
+    def close(self):
+        self.file.close()
+        return {}
+
+    def finish(self, blob):
+        path = self.store.path(self.content_hash)
+        if os.path.exists(path):
+            os.remove(self.tmp_path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(self.tmp_path, path)  # atomic; concurrent writers of the same hash write the same bytes
+
+    def abort(self):
+        self.file.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+
+class FileSystemUploadStore(UploadStore):
+    """Content-addressed files in a sharded directory tree"""
+
+    storage = 'filesystem'
+
+    def path(self, content_hash):
+        return shard_path(UPLOAD_ROOT, content_hash)
+
+    def begin(self, original_filename=None):
+        return _FileBlobWriter(self)
+
+    def _delete_blob(self, blob):
+        try:
+            os.remove(self.path(blob['_id']))
+        except FileNotFoundError:
+            pass
+
+    def _restore(self, content_hash):
+        """Bring an archived file back from its bundle into the live tree"""
+        blob = self.blobs.find_one({'_id': content_hash}, {'archive': 1})
+        if not blob or not blob.get('archive'):
+            raise FileNotFoundError(content_hash)
+
+        path = self.path(content_hash)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.join(UPLOAD_ROOT, '.tmp'))
+        bundle_path = os.path.join(ARCHIVE_ROOT, blob['archive']['bundle'])
+        with os.fdopen(fd, 'wb') as tmp, zipfile.ZipFile(bundle_path) as bundle, bundle.open(content_hash) as src:
+            shutil.copyfileobj(src, tmp, CHUNK_SIZE)
+        os.replace(tmp_path, path)
+
+        # The file is live again; its bundle copy is left for compaction
+        self.blobs.update_one({'_id': content_hash}, {'$unset': {'archive': ''}})
+        logger.info("Restored archived upload %s", content_hash)
+        return path
+
+    def open(self, content_hash):
+        return open(self.local_path(content_hash), 'rb')
+
+    def local_path(self, content_hash):
+        path = self.path(content_hash)
+        if not os.path.exists(path):
+            return self._restore(content_hash)
+        return path
+
+
+class _GridFSBlobWriter(BlobWriter):
+    """Streams chunks straight into GridFS; duplicates are deleted on finish"""
+
+    def __init__(self, bucket, original_filename):
+        super().__init__()
+        self.bucket = bucket
+        self.grid_in = bucket.open_upload_stream(original_filename or 'upload')
+
+    def _write(self, chunk):
+        self.grid_in.write(chunk)
+
+    def close(self):
+        self.grid_in.close()
+        return {'file_id': self.grid_in._id}
+
+    def finish(self, blob):
+        if blob['file_id'] != self.grid_in._id:
+            # Content already stored under another GridFS file
+            self.bucket.delete(self.grid_in._id)
+
+    def abort(self):
+        self.grid_in.abort()
+
+
+class GridFSUploadStore(UploadStore):
+    """Content-addressed files in a GridFS bucket, cached locally on read"""
+
+    storage = 'gridfs'
+
+    cache_root = os.path.join(UPLOAD_ROOT, '.gridfs_cache')
+
+    @property
+    def bucket(self):
+        import gridfs
+
+        # Through a collection, so the database handle is this process's
+        return gridfs.GridFSBucket(self.blobs.database, bucket_name=GRIDFS_BUCKET)
+
+    def begin(self, original_filename=None):
+        return _GridFSBlobWriter(self.bucket, original_filename)
+
+    def _file_id(self, content_hash):
+        blob = self.blobs.find_one({'_id': content_hash}, {'file_id': 1})
+        if not blob:
+            raise FileNotFoundError(content_hash)
+        return blob['file_id']
+
+    def _delete_blob(self, blob):
+        import gridfs
+
+        try:
+            self.bucket.delete(blob['file_id'])
+        except gridfs.errors.NoFile:
+            pass
+        try:
+            os.remove(shard_path(self.cache_root, blob['_id']))
+        except FileNotFoundError:
+            pass
+
+    def open(self, content_hash):
+        return self.bucket.open_download_stream(self._file_id(content_hash))
+
+    def local_path(self, content_hash):
+        path = shard_path(self.cache_root, content_hash)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(fd, 'wb') as tmp, self.open(content_hash) as src:
+                shutil.copyfileobj(src, tmp, CHUNK_SIZE)
+            os.replace(tmp_path, path)
+        return path
+
+
+def get_upload_store():
+    """Create the upload store configured by UPLOAD_STORAGE"""
+    if UPLOAD_STORAGE == 'gridfs':
+        return GridFSUploadStore()
+    return FileSystemUploadStore()
+
+
+def migrate_flat_uploads(store):
+    """Move legacy `<uuid>_<filename>` files from the flat UPLOAD_ROOT into the store"""
+    migrated = 0
+    for name in os.listdir(UPLOAD_ROOT):
+        path = os.path.join(UPLOAD_ROOT, name)
+        # Legacy files are top-level; shard directories and hidden work dirs are skipped
+        if name.startswith('.') or not os.path.isfile(path):
+            continue
+        original_filename = name.split('_', 1)[1] if '_' in name else name
+        with open(path, 'rb') as f:
+            store.save(f, original_filename)
+        os.remove(path)
+        migrated += 1
+    return migrated
+
+
+if __name__ == '__main__':
+    store = get_upload_store()
+    store.ensure_indexes()
+    count = migrate_flat_uploads(store)
+    logger.info("Migrated %d legacy uploads into the %s store", count, UPLOAD_STORAGE)
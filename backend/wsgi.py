@@ -0,0 +1,33 @@
+"""
+WSGI entry point for production servers.
+
+The Keras model is imported here so a pre-forking server that preloads this
+module (see gunicorn.conf.py) loads the weights once in the master process and
+workers share them copy-on-write. The Flask app itself - and with it the
+MongoDB client - is only created inside each worker, because MongoClient is
+not fork-safe. With PRELOAD_MODEL=0 Gunicorn imports this module in each
+worker instead, and every worker loads its own copy of the model.
+"""
+
+# Load the model in the master before fork
+import models.ml_model  # noqa: F401
+
+_app = None
+
+
+def init_worker():
+    """Create the Flask app (and MongoDB client) inside a worker process"""
+    global _app
+    from app import create_app
+
+    _app = create_app()
+    if _app is None:
+        raise RuntimeError("Failed to create application!")
+    return _app
+
+
+def app(environ, start_response):
+    """WSGI callable that builds the Flask app lazily on first request"""
+    if _app is None:
+        init_worker()
+    return _app(environ, start_response)
@@ -1,6 +1,6 @@
-import React, { useState, useEffect } from "react";
+import React, { useState, useEffect, useRef } from "react";
 import { toast } from "react-toastify";
-import { adminService } from "../utils/auth";
+import { adminService, subscribeToEvents } from "../utils/auth";
 
 const AdminDashboard = () => {
   const [dashboardData, setDashboardData] = useState(null);
@@ -8,6 +8,7 @@ const AdminDashboard = () => {
   const [modalType, setModalType] = useState(null);
   const [modalData, setModalData] = useState([]);
   const [searchTerm, setSearchTerm] = useState("");
+  const [nextCursor, setNextCursor] = useState(null);
   const [doctorForm, setDoctorForm] = useState({
     first_name: "",
     last_name: "",
@@ -23,6 +24,38 @@ const AdminDashboard = () => {
     fetchDashboardData();
   }, []);
 
+  // Apply pushed changes to the counters instead of reloading the dashboard
+  useEffect(() => {
+    const bump = (section, changes) =>
+      setDashboardData((data) => {
+        if (!data) return data;
+        const updated = { ...data[section] };
+        Object.entries(changes).forEach(([key, delta]) => {
+          updated[key] = (updated[key] || 0) + delta;
+        });
+        return { ...data, [section]: updated };
+      });
+
+    return subscribeToEvents({
+      "appointment.created": () => bump("appointments", { total: 1, pending: 1 }),
+      "appointment.status": ({ previous_status, status }) => {
+        if (previous_status === "pending" && status !== "pending") {
+          bump("appointments", { pending: -1 });
+        }
+      },
+      "prediction.created": ({ prediction }) =>
+        bump("predictions", {
+          total_predictions: 1,
+          pending_review: 1,
+          [prediction === "notumor" ? "no_tumor_count" : "tumor_count"]: 1,
+        }),
+      "prediction.reviewed": ({ was_pending }) => {
+        if (was_pending) bump("predictions", { pending_review: -1 });
+      },
+      resync: () => fetchDashboardData(),
+    });
+  }, []);
+
   // Fetch dashboard stats
   const fetchDashboardData = async () => {
     try {
@@ -70,29 +103,55 @@ const AdminDashboard = () => {
     }
   };
 
+  // Doctors and patients are searched on the server, one page at a time
+  const isUserModal = (type) => type === "doctors" || type === "patients";
+
+  // Only the latest request may fill the list; an earlier, slower one is dropped
+  const latestSearch = useRef(0);
+
+  // Returns false if the search failed
+  const searchUsers = async (type, term, cursor = null) => {
+    const request = ++latestSearch.current;
+    const result = await adminService.searchUsers({
+      q: term,
+      type: type.slice(0, -1),
+      match: term.length >= 3 ? "contains" : "prefix",
+      cursor,
+    });
+    if (request !== latestSearch.current) return true;
+    if (!result.success) {
+      toast.error(result.error);
+      return false;
+    }
+    setModalData((data) => (cursor ? [...data, ...result.data] : result.data));
+    setNextCursor(result.nextCursor);
+    return true;
+  };
+
+  // Re-run the search as the admin types
+  useEffect(() => {
+    if (!isUserModal(modalType)) return;
+    const timer = setTimeout(() => searchUsers(modalType, searchTerm.trim()), 300);
+    return () => clearTimeout(timer);
+  }, [searchTerm]); // eslint-disable-line react-hooks/exhaustive-deps
+
   // Generic modal fetch for doctors or patients
   const openModal = async (type) => {
     setModalType(type);
     setSearchTerm(""); // reset search input
+    setNextCursor(null);
     try {
-      let data = [];
-      if (type === "doctors") {
-        const result = await adminService.getDoctors();
-        if (result.success) data = result.data;
-        else return toast.error(result.error);
-      } else if (type === "patients") {
-        const result = await adminService.getPatients();
-        if (result.success) data = result.data;
-        else return toast.error(result.error);
+      if (isUserModal(type)) {
+        if (!(await searchUsers(type, ""))) return;
       } else {
-        // For appointments or predictions
+        // For appointments or predictions; a user search still in flight must not replace them
+        latestSearch.current += 1;
         const res = await fetch(`/api/admin/${type}`, {
           headers: { Authorization: `Bearer ${localStorage.getItem("token")}` },
         });
         const result = await res.json();
-        data = result.data || [];
+        setModalData(result.data || []);
       }
-      setModalData(data);
       new window.bootstrap.Modal(document.getElementById("dataModal")).show();
     } catch (err) {
       toast.error(`Failed to fetch ${type}`);
@@ -127,13 +186,15 @@ const AdminDashboard = () => {
     }
   };
 
-  // Filtered data for search
-  const filteredData = modalData.filter((item) =>
-    Object.values(item)
-      .join(" ")
-      .toLowerCase()
-      .includes(searchTerm.toLowerCase())
-  );
+  // Filtered data for search (doctors and patients are already filtered by the server)
+  const filteredData = isUserModal(modalType)
+    ? modalData
+    : modalData.filter((item) =>
+        Object.values(item)
+          .join(" ")
+          .toLowerCase()
+          .includes(searchTerm.toLowerCase())
+      );
 
   if (loading) {
     return (
@@ -480,6 +541,16 @@ const AdminDashboard = () => {
                       ))}
                     </tbody>
                   </table>
+                  {nextCursor && (
+                    <button
+                      className="btn btn-outline-primary btn-sm"
+                      onClick={() =>
+                        searchUsers(modalType, searchTerm.trim(), nextCursor)
+                      }
+                    >
+                      Load more
+                    </button>
+                  )}
                 </div>
               ) : (
                 <p>No data available</p>
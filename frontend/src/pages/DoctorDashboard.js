@@ -1,6 +1,35 @@
-import React from 'react';
+import React, { useState, useEffect } from 'react';
+import { toast } from 'react-toastify';
+import { subscribeToEvents } from '../utils/auth';
 
 const DoctorDashboard = () => {
+  const [liveUpdates, setLiveUpdates] = useState([]);
+
+  // This dashboard has no live data yet, so pushed events are shown as notices
+  useEffect(() => {
+    const notify = (message, { quiet = false } = {}) => {
+      if (!quiet) toast.info(message);
+      setLiveUpdates((updates) =>
+        [
+          { id: Date.now() + Math.random(), time: new Date().toLocaleTimeString(), message },
+          ...updates,
+        ].slice(0, 5)
+      );
+    };
+
+    return subscribeToEvents({
+      'appointment.created': ({ appointment_date, time_slot, priority }) =>
+        notify(`New ${priority} appointment request for ${appointment_date} at ${time_slot}`),
+      'appointment.status': ({ appointment_date, time_slot, status }) =>
+        notify(`Appointment on ${appointment_date} at ${time_slot} is now ${status}`),
+      'prediction.created': ({ prediction, confidence }) =>
+        notify(`New AI prediction to review: ${prediction} (${Math.round(confidence)}%)`),
+      'prediction.reviewed': () => notify('A prediction was reviewed', { quiet: true }),
+      'prediction.claimed': () => notify('A doctor started reviewing a case', { quiet: true }),
+      'prediction.released': () => notify('A case is back in the review queue', { quiet: true }),
+    });
+  }, []);
+
   return (
     <div>
       <div className="d-flex justify-content-between align-items-center mb-4">
@@ -145,6 +174,28 @@ const DoctorDashboard = () => {
         </div>
 
         <div className="col-lg-4">
+          {/* Live Updates */}
+          {liveUpdates.length > 0 && (
+            <div className="card border-0 shadow-sm mb-4">
+              <div className="card-header bg-secondary text-white">
+                <h5 className="mb-0">
+                  <i className="fas fa-bell me-2"></i>
+                  Live Updates
+                </h5>
+              </div>
+              <div className="card-body">
+                <ul className="list-unstyled small mb-0">
+                  {liveUpdates.map((update) => (
+                    <li key={update.id} className="mb-2">
+                      <span className="text-muted me-2">{update.time}</span>
+                      {update.message}
+                    </li>
+                  ))}
+                </ul>
+              </div>
+            </div>
+          )}
+
           <div className="card border-0 shadow-sm mb-4">
             <div className="card-header bg-success text-white">
               <h5 className="mb-0">
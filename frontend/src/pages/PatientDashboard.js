@@ -1,4 +1,6 @@
 import React, { useState, useEffect } from "react";
+import { toast } from "react-toastify";
+import { subscribeToEvents } from "../utils/auth";
 
 const PatientDashboard = () => {
   const healthTips = [
@@ -43,6 +45,34 @@ const PatientDashboard = () => {
     const randomIndex = Math.floor(Math.random() * healthTips.length);
     setDailyTip(healthTips[randomIndex]);
   }, []);
+
+  const [liveUpdates, setLiveUpdates] = useState([]);
+
+  // This dashboard has no live data yet, so pushed events are shown as notices
+  useEffect(() => {
+    const notify = (message, { quiet = false } = {}) => {
+      if (!quiet) toast.info(message);
+      setLiveUpdates((updates) =>
+        [
+          { id: Date.now() + Math.random(), time: new Date().toLocaleTimeString(), message },
+          ...updates,
+        ].slice(0, 5)
+      );
+    };
+
+    return subscribeToEvents({
+      "appointment.status": ({ appointment_date, time_slot, status }) =>
+        notify(`Your appointment on ${appointment_date} at ${time_slot} is now ${status}`),
+      "prediction.created": ({ prediction }) =>
+        notify(`MRI analysis complete: ${prediction}. A doctor will review it.`),
+      "prediction.reviewed": ({ was_pending }) =>
+        notify(
+          was_pending
+            ? "A doctor has reviewed your MRI scan"
+            : "A doctor has updated the review of your MRI scan"
+        ),
+    });
+  }, []);
   return (
     <div>
       <div className="d-flex justify-content-between align-items-center mb-4">
@@ -228,6 +258,28 @@ const PatientDashboard = () => {
 
         {/* Sidebar - Quick Actions & Info */}
         <div className="col-lg-4">
+          {/* Live Updates */}
+          {liveUpdates.length > 0 && (
+            <div className="card border-0 shadow-sm mb-4">
+              <div className="card-header bg-secondary text-white">
+                <h5 className="mb-0">
+                  <i className="fas fa-bell me-2"></i>
+                  Live Updates
+                </h5>
+              </div>
+              <div className="card-body">
+                <ul className="list-unstyled small mb-0">
+                  {liveUpdates.map((update) => (
+                    <li key={update.id} className="mb-2">
+                      <span className="text-muted me-2">{update.time}</span>
+                      {update.message}
+                    </li>
+                  ))}
+                </ul>
+              </div>
+            </div>
+          )}
+
           {/* Next Appointment */}
           <div className="card border-0 shadow-sm mb-4">
             <div className="card-header bg-info text-white">
@@ -178,6 +178,25 @@ export const adminService = {
     }
   },
 
+  // Search doctors/patients on the server (paginated by cursor)
+  async searchUsers({ q = "", type, match = "prefix", cursor, limit = 50 }) {
+    try {
+      const response = await api.get("/admin/users/search", {
+        params: { q, type, match, cursor, limit },
+      });
+      return {
+        success: true,
+        data: response.data.users,
+        nextCursor: response.data.next_cursor,
+      };
+    } catch (error) {
+      return {
+        success: false,
+        error: error.response?.data?.error || "Failed to search users",
+      };
+    }
+  },
+
   // Get all appointments
   async getAppointments() {
     try {
@@ -472,4 +491,54 @@ export const mlService = {
   },
 };
 
+// Server-sent events for the logged-in user (see backend routes/events.py).
+// handlers maps event types (e.g. "appointment.status") to callbacks taking the
+// event data; "resync" means events were dropped and the view should refetch.
+// Returns a function that closes the stream.
+export const subscribeToEvents = (handlers) => {
+  if (!localStorage.getItem("token") || typeof EventSource === "undefined") {
+    return () => {};
+  }
+  let source = null;
+  let retryTimer = null;
+  let lastEventId = null;
+  let closed = false;
+
+  const retry = () => {
+    if (!closed) retryTimer = setTimeout(connect, 5000);
+  };
+
+  // EventSource cannot send the Authorization header, so each connection uses
+  // a fresh short-lived ticket and resumes from the last event received
+  const connect = async () => {
+    try {
+      const response = await api.post("/events/ticket");
+      if (closed) return;
+      const params = new URLSearchParams({ ticket: response.data.ticket });
+      if (lastEventId) params.set("last_event_id", lastEventId);
+      source = new EventSource(`${API_BASE_URL}/events/stream?${params}`);
+      Object.entries(handlers).forEach(([type, handler]) => {
+        source.addEventListener(type, (event) => {
+          if (event.lastEventId) lastEventId = event.lastEventId;
+          handler(JSON.parse(event.data));
+        });
+      });
+      // The browser would reconnect with the same, by then expired, ticket
+      source.onerror = () => {
+        source.close();
+        retry();
+      };
+    } catch (error) {
+      retry();
+    }
+  };
+
+  connect();
+  return () => {
+    closed = true;
+    clearTimeout(retryTimer);
+    if (source) source.close();
+  };
+};
+
 export default api;